@@ -0,0 +1,190 @@
+"""
+向量化组合回测
+输入日期×股票的复权日线面板（开盘价、收盘价、成交量）和同形状的信号矩阵，逐日模拟A股交易：
+- 第t日收盘后的信号（目标权重）在第t+1日开盘价成交，当日买入的股票最早下一交易日卖出（T+1）
+- 开盘涨停不能买入，开盘跌停不能卖出，涨跌停价按前一日收盘价计算（四舍五入到分）
+- 停牌（无日线或成交量为0）不能交易，按停牌前的收盘价计算市值
+- 按手（100股）成交，佣金双向收取且有最低佣金，印花税只在卖出时收取
+- 先卖后买，现金不足时按比例减少买入
+
+按日期循环，每日对全部股票向量化计算，5000只股票×20年数秒完成
+
+例如
+panel = load_data.load_panel(["open", "close", "vol"], start="2010-01-01")
+signal = panel["close"] > tdx_ta_func.MA(panel["close"], 20)
+result = backtest.run(panel, signal)
+backtest.summary(result)
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def limit_ratio(codes):
+    """
+    各股票的涨跌停幅度：创业板、科创板20%，北交所30%，其余10%
+    未区分ST股票（5%）
+    :param codes: list 股票代码
+    :return np.ndarray
+    """
+    ratio = np.full(len(codes), 0.1)
+    for i, code in enumerate(codes):
+        if code.startswith(("300", "301", "688", "689")):
+            ratio[i] = 0.2
+        elif code.startswith(("4", "8", "92")):
+            ratio[i] = 0.3
+    return ratio
+
+
+def _weights(signal):
+    """
+    信号转为目标权重：bool为等权，数值为权重，nan为0；每日权重合计超过1时按比例缩小
+    """
+    weights = np.asarray(signal)
+    if weights.dtype == bool:
+        weights = weights.astype(np.float64)
+        count = weights.sum(axis=1, keepdims=True)
+        np.divide(weights, count, out=weights, where=count > 0)
+    else:
+        weights = np.nan_to_num(weights.astype(np.float64), nan=0.0)
+        total = np.abs(weights).sum(axis=1, keepdims=True)
+        np.divide(weights, total, out=weights, where=total > 1)
+    return np.clip(weights, 0, None)
+
+
+def _limit_price(prev_close, ratio):
+    """涨跌停价，四舍五入到分，加上1e-6避免浮点误差使x.xx5向下舍入"""
+    return np.floor(prev_close * ratio * 100 + 0.5 + 1e-6) / 100
+
+
+def _commission(value, rate, minimum):
+    """成交金额value的佣金，未成交为0"""
+    return np.where(value > 0, np.maximum(value * rate, minimum), 0.0)
+
+
+def run(
+    panel,
+    signal,
+    capital=1e6,
+    commission=0.00025,
+    min_commission=5.0,
+    stamp_duty=0.0005,
+    lot=100,
+    limit=None,
+):
+    """
+    回测
+    :param panel: dict {列名: DataFrame}，须有open close，有vol时成交量为0视为停牌，见load_data.load_panel
+    :param signal: DataFrame 与面板同形状，第t日的目标权重（bool为等权持有），第t+1日开盘成交
+    :param capital: float 初始资金
+    :param commission: float 佣金费率
+    :param min_commission: float 每笔最低佣金
+    :param stamp_duty: float 卖出印花税率
+    :param lot: int 每手股数
+    :param limit: float或np.ndarray 各股票涨跌停幅度，为None时按股票代码，见limit_ratio
+    :return DataFrame index为日期，columns: equity cash returns turnover cost drawdown positions
+    """
+    open_ = panel["open"].to_numpy(dtype=np.float64)
+    close = panel["close"].to_numpy(dtype=np.float64)
+    index = panel["close"].index
+    codes = [str(code) for code in panel["close"].columns]
+    weights = _weights(signal)
+    limit = limit_ratio(codes) if limit is None else np.broadcast_to(limit, len(codes))
+
+    tradable = ~np.isnan(open_)
+    if "vol" in panel:
+        tradable &= panel["vol"].to_numpy() > 0
+    # 停牌时按之前的收盘价计算市值
+    last_close = pd.DataFrame(close).ffill().to_numpy()
+    prev_close = np.full_like(last_close, np.nan)
+    prev_close[1:] = last_close[:-1]
+    with np.errstate(invalid="ignore"):
+        limit_up = open_ >= _limit_price(prev_close, 1 + limit) - 1e-6
+        limit_down = open_ <= _limit_price(prev_close, 1 - limit) + 1e-6
+    price = np.where(tradable, open_, prev_close)
+
+    dates, symbols = close.shape
+    shares = np.zeros(symbols)
+    cash = float(capital)
+    equity = np.empty(dates)
+    cash_series = np.empty(dates)
+    turnover = np.zeros(dates)
+    cost = np.zeros(dates)
+    positions = np.zeros(dates, dtype=np.int64)
+    previous = float(capital)
+    for t in range(dates):
+        if t > 0:
+            can = tradable[t]
+            p = np.where(can, price[t], 0.0)
+            held = np.nan_to_num(price[t] * shares)
+            value = cash + held.sum()
+            target = (
+                np.floor(value * weights[t - 1] / np.where(can, p, 1.0) / lot) * lot
+            )
+            delta = np.where(can, target - shares, 0.0)
+            sell = np.where((delta < 0) & ~limit_down[t], -delta, 0.0)
+            buy = np.where((delta > 0) & ~limit_up[t], delta, 0.0)
+
+            sell_value = sell * p
+            sell_cost = _commission(sell_value, commission, min_commission)
+            sell_cost += sell_value * stamp_duty
+            cash += sell_value.sum() - sell_cost.sum()
+            shares -= sell
+
+            buy_value = buy * p
+            buy_cost = _commission(buy_value, commission, min_commission)
+            need = buy_value.sum() + buy_cost.sum()
+            if need > cash:
+                # 佣金随成交金额单调不减，按未缩减时的佣金计算比例，缩减后不会超过现金
+                total = buy_value.sum()
+                ratio = max(cash - buy_cost.sum(), 0.0) / total if total else 0.0
+                buy = np.floor(buy * min(ratio, 1.0) / lot) * lot
+                buy_value = buy * p
+                buy_cost = _commission(buy_value, commission, min_commission)
+            cash -= buy_value.sum() + buy_cost.sum()
+            shares += buy
+
+            cost[t] = sell_cost.sum() + buy_cost.sum()
+            turnover[t] = (sell_value.sum() + buy_value.sum()) / previous
+        equity[t] = cash + np.nan_to_num(last_close[t] * shares).sum()
+        cash_series[t] = cash
+        positions[t] = np.count_nonzero(shares)
+        previous = equity[t]
+
+    result = pd.DataFrame(
+        {
+            "equity": equity,
+            "cash": cash_series,
+            "returns": np.r_[equity[0] / capital, equity[1:] / equity[:-1]] - 1,
+            "turnover": turnover,
+            "cost": cost,
+            "drawdown": equity / np.maximum.accumulate(equity) - 1,
+            "positions": positions,
+        },
+        index=index,
+    )
+    result.index.name = "date"
+    return result
+
+
+def summary(result, periods=242):
+    """
+    回测结果统计
+    :param result: DataFrame run的返回值
+    :param periods: int 每年交易日数
+    :return dict total_return annual_return volatility sharpe max_drawdown turnover cost
+    """
+    returns = result["returns"]
+    years = returns.shape[0] / periods
+    total = (1 + returns).prod()
+    volatility = returns.std() * np.sqrt(periods)
+    return {
+        "total_return": total - 1,
+        "annual_return": total ** (1 / years) - 1 if years else 0.0,
+        "volatility": volatility,
+        "sharpe": returns.mean() * periods / volatility if volatility else 0.0,
+        "max_drawdown": result["drawdown"].min(),
+        # 年化换手率
+        "turnover": result["turnover"].sum() / years if years else 0.0,
+        "cost": result["cost"].sum(),
+    }
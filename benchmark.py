@@ -0,0 +1,503 @@
+"""
+性能基准测试套件
+使用随机生成的数据（见testdata），统计各热点函数的耗时和峰值内存，结果追加到历史文件（每行一个json），可与上一次结果比较
+python benchmark.py [--size small|medium|large] [--bars N] [--symbols N] [--files N]
+                    [--history 文件] [--compare] [--threshold 0.2] [--baseline]
+--compare时耗时或峰值内存超过上一次同规模结果的(1+threshold)倍视为退化，有退化时退出码为1
+--baseline时不运行套件，比较新实现与原实现、参照实现（见testdata）的耗时，不写历史文件
+与原实现、参照实现的一致性见tests
+"""
+
+import os
+import json
+import contextlib
+import functools
+import importlib.util
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import tdx_data_func
+import gbbq_store
+import cw_store
+import tdx_mapping
+import load_data
+from testdata import (
+    SCREEN_CONDITION,
+    SCREEN_FORMULA,
+    gen_cw,
+    gen_gbbq,
+    gen_market,
+    gen_panel,
+    gen_store,
+    momentum_top,
+    lday_to_csv_reference,
+    qfq_reference,
+    hhv_reference,
+    llv_reference,
+    barslast_reference,
+    barslastcount_reference,
+    valuewhen_reference,
+    count_reference,
+    ta_cases,
+)
+
+
+def timeit(func, repeat=3):
+    """返回多次执行的最短耗时（秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        cost = time.perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    return best
+
+
+# 基准测试套件的数据规模
+# bars: 每只股票的日线条数  symbols: 面板和财务文件的股票数  files: 日线文件数
+SUITE_SIZES = {
+    "small": {"bars": 1000, "symbols": 100, "files": 20},
+    "medium": {"bars": 5000, "symbols": 1000, "files": 200},
+    "large": {"bars": 10000, "symbols": 5000, "files": 1000},
+}
+
+# 基准测试历史文件，每次运行追加一行json
+SUITE_HISTORY = (
+    os.path.dirname(os.path.abspath(__file__)) + os.sep + "benchmark_history.jsonl"
+)
+
+# 基准测试套件使用临时目录的数据路径（cfg.ProcessedDataPath的属性），复权因子表另外设置
+SUITE_PATHS = [
+    "tdx_lday_bin",
+    "tdx_lday_qfq_bin",
+    "tdx_lday_period",
+    "tdx_cw_cube",
+    "ta_cache",
+]
+
+
+def measure(func, repeat=3):
+    """
+    计时并统计峰值内存
+    计时与统计内存分开执行，tracemalloc的开销不计入耗时
+    :return (最短耗时秒, 峰值内存MB)
+    """
+    import tracemalloc
+
+    seconds = timeit(func, repeat=repeat)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak / 2**20
+
+
+def suite_cases(bars, symbols, files, tmp):
+    """
+    生成基准测试套件的数据，返回各热点函数的测试用例
+    :param tmp: str 临时目录，数据生成在其中
+    :return list (名称, 函数, 重复次数)
+    """
+    import backtest
+    import screener
+    import ta_cache
+    import tdx_ta_func as ta
+    import tdx_ta_stream as stream
+    import tdx_formula
+    import xline
+
+    paths = cfg.ProcessedDataPath
+    src = tmp + os.sep + "src"
+    csv = tmp + os.sep + "csv"
+    for name in SUITE_PATHS:
+        setattr(paths, name, tmp + os.sep + name)
+    paths.tdx_lday_factor = tmp + os.sep + "factor.bin"
+    for p in [src, csv, paths.tdx_lday_qfq_bin]:
+        os.mkdir(p)
+    codes = [f"{i:06d}" for i in range(files)]
+    names = ["sz" + code + ".day" for code in codes]
+    df_gbbq = gen_store(codes, rows=bars, src=src)
+    df_xrxd = tdx_data_func.group_xrxd(df_gbbq)
+    df_gbbq_all = gen_gbbq([f"{i:06d}" for i in range(symbols)], events=20)
+    df_gbbq_all["类别"] = 1
+    gbbq_records = gbbq_store.to_records(df_gbbq_all)
+    gbbq_path = tmp + os.sep + "gbbq.bin"
+    gbbq_store.save(gbbq_records, gbbq_path)
+    cw_paths = []
+    for year in range(2020, 2024):
+        cw_paths.append(tmp + os.sep + f"gpcw{year}1231.dat")
+        gen_cw(cw_paths[-1], shares=symbols, seed=year, date=year * 10000 + 1231)
+    headers = [tdx_data_func.load_cw_header(path) for path in cw_paths]
+    cw_store.reserve(
+        np.concatenate([h[1] for h in headers]), max(h[2] for h in headers)
+    )
+    for path in cw_paths:
+        with open(path, "rb") as f:
+            cw_store.put(*tdx_data_func.parse_cw_dat(f.read()))
+    finance_fields = [field for field in tdx_mapping.finance_mapping if field != 0]
+
+    def convert(func, dst):
+        for name in names:
+            func(src=src, dst=dst, file_name=name)
+
+    def indicators():
+        return [ta_cache.indicator(c, ta.HHV, n) for c in codes for n in [20, 60]]
+
+    indicators()
+    cases = [
+        ("lday_to_csv", lambda: convert(tdx_data_func.lday_to_csv, csv), 1),
+        (
+            "lday_to_store",
+            lambda: convert(tdx_data_func.lday_to_store, paths.tdx_lday_bin),
+            1,
+        ),
+        (
+            "backward_adjust",
+            lambda: tdx_data_func.backward_adjust(paths.tdx_lday_bin, df_gbbq),
+            1,
+        ),
+        (
+            "calc_factors",
+            lambda: tdx_data_func.calc_factors(df_xrxd, paths.tdx_lday_bin),
+            1,
+        ),
+        ("load_line_day", lambda: [load_data.load_line_day(c) for c in codes], 3),
+        (
+            "load_line_day/last_n",
+            lambda: [load_data.load_line_day(c, last_n=60) for c in codes],
+            3,
+        ),
+        ("load_panel", lambda: load_data.load_panel(["close"]), 3),
+        ("ta_cache/hit", indicators, 3),
+        (
+            "update_period_stores",
+            lambda: xline.update_period_stores(full=True),
+            1,
+        ),
+        (
+            "screen",
+            lambda: screener.screen(SCREEN_CONDITION, last_n=250, workers=1),
+            1,
+        ),
+        ("gbbq_to_frame", lambda: gbbq_store.to_frame(gbbq_records), 3),
+        (
+            "gbbq_records_of",
+            lambda: [gbbq_store.records_of(c, gbbq_path, "除权除息") for c in codes],
+            3,
+        ),
+        ("load_cw_dat", lambda: tdx_data_func.load_cw_dat(cw_paths[-1]), 3),
+        ("cw_store_load", lambda: cw_store.load(finance_fields, "1231"), 3),
+    ]
+
+    # 单只股票的序列和全市场面板
+    panel = gen_panel(bars, symbols)
+    series = panel.iloc[:, 0]
+    up = panel > ta.REF(panel, 1)
+    funcs = [
+        ("SMA", lambda x, c: ta.SMA(x, 20)),
+        ("REF", lambda x, c: ta.REF(x, 5)),
+        ("HHV", lambda x, c: ta.HHV(x, 20)),
+        ("LLV", lambda x, c: ta.LLV(x, 0)),
+        ("CROSS", lambda x, c: ta.CROSS(x, ta.REF(x, 5))),
+        ("COUNT", lambda x, c: ta.COUNT(c, 20)),
+        ("EVERY", lambda x, c: ta.EVERY(c, 5)),
+        ("BARSLAST", lambda x, c: ta.BARSLAST(c)),
+        ("BARSLASTCOUNT", lambda x, c: ta.BARSLASTCOUNT(c)),
+        ("VALUEWHEN", lambda x, c: ta.VALUEWHEN(c, x)),
+    ]
+    for name, func in funcs:
+        if name != "SMA" or importlib.util.find_spec("talib") is not None:
+            cases.append(
+                (f"ta/{name}", functools.partial(func, series, up.iloc[:, 0]), 10)
+            )
+        cases.append((f"panel/{name}", functools.partial(func, panel, up), 1))
+    formula = tdx_formula.compile_formula(SCREEN_FORMULA)
+    data = {
+        "close": panel,
+        "high": panel * 1.02,
+        "low": panel * 0.98,
+        "vol": panel * 0 + 10**6,
+    }
+    cases.append(("formula/screen", lambda: formula(data), 1))
+
+    # 增量指标：收盘后全市场追加一天
+    values = panel.to_numpy()
+    items = [stream.SMA(20), stream.HHV(20), stream.COUNT(20)]
+    for item in items[:2]:
+        item.extend(values[:-1])
+    items[2].extend(up.to_numpy()[:-1])
+    last = [values[-1], values[-1], up.to_numpy()[-1]]
+    cases.append(
+        (
+            "stream/update",
+            lambda: [item.update(value) for item, value in zip(items, last)],
+            10,
+        )
+    )
+
+    market = gen_market(bars, symbols)
+    signal = momentum_top(market["close"])
+    cases.append(("backtest/run", lambda: backtest.run(market, signal), 1))
+    return cases
+
+
+@contextlib.contextmanager
+def suite_tmp():
+    """
+    数据路径（SUITE_PATHS和复权因子表）指向临时目录并关闭日线缓存，结束后恢复并删除临时目录
+    统计的是日线读取本身的耗时，关闭日线缓存，与加入缓存前的历史结果可比
+    :return str 临时目录
+    """
+    import ta_cache
+
+    tmp = tempfile.mkdtemp()
+    paths = cfg.ProcessedDataPath
+    saved = {name: getattr(paths, name) for name in SUITE_PATHS + ["tdx_lday_factor"]}
+    saved_size = cfg.line_day_cache_memory
+    try:
+        cfg.line_day_cache_memory = 0
+        load_data.clear_line_day_cache()
+        yield tmp
+    finally:
+        for name, path in saved.items():
+            setattr(paths, name, path)
+        cfg.line_day_cache_memory = saved_size
+        load_data.clear_line_day_cache()
+        ta_cache.clear()
+        shutil.rmtree(tmp)
+
+
+def run_suite(
+    size="small", history=SUITE_HISTORY, compare=False, threshold=0.2, **sizes
+):
+    """
+    基准测试套件：生成指定规模的数据，统计各热点函数的耗时和峰值内存，追加到历史文件
+    :param size: str 规模，见SUITE_SIZES，sizes中的bars symbols files可覆盖
+    :param history: str 历史文件路径
+    :param compare: bool 与历史文件中同规模的上一次结果比较
+    :param threshold: float 耗时或峰值内存超过上一次的(1+threshold)倍时视为退化
+    :return list 退化的项目
+    """
+    params = dict(SUITE_SIZES[size])
+    params.update({k: v for k, v in sizes.items() if v is not None})
+    results = dict()
+    with suite_tmp() as tmp:
+        for name, func, repeat in suite_cases(tmp=tmp, **params):
+            seconds, peak = measure(func, repeat)
+            results[name] = {"seconds": round(seconds, 6), "peak_mb": round(peak, 3)}
+            print(f"{name:<24} {seconds * 1000:>10.2f}ms {peak:>10.1f}MB")
+
+    import platform
+
+    run = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "size": size,
+        "params": params,
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "results": results,
+    }
+    regressions = []
+    if compare:
+        previous = load_history(history, size, params)
+        if previous is None:
+            print("历史文件中没有同规模的结果，不比较")
+        else:
+            regressions = compare_runs(previous, run, threshold)
+    with open(history, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run, ensure_ascii=False) + "\n")
+    return regressions
+
+
+def baseline_cases(bars, symbols, files, tmp):
+    """
+    新实现与原实现、参照实现的耗时比较用例：日线解码、前复权、单只股票的TA函数、全市场面板一次计算与逐只计算
+    :param tmp: str 临时目录，数据生成在其中
+    :return list (名称, 新实现, 原实现, 重复次数)
+    """
+    import tdx_ta_func as ta
+
+    paths = cfg.ProcessedDataPath
+    src = tmp + os.sep + "src"
+    csv = tmp + os.sep + "csv"
+    for name in SUITE_PATHS:
+        setattr(paths, name, tmp + os.sep + name)
+    paths.tdx_lday_factor = tmp + os.sep + "factor.bin"
+    for p in [src, csv, paths.tdx_lday_qfq_bin]:
+        os.mkdir(p)
+    codes = [f"{i:06d}" for i in range(files)]
+    names = ["sz" + code + ".day" for code in codes]
+    df_gbbq = gen_store(codes, rows=bars, src=src)
+
+    def convert(func):
+        for name in names:
+            func(src=src, dst=csv, file_name=name)
+
+    cases = [
+        (
+            "lday_to_csv",
+            lambda: convert(tdx_data_func.lday_to_csv),
+            lambda: convert(lday_to_csv_reference),
+            1,
+        ),
+        (
+            "backward_adjust",
+            lambda: tdx_data_func.backward_adjust(paths.tdx_lday_bin, df_gbbq),
+            # 参照实现读取日线后在内存中复权，不写入前复权存储
+            lambda: [
+                qfq_reference(load_data.load_line_day(c, adjust="none"), df_gbbq, c)
+                for c in codes
+            ],
+            1,
+        ),
+    ]
+
+    _, price, cond = ta_cases(bars)[0]
+    funcs = [
+        ("HHV(0)", ta.HHV, lambda p, c, n: hhv_reference(p, n), 0),
+        ("HHV(20)", ta.HHV, lambda p, c, n: hhv_reference(p, n), 20),
+        ("LLV(20)", ta.LLV, lambda p, c, n: llv_reference(p, n), 20),
+        ("COUNT(20)", None, lambda p, c, n: count_reference(c, n), 20),
+        ("BARSLAST", None, lambda p, c, n: barslast_reference(c), 0),
+        ("BARSLASTCOUNT", None, lambda p, c, n: barslastcount_reference(c), 0),
+        ("VALUEWHEN", None, lambda p, c, n: valuewhen_reference(c, p), 0),
+    ]
+    new = {
+        "COUNT(20)": lambda p, c, n: ta.COUNT(c, n),
+        "BARSLAST": lambda p, c, n: ta.BARSLAST(c),
+        "BARSLASTCOUNT": lambda p, c, n: ta.BARSLASTCOUNT(c),
+        "VALUEWHEN": lambda p, c, n: ta.VALUEWHEN(c, p),
+    }
+    for name, func, reference, n in funcs:
+        func = new.get(name, lambda p, c, n, func=func: func(p, n))
+        cases.append(
+            (
+                f"ta/{name}",
+                functools.partial(func, price, cond, n),
+                functools.partial(reference, price, cond, n),
+                3,
+            )
+        )
+
+    # 全市场面板一次计算 vs 逐只股票计算
+    panel = gen_panel(bars, symbols)
+    up = panel > ta.REF(panel, 1)
+    for name, func in [
+        ("HHV(20)", lambda x, c: ta.HHV(x, 20)),
+        ("COUNT(20)", lambda x, c: ta.COUNT(c, 20)),
+        ("BARSLAST", lambda x, c: ta.BARSLAST(c)),
+        ("VALUEWHEN", lambda x, c: ta.VALUEWHEN(c, x)),
+    ]:
+        cases.append(
+            (
+                f"panel/{name}",
+                functools.partial(func, panel, up),
+                lambda func=func: [func(panel[c], up[c]) for c in panel.columns],
+                1,
+            )
+        )
+    return cases
+
+
+def run_baseline(size="small", **sizes):
+    """
+    新实现与原实现、参照实现的耗时比较，打印各项的耗时和提速倍数
+    :param size: str 规模，见SUITE_SIZES，sizes中的bars symbols files可覆盖
+    :return dict {名称: (新实现耗时秒, 原实现耗时秒)}
+    """
+    params = dict(SUITE_SIZES[size])
+    params.update({k: v for k, v in sizes.items() if v is not None})
+    results = dict()
+    with suite_tmp() as tmp:
+        for name, func, reference, repeat in baseline_cases(tmp=tmp, **params):
+            new, old = timeit(func, repeat), timeit(reference, repeat)
+            results[name] = (new, old)
+            print(
+                f"{name:<24} {new * 1000:>10.2f}ms {old * 1000:>10.2f}ms {old / new:>8.1f}倍"
+            )
+    return results
+
+
+def load_history(history, size, params):
+    """
+    历史文件中同规模的最后一次结果
+    :return dict 没有时为None
+    """
+    if not os.path.exists(history):
+        return None
+    previous = None
+    with open(history, encoding="utf-8") as f:
+        for line in f:
+            run = json.loads(line)
+            if run["size"] == size and run["params"] == params:
+                previous = run
+    return previous
+
+
+def compare_runs(previous, current, threshold=0.2):
+    """
+    比较两次结果，耗时或峰值内存超过上一次的(1+threshold)倍时视为退化
+    耗时小于1ms的项目误差较大，只在超过1ms时比较耗时
+    :return list (名称, 指标, 上一次, 本次)
+    """
+    regressions = []
+    print(
+        f"与{previous['time']}（pandas {previous['pandas']}, numpy {previous['numpy']}）比较:"
+    )
+    for name, result in current["results"].items():
+        old = previous["results"].get(name)
+        if old is None:
+            continue
+        for key in ["seconds", "peak_mb"]:
+            if key == "seconds" and max(old[key], result[key]) < 0.001:
+                continue
+            ratio = result[key] / old[key] if old[key] else 1.0
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = " 退化"
+                regressions.append((name, key, old[key], result[key]))
+            if key == "seconds" or flag:
+                print(
+                    f"{name:<24} {key:<8} {old[key]:>12.4f} -> {result[key]:>12.4f} {ratio:>6.2f}倍{flag}"
+                )
+    if regressions:
+        print(f"共{len(regressions)}项退化超过{threshold:.0%}")
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="benchmark.py")
+    parser.add_argument("--size", choices=list(SUITE_SIZES), default="small")
+    parser.add_argument("--bars", type=int)
+    parser.add_argument("--symbols", type=int)
+    parser.add_argument("--files", type=int)
+    parser.add_argument("--history", default=SUITE_HISTORY)
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--baseline", action="store_true")
+    options = parser.parse_args()
+    if options.baseline:
+        run_baseline(
+            options.size,
+            bars=options.bars,
+            symbols=options.symbols,
+            files=options.files,
+        )
+        sys.exit(0)
+    options = vars(options)
+    options.pop("baseline")
+    regressions = run_suite(**options)
+    sys.exit(1 if regressions else 0)
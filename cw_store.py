@@ -0,0 +1,220 @@
+"""
+专业财务数据立方体存储
+全部报告期的财务数据保存为一个float32立方体文件，维度为 (报告期, 字段, 股票)，读取时np.memmap映射
+同一报告期同一字段的全部股票连续存放，按字段和报告期筛选时只读取需要的部分
+
+目录结构
+cube.bin: float32 财务数据，shape为(报告期数, 字段数, 股票容量)，不存在的数据为nan
+mask.bin: uint8 股票在该报告期是否有数据，shape为(报告期数, 股票容量)
+codes.bin: S6 股票代码，长度为股票容量，未使用的位置为空
+reports.bin: int32 报告期，如20221231，按写入顺序。最后写入，作为新报告期写入完成的标志
+fields.bin: int32 字段数
+
+股票容量按CAPACITY_STEP预留，新股票或新字段超出容量时重建立方体，否则只追加或原地覆盖
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+
+# 股票容量的增长步长
+CAPACITY_STEP = 1024
+
+
+def _paths(root):
+    root = cfg.ProcessedDataPath.tdx_cw_cube if root is None else root
+    return {
+        name: root + os.sep + name + ".bin"
+        for name in ["cube", "mask", "codes", "reports", "fields"]
+    }
+
+
+def files(root=None):
+    """立方体的全部文件路径，用于判断财务数据是否变化（见snapshot）"""
+    return list(_paths(root).values())
+
+
+def _read(root):
+    """
+    读取立方体的维度信息
+    :return (报告期数组, 股票代码数组, 字段数)，立方体不存在时为空
+    """
+    paths = _paths(root)
+    if not os.path.exists(paths["reports"]):
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype="S6"), 0
+    reports = np.fromfile(paths["reports"], dtype=np.int32)
+    codes = np.fromfile(paths["codes"], dtype="S6")
+    fields = int(np.fromfile(paths["fields"], dtype=np.int32)[0])
+    return reports, codes, fields
+
+
+def reports(root=None):
+    """
+    已保存的报告期，升序
+    :return list int
+    """
+    return sorted(_read(root)[0].tolist())
+
+
+def memmap(root=None, mode="r"):
+    """
+    映射立方体
+    :return (cube, mask, codes, reports)，立方体不存在时返回None
+    """
+    report, codes, fields = _read(root)
+    if report.shape[0] == 0:
+        return None
+    paths = _paths(root)
+    shape = (report.shape[0], fields, codes.shape[0])
+    cube = np.memmap(paths["cube"], dtype="<f4", mode=mode, shape=shape)
+    mask = np.memmap(paths["mask"], dtype=np.uint8, mode=mode, shape=shape[::2])
+    return cube, mask, codes, report
+
+
+def reserve(codes, fields, root=None):
+    """
+    预留股票容量和字段数，超出时重建立方体
+    批量写入前调用，避免逐个报告期写入时多次重建
+    :param codes: 将要写入的股票代码
+    :param fields: int 将要写入的最大字段数
+    :return np.ndarray 扩充后的股票代码数组
+    """
+    root = cfg.ProcessedDataPath.tdx_cw_cube if root is None else root
+    report, old_codes, old_fields = _read(root)
+    used = old_codes[old_codes != b""]
+    new_codes = np.setdiff1d(np.asarray(codes, dtype="S6"), used)
+    if new_codes.shape[0] == 0 and fields <= old_fields:
+        return old_codes
+
+    # 已有股票的位置不变，新股票依次填入空位
+    capacity = used.shape[0] + new_codes.shape[0]
+    capacity = -(-capacity // CAPACITY_STEP) * CAPACITY_STEP
+    codes = np.zeros(capacity, dtype="S6")
+    codes[: used.shape[0]] = used
+    codes[used.shape[0] : used.shape[0] + new_codes.shape[0]] = new_codes
+    fields = max(fields, old_fields)
+    if capacity == old_codes.shape[0] and fields == old_fields:
+        # 容量足够，只需更新股票代码
+        _write_codes(root, codes)
+        return codes
+
+    # 逐个报告期复制到新立方体，再整体替换
+    tmp = root + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.mkdir(tmp)
+    paths = _paths(tmp)
+    old = memmap(root)
+    with open(paths["cube"], "wb") as f_cube, open(paths["mask"], "wb") as f_mask:
+        for i in range(report.shape[0]):
+            cube = np.full((fields, capacity), np.nan, dtype="<f4")
+            mask = np.zeros(capacity, dtype=np.uint8)
+            cube[:old_fields, : old_codes.shape[0]] = old[0][i]
+            mask[: old_codes.shape[0]] = old[1][i]
+            cube.tofile(f_cube)
+            mask.tofile(f_mask)
+    del old
+    codes.tofile(paths["codes"])
+    np.array([fields], dtype=np.int32).tofile(paths["fields"])
+    report.tofile(paths["reports"])
+
+    if os.path.exists(root):
+        os.replace(root, root + ".old")
+    os.replace(tmp, root)
+    if os.path.exists(root + ".old"):
+        shutil.rmtree(root + ".old")
+    return codes
+
+
+def _write_codes(root, codes):
+    path = _paths(root)["codes"]
+    codes.tofile(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def put(date, codes, data, root=None):
+    """
+    写入一个报告期的财务数据，报告期已存在时原地覆盖，否则追加
+    :param date: int 报告期，如20221231
+    :param codes: np.ndarray 股票代码
+    :param data: np.ndarray float32 财务数据，shape为(股票数, 字段数)
+    """
+    root = cfg.ProcessedDataPath.tdx_cw_cube if root is None else root
+    all_codes = reserve(codes, data.shape[1], root)
+    report, _, fields = _read(root)
+
+    # 股票代码在立方体中的位置
+    order = np.argsort(all_codes)
+    pos = order[np.searchsorted(all_codes, np.asarray(codes, dtype="S6"), sorter=order)]
+    cube = np.full((fields, all_codes.shape[0]), np.nan, dtype="<f4")
+    mask = np.zeros(all_codes.shape[0], dtype=np.uint8)
+    cube[: data.shape[1], pos] = data.T
+    mask[pos] = 1
+
+    exist = np.flatnonzero(report == date)
+    if exist.shape[0]:
+        cube_map, mask_map, _, _ = memmap(root, mode="r+")
+        cube_map[exist[0]] = cube
+        mask_map[exist[0]] = mask
+        cube_map.flush()
+        mask_map.flush()
+        return
+
+    paths = _paths(root)
+    # 上次追加中断时可能有多余的数据，按已完成的报告期截断
+    for name, array in [("cube", cube), ("mask", mask)]:
+        with open(paths[name], "ab") as f:
+            f.truncate(report.shape[0] * array.nbytes)
+            f.seek(report.shape[0] * array.nbytes)
+            array.tofile(f)
+    with open(paths["reports"], "ab") as f:
+        np.array([date], dtype=np.int32).tofile(f)
+
+
+def load(fields=None, period=None, root=None):
+    """
+    加载财务数据
+    :param fields: list int 字段编号（见tdx_mapping.finance_mapping），为None时加载全部字段
+    :param period: str 报告期月日，如"1231"只加载年报，为None时加载全部报告期
+    :return DataFrame columns: 0(股票代码) 字段编号... date，按code、date排序
+            超出各报告期文件字段数的字段为nan，与逐个解析文件后拼接一致
+    """
+    mapped = memmap(root)
+    if mapped is None:
+        return pd.DataFrame()
+    cube, mask, codes, report = mapped
+    if fields is None:
+        fields = list(range(1, cube.shape[1] + 1))
+    index = np.asarray(fields, dtype=np.int64) - 1
+    stored = np.flatnonzero(index < cube.shape[1])
+
+    selected = np.arange(report.shape[0])
+    if period is not None:
+        selected = selected[report % 10000 == int(period)]
+
+    names, dates, values = [], [], []
+    for i in selected.tolist():
+        present = np.flatnonzero(mask[i])
+        names.append(codes[present])
+        dates.append(np.full(present.shape[0], report[i], dtype=np.int32))
+        # 只读取需要的字段，每个字段为连续的一行
+        block = np.full((present.shape[0], index.shape[0]), np.nan, dtype="<f4")
+        block[:, stored] = cube[i][index[stored]][:, present].T
+        values.append(block)
+    if not names:
+        return pd.DataFrame(columns=[0] + fields + ["date"])
+
+    names = np.concatenate(names)
+    data = {0: names.astype(str).astype(object)}
+    matrix = np.concatenate(values).astype(np.float64)
+    for j, field in enumerate(fields):
+        data[field] = matrix[:, j]
+    date = np.concatenate(dates)
+    data["date"] = pd.to_datetime(date.astype(str), format="%Y%m%d")
+    df = pd.DataFrame(data)
+    order = np.lexsort((date, names))
+    return df.iloc[order].reset_index(drop=True)
@@ -6,15 +6,14 @@ import os, sys, math
 from datetime import datetime
 
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.figure import Figure
-from matplotlib import dates
 from tqdm import tqdm
 import numpy as np
 
 import config as cfg
+import cw_store
 import load_data
-import xline
+import lday_store
+import snapshot
 
 
 def core_indicator_calc(df=pd.DataFrame):
@@ -67,8 +66,9 @@ def core_indicator_plot(code="000001", to_web=False, df_gbbq=pd.DataFrame):
     to_web=True 返回figure对象，不plot。false时直接plot
     df_gbbq: 股本变迁dataframe
     """
-    # 加载日线并转换为月线
-    df_price = xline.day2month(load_data.load_line_day(code))
+    init_global()
+    # 加载月线
+    df_price = load_data.load_line_period(code, "month").set_index("date")
 
     # 财报数据
     df = df_core_indicator[df_core_indicator["code"] == code].sort_values(
@@ -76,11 +76,11 @@ def core_indicator_plot(code="000001", to_web=False, df_gbbq=pd.DataFrame):
     )
 
     if df_gbbq is None or df_gbbq.empty:
-        df_gbbq = load_data.load_gbbq()
+        df_gbbq = load_data.load_gbbq(code)
 
     # 分红数据
-    df_gbbq.rename(columns={"分红-前流通盘": "dividend"}, inplace=True)
     df_dividend = df_gbbq[(df_gbbq["code"] == code) & (df_gbbq["类别"] == "除权除息")]
+    df_dividend = df_dividend.rename(columns={"分红-前流通盘": "dividend"})
     df_dividend.loc[:, ["year"]] = pd.DatetimeIndex(df_dividend["date"]).year - 1
     df_dividend = df_dividend[["year", "dividend"]]
     # groupby 后自动设置index
@@ -113,10 +113,15 @@ def core_indicator_plot(code="000001", to_web=False, df_gbbq=pd.DataFrame):
             min = -10
         df.loc[df[c] < 0, c] = min
 
+    # matplotlib只在绘图时导入，web不导入pyplot
     if to_web:
+        from matplotlib.figure import Figure
+
         fig = Figure(figsize=(20, 28))
         cols = 2  # web上显示2列
     else:
+        import matplotlib.pyplot as plt
+
         fig = plt.figure(figsize=(18, 10))
         cols = 3  # plot显示3列
     name = load_data.dt_a_share_codes[code]
@@ -182,6 +187,7 @@ def calc_avg_book_value_grow():
     """
     计算上市以来净资产增长
     """
+    init_global()
     # 2010年来
     begin = "2010-12-31"
     df_finance = df_core_indicator[df_core_indicator["date"] >= begin]
@@ -189,9 +195,6 @@ def calc_avg_book_value_grow():
     # 2019年6月注册制 pass
     milestone = pd.Timestamp("2019-06-01")
 
-    # 股本变迁， 计算分红用
-    df_gbbq = load_data.load_gbbq()
-
     df_shares = load_data.df_a_shares.copy()
     df_shares = df_shares.dropna()
     df_shares.set_index("code", drop=True, inplace=True)
@@ -221,12 +224,8 @@ def calc_avg_book_value_grow():
         rate = math.pow(grow, 1 / year)
 
         # 股本变迁中分红单位为10股
-        dividend = (
-            df_gbbq[(df_gbbq["code"] == code) & (df_gbbq["类别"] == "除权除息")][
-                "分红-前流通盘"
-            ].sum()
-            / 10
-        )
+        df_gbbq = load_data.load_gbbq(code, "除权除息")
+        dividend = df_gbbq["分红-前流通盘"].sum() / 10
         obj = {
             "date": date,
             "name": load_data.dt_a_share_codes[code],
@@ -251,15 +250,28 @@ def calc_avg_book_value_grow():
     print(df_grow)
 
 
-# 全部股票核心指标dataframe
+# 全部股票核心指标dataframe，首次使用时从快照加载（见init_global）
 df_core_indicator = None
+# 核心指标快照的版本号，修改core_indicator_calc时递增
+CORE_INDICATOR_VERSION = 1
+
+
+def _build_core_indicator():
+    # core_indicator_calc原地修改，复制后计算，不改变load_data中的年报
+    return core_indicator_calc(load_data.df_a_share_annual_finance_reports.copy())
 
 
 def init_global():
+    """
+    加载核心指标，财务数据未变化时直接读取快照，不加载年报
+    """
     global df_core_indicator
     if df_core_indicator is None:
-        df_core_indicator = core_indicator_calc(
-            load_data.df_a_share_annual_finance_reports
+        df_core_indicator = snapshot.load(
+            "core_indicator",
+            cw_store.files(),
+            _build_core_indicator,
+            version=(load_data.SNAPSHOT_VERSION, CORE_INDICATOR_VERSION),
         )
 
 
@@ -267,13 +279,10 @@ if __name__ == "__main__":
     load_data.init_global()
     init_global()
 
-    df_gbbq = load_data.load_gbbq()
-
     # calc_avg_book_value_grow()
     # raise Exception("test")
 
-    codes = [name[:-4] for name in os.listdir(cfg.ProcessedDataPath.tdx_lday_qfq)]
-    codes.sort()
+    codes = lday_store.codes()
     index = codes.index(load_data.dt_a_share_names["伊利股份"])
 
     record = False
@@ -287,7 +296,7 @@ if __name__ == "__main__":
     codes = codes[index:]
     df = df_core_indicator
     for c in codes:
-        core_indicator_plot(code=c, to_web=False, df_gbbq=df_gbbq)
+        core_indicator_plot(code=c, to_web=False)
         if record:
             with open(".cache/lastest", "w") as f:
                 f.write(c)
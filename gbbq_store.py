@@ -0,0 +1,146 @@
+"""
+股本变迁二进制存储
+全部记录保存为一个定长记录文件，按code、权息日排序，同一股票的记录连续存放
+加载时按股票代码边界建立偏移索引，读取单只股票只需切片
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import lday_store
+
+# 类别，下标+1为通达信股本变迁中的类别代码
+CATEGORIES = [
+    "除权除息",
+    "送配股上市",
+    "非流通股上市",
+    "未知股本变动",
+    "股本变化",
+    "增发新股",
+    "股份回购",
+    "增发新股上市",
+    "转配股上市",
+    "可转债上市",
+    "扩缩股",
+    "非流通股缩股",
+    "送认购权证",
+    "送认沽权证",
+]
+
+# 数值列，与股本变迁原文件的字段顺序一致
+COLUMNS = ["分红-前流通盘", "配股价-前总股本", "送转股-后流通盘", "配股-后总股本"]
+
+# 定长记录格式
+# code: 股票代码  date: int32 权息日，如20240102  category: uint8 类别代码
+# f0~f3: float64 对应COLUMNS
+DTYPE = np.dtype(
+    [
+        ("code", "S6"),
+        ("date", "<i4"),
+        ("category", "u1"),
+        ("f0", "<f8"),
+        ("f1", "<f8"),
+        ("f2", "<f8"),
+        ("f3", "<f8"),
+    ]
+)
+
+# 类别列的dtype，只构造一次，from_codes时不再逐次校验类别
+CATEGORY_DTYPE = pd.CategoricalDtype(CATEGORIES)
+
+# 缓存 {path: (mtime, 记录, {code: (起始行, 结束行)})}
+_cache = dict()
+
+
+def to_records(df):
+    """
+    股本变迁DataFrame转换为按code、权息日排序的定长记录
+    :param df: DataFrame columns: code 权息日 类别(类别代码) 及COLUMNS
+    :return np.ndarray dtype为DTYPE
+    """
+    records = np.empty(df.shape[0], dtype=DTYPE)
+    records["code"] = df["code"].to_numpy(dtype="S6")
+    records["date"] = df["权息日"].to_numpy(dtype=np.int32)
+    records["category"] = df["类别"].to_numpy(dtype=np.uint8)
+    for i, name in enumerate(COLUMNS):
+        records[f"f{i}"] = df[name].to_numpy(dtype=np.float64)
+    # 稳定排序，同一股票同一天的多条记录保持原顺序
+    return records[np.lexsort((records["date"], records["code"]))]
+
+
+def save(records, path=None):
+    """
+    覆盖写入股本变迁，先写临时文件再替换
+    """
+    path = cfg.ProcessedDataPath.tdx_gbbq if path is None else path
+    tmp = path + ".tmp"
+    records.tofile(tmp)
+    os.replace(tmp, path)
+
+
+def load(path=None):
+    """
+    加载股本变迁，文件未修改时返回缓存
+    :return (记录, {code: (起始行, 结束行)})
+    """
+    path = cfg.ProcessedDataPath.tdx_gbbq if path is None else path
+    mtime = os.path.getmtime(path)
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2]
+
+    records = np.fromfile(path, dtype=DTYPE)
+    code = records["code"]
+    bounds = np.flatnonzero(code[1:] != code[:-1]) + 1
+    starts = np.r_[0, bounds] if records.shape[0] else np.empty(0, dtype=np.int64)
+    ends = np.r_[bounds, records.shape[0]]
+    index = {
+        code[lo].decode(): (lo, hi) for lo, hi in zip(starts.tolist(), ends.tolist())
+    }
+    _cache[path] = (mtime, records, index)
+    return records, index
+
+
+def records_of(code, path=None, category=None):
+    """
+    某股票的股本变迁记录
+    :param category: str 只返回该类别的记录，如"除权除息"，为None时返回全部
+    :return np.ndarray 没有记录时为空
+    """
+    records, index = load(path)
+    lo, hi = index.get(code, (0, 0))
+    records = records[lo:hi]
+    if category is not None:
+        records = records[records["category"] == CATEGORIES.index(category) + 1]
+    return records
+
+
+def to_frame(records):
+    """
+    定长记录转换为股本变迁DataFrame
+    columns: ['code', '权息日', '类别', '分红-前流通盘', '配股价-前总股本', '送转股-后流通盘', '配股-后总股本', 'date']
+    类别为Categorical，date为datetime64
+    """
+    # 记录按code排序，只解码每段的股票代码再重复，避免逐行构造字符串
+    code = records["code"]
+    if code.shape[0] and code[0] == code[-1]:
+        # 单只股票（records_of的切片）只有一段
+        codes = np.full(code.shape[0], code[0].decode(), dtype=object)
+    else:
+        starts = np.r_[0, np.flatnonzero(code[1:] != code[:-1]) + 1][: code.shape[0]]
+        counts = np.diff(np.r_[starts, code.shape[0]])
+        codes = np.repeat(code[starts].astype(str).astype(object), counts)
+    category = records["category"].astype(np.int64) - 1
+    category[(category < 0) | (category >= len(CATEGORIES))] = -1
+    data = {
+        "code": codes,
+        "权息日": records["date"].astype(np.int64),
+        "类别": pd.Categorical.from_codes(category, dtype=CATEGORY_DTYPE),
+    }
+    for i, name in enumerate(COLUMNS):
+        data[name] = np.array(records[f"f{i}"])
+    data["date"] = lday_store.int_to_date(records["date"]).astype("datetime64[ns]")
+    return pd.DataFrame(data, copy=False)
@@ -0,0 +1,306 @@
+"""
+日线二进制存储
+每只股票一个文件，文件名为股票代码，由定长记录顺序组成（按日期升序）
+读取时直接np.memmap映射为结构化数组，无需解析文本
+默认目录保存不复权日线，复权因子表单独保存，读取时按需复权（见adjust）
+
+python lday_store.py 将旧的前复权csv日线转换为二进制格式
+"""
+
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+
+# 定长记录格式
+# date: int32 日期，自1970-01-01起的天数，可直接转换为datetime64
+# open/high/low/close: float64 价格
+# vol: int64 成交量  amount: int64 成交金额
+# adj: float64 复权因子
+DTYPE = np.dtype(
+    [
+        ("date", "<i4"),
+        ("open", "<f8"),
+        ("high", "<f8"),
+        ("low", "<f8"),
+        ("close", "<f8"),
+        ("vol", "<i8"),
+        ("amount", "<i8"),
+        ("adj", "<f8"),
+    ]
+)
+
+SUFFIX = ".bin"
+
+# 复权因子表格式，全市场一个文件，按code、date排序
+# code: 股票代码  date: int32 除权除息日，自1970-01-01起的天数
+# factor: float64 该日及之后全部除权除息的除权因子连乘，即该日之前日线的前复权因子
+FACTOR_DTYPE = np.dtype([("code", "S6"), ("date", "<i4"), ("factor", "<f8")])
+
+# 复权因子表缓存 (mtime, 因子表, {code: (起始行, 结束行)})
+_factor_cache = dict()
+
+
+def int_to_date(date):
+    """
+    int日期数组转换为datetime64数组，20240102 -> 2024-01-02
+    :param date: np.ndarray int日期
+    :return np.ndarray datetime64[D]
+    """
+    date = np.asarray(date, dtype=np.int64)
+    month = ((date // 10000 - 1970) * 12 + date // 100 % 100 - 1).astype(
+        "datetime64[M]"
+    )
+    return month.astype("datetime64[D]") + (date % 100 - 1)
+
+
+def to_days(date):
+    """
+    日期转换为自1970-01-01起的天数
+    :param date: datetime64数组或Series，也可以是%Y-%m-%d格式的字符串
+    :return np.ndarray int32
+    """
+    day = np.asarray(pd.to_datetime(date), dtype="datetime64[D]")
+    return day.astype(np.int32)
+
+
+def from_days(days):
+    """
+    自1970-01-01起的天数转换为datetime64[ns]数组
+    """
+    return np.asarray(days).astype("datetime64[D]").astype("datetime64[ns]")
+
+
+def path_of(code, root=None):
+    """股票代码对应的文件路径"""
+    root = cfg.ProcessedDataPath.tdx_lday_bin if root is None else root
+    return root + os.sep + code + SUFFIX
+
+
+def codes(root=None):
+    """
+    已存储的全部股票代码，升序
+    """
+    root = cfg.ProcessedDataPath.tdx_lday_bin if root is None else root
+    return sorted(
+        name[: -len(SUFFIX)] for name in os.listdir(root) if name.endswith(SUFFIX)
+    )
+
+
+def to_records(df):
+    """
+    日线DataFrame转换为定长记录数组
+    :param df: DataFrame 包含date open high low close vol amount列，adj列可选
+    :return np.ndarray dtype为DTYPE
+    """
+    records = np.empty(df.shape[0], dtype=DTYPE)
+    records["date"] = to_days(df["date"])
+    for name in ["open", "high", "low", "close"]:
+        records[name] = df[name].to_numpy(dtype=np.float64)
+    for name in ["vol", "amount"]:
+        records[name] = df[name].fillna(0).to_numpy(dtype=np.int64)
+    if "adj" in df.columns:
+        records["adj"] = df["adj"].to_numpy(dtype=np.float64)
+    else:
+        records["adj"] = 1.0
+    return records
+
+
+def save(code, df, root=None):
+    """
+    覆盖写入某股票日线
+    """
+    save_records(code, to_records(df), root)
+
+
+def save_records(code, records, root=None):
+    """
+    覆盖写入某股票的定长记录
+    先写临时文件再替换，读取方不会读到写了一半的文件
+    """
+    path = path_of(code, root)
+    tmp = path + ".tmp"
+    records.tofile(tmp)
+    os.replace(tmp, path)
+
+
+def append(code, df, root=None):
+    """
+    在某股票日线末尾追加，df的日期须晚于已保存的日线
+    """
+    append_records(code, to_records(df), root)
+
+
+def append_records(code, records, root=None):
+    """
+    在某股票的定长记录末尾追加
+    """
+    with open(path_of(code, root), "ab") as f:
+        records.tofile(f)
+
+
+def memmap(code, root=None):
+    """
+    只读映射某股票日线
+    :return np.ndarray 结构化数组，文件不存在返回None
+    """
+    path = path_of(code, root)
+    if not os.path.exists(path):
+        return None
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=DTYPE)
+    return np.memmap(path, dtype=DTYPE, mode="r")
+
+
+def to_frame(records, writeable=True):
+    """
+    定长记录数组转换为日线DataFrame
+    股票代码由调用方持有，不再逐行保存，避免构造字符串列的开销
+    各列复制出映射文件，返回的DataFrame可修改
+    :param writeable: bool 为False时各列数组只读，用于缓存
+    columns: ['date', 'open', 'high', 'low', 'close', 'vol', 'amount', 'adj']
+    """
+    data = {"date": from_days(records["date"])}
+    for name in DTYPE.names[1:]:
+        data[name] = np.array(records[name])
+    if not writeable:
+        for values in data.values():
+            values.flags.writeable = False
+    return pd.DataFrame(data, copy=False)
+
+
+def load(code, root=None):
+    """
+    加载某股票日线
+    :return DataFrame 文件不存在返回None
+    """
+    records = memmap(code, root)
+    if records is None:
+        return None
+    return to_frame(records)
+
+
+def save_factors(factors, path=None):
+    """
+    覆盖写入复权因子表
+    :param factors: np.ndarray dtype为FACTOR_DTYPE
+    :param path: str 文件路径
+    """
+    path = cfg.ProcessedDataPath.tdx_lday_factor if path is None else path
+    tmp = path + ".tmp"
+    factors.tofile(tmp)
+    os.replace(tmp, path)
+
+
+def load_factors(path=None):
+    """
+    加载复权因子表，文件未修改时返回缓存
+    :return (因子表, {code: (起始行, 结束行)})，文件不存在返回空表
+    """
+    path = cfg.ProcessedDataPath.tdx_lday_factor if path is None else path
+    if not os.path.exists(path):
+        return np.empty(0, dtype=FACTOR_DTYPE), dict()
+    mtime = os.path.getmtime(path)
+    cached = _factor_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2]
+
+    factors = np.fromfile(path, dtype=FACTOR_DTYPE)
+    code = factors["code"]
+    bounds = np.flatnonzero(code[1:] != code[:-1]) + 1
+    starts = np.r_[0, bounds] if factors.shape[0] else np.empty(0, dtype=np.int64)
+    ends = np.r_[bounds, factors.shape[0]]
+    index = {
+        code[lo].decode(): (lo, hi) for lo, hi in zip(starts.tolist(), ends.tolist())
+    }
+    _factor_cache[path] = (mtime, factors, index)
+    return factors, index
+
+
+def factors_of(code, path=None):
+    """
+    某股票的复权因子
+    :return np.ndarray dtype为FACTOR_DTYPE，没有除权除息时为空
+    """
+    factors, index = load_factors(path)
+    lo, hi = index.get(code, (0, 0))
+    return factors[lo:hi]
+
+
+def version_of(code, adjust="qfq", root=None):
+    """
+    股票日线的数据版本，由不复权日线文件的大小、修改时间和该股票的复权因子组成
+    追加日线或除权除息改变复权因子后版本改变
+    :return str 日线文件不存在时为None
+    """
+    path = path_of(code, root)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    factors = factors_of(code) if adjust != "none" else b""
+    crc = zlib.crc32(np.asarray(factors).tobytes())
+    return f"{stat.st_size}-{stat.st_mtime_ns}-{crc:08x}-{adjust}"
+
+
+def adjust_factors(dates, factors, how="qfq"):
+    """
+    各日线的复权因子，价格乘以复权因子为复权价格
+    :param dates: np.ndarray 日线日期，自1970-01-01起的天数
+    :param factors: np.ndarray 该股票的复权因子，factors_of返回，不能为空
+    :param how: str qfq前复权，hfq后复权
+    :return np.ndarray float64
+    """
+    # 日线之后的第一次除权除息决定该日线的复权因子，之后没有除权除息时为1
+    cum = np.r_[factors["factor"], 1.0]
+    adj = cum[np.searchsorted(factors["date"], dates, side="right")]
+    if how == "hfq":
+        adj = adj / factors["factor"][0]
+    elif how != "qfq":
+        raise ValueError("不支持的复权方式: " + how)
+    return adj
+
+
+def adjust(records, factors, how="qfq", decimals=2):
+    """
+    按复权因子表复权日线
+    :param records: np.ndarray 不复权定长记录
+    :param factors: np.ndarray 该股票的复权因子，factors_of返回
+    :param how: str qfq前复权，hfq后复权，none不复权
+    :param decimals: int 价格保留的小数位数，为None时不取整
+    :return np.ndarray 复权后的定长记录，adj列为复权因子
+    """
+    records = np.array(records)
+    if how == "none" or factors.shape[0] == 0:
+        return records
+    adj = adjust_factors(records["date"], factors, how)
+    for name in ["open", "high", "low", "close"]:
+        records[name] = records[name] * adj
+        if decimals is not None:
+            records[name] = np.round(records[name], decimals)
+    records["adj"] = adj
+    return records
+
+
+def csv_to_store(src=None, dst=None):
+    """
+    将已有的前复权csv日线转换为二进制格式
+    :param src: str csv日线目录
+    :param dst: str 二进制日线目录，默认为前复权二进制日线目录
+    """
+    from tqdm import tqdm
+
+    src = cfg.ProcessedDataPath.tdx_lday_qfq if src is None else src
+    dst = cfg.ProcessedDataPath.tdx_lday_qfq_bin if dst is None else dst
+    files = [name for name in os.listdir(src) if name.endswith(".csv")]
+    files.sort()
+    for filename in tqdm(files, desc="csv to bin:"):
+        df = pd.read_csv(src + os.sep + filename, encoding="utf-8", dtype={"code": str})
+        save(filename[:-4], df, dst)
+
+
+if __name__ == "__main__":
+    csv_to_store()
@@ -2,16 +2,21 @@
 加载本地数据
 """
 
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-import os
 import time
 
+import numpy as np
 import pandas as pd
 
 import log
 import config as cfg
 import tdx_mapping
+import lday_store
+import gbbq_store
+import cw_store
+import snapshot
 import xline
 
 
@@ -31,12 +36,8 @@ def a_shares_to_dict(df=pd.DataFrame):
     """
     将df转换为name-code，code-name的2个dict
     """
-    dt_codes, dt_names = dict(), dict()
-
-    for index, row in df.iterrows():
-        dt_codes[row["code"]] = row["name"]
-        dt_names[row["name"]] = row["code"]
-    return dt_codes, dt_names
+    codes, names = df["code"].tolist(), df["name"].tolist()
+    return dict(zip(codes, names)), dict(zip(names, codes))
 
 
 class ReportPeriod(Enum):
@@ -54,46 +55,45 @@ class ReportPeriod(Enum):
     ANNUAL = "1231"
 
 
-def load_a_annual_finance_reports(period=ReportPeriod.ANNUAL, rename_column=True):
+def load_a_annual_finance_reports(
+    period=ReportPeriod.ANNUAL, rename_column=True, fields=None
+):
     """
     加载A股全部年报
+    从财务数据立方体中只读取指定报告期和字段
+    :param period: ReportPeriod 报告期，为None时加载全部报告期
+    :param rename_column: bool 按tdx_mapping.finance_mapping重命名列
+    :param fields: list int 字段编号（见tdx_mapping.finance_mapping），为None时加载全部字段
     """
     log.i(f"加载财报:begin, period={period}, rename_column={rename_column}")
     start = time.time()
 
-    df = pd.DataFrame()
-
-    fnames = [
-        name
-        for name in os.listdir(cfg.ProcessedDataPath.tdx_cw)
-        if period.value in name
-    ]
-    for name in fnames:
-        path = cfg.ProcessedDataPath.tdx_cw + os.sep + name
-        if os.path.getsize(path) == 0:
-            continue
-        tmp_df = pd.read_pickle(path, compression=None)
-        tmp_df["date"] = datetime.strptime(name[4:-4], "%Y%m%d")
-        df = pd.concat([df, tmp_df])
+    df = cw_store.load(fields, None if period is None else period.value)
 
     if rename_column:
         df.rename(columns=tdx_mapping.finance_mapping, inplace=True)
 
-    df = df.sort_values(by=["code", "date"], ascending=True)
     log.i(f"加载财报:end,共{df.shape[0]}份 用时{(time.time() - start):.2f}秒")
     return df
 
 
-def load_gbbq():
+def load_gbbq(code=None, category=None):
     """
-    加载股本变迁csv
+    加载股本变迁
+    按code排序的二进制文件，读取单只股票只需切片，按类别筛选在转换为DataFrame之前进行
+    :param code: str 股票代码，为None时加载全部
+    :param category: str 类别，如"除权除息"，为None时加载全部类别
     return DataFrame
+    columns: ['code', '权息日', '类别', '分红-前流通盘', '配股价-前总股本', '送转股-后流通盘', '配股-后总股本', 'date']
     """
-    df = pd.read_csv(
-        cfg.ProcessedDataPath.tdx_gbbq, encoding="utf-8", dtype={"code": str}
-    )
-    df["date"] = pd.to_datetime(df["权息日"], format="%Y%m%d")
-    return df
+    if code is not None:
+        return gbbq_store.to_frame(gbbq_store.records_of(code, category=category))
+    records, _ = gbbq_store.load()
+    if category is not None:
+        records = records[
+            records["category"] == gbbq_store.CATEGORIES.index(category) + 1
+        ]
+    return gbbq_store.to_frame(records)
 
 
 # def load_a_lday(code="000423", date_to_datetime=False):
@@ -112,46 +112,268 @@ def load_gbbq():
 #     return df
 
 
-def load_line_day(code="000001"):
-    """加载股票日线"""
-    path = cfg.ProcessedDataPath.tdx_lday_qfq + os.sep + code + ".csv"
-    if not os.path.exists(path):
+# 日线缓存 {(日线文件路径, adjust): (数据版本, DataFrame, 字节数)}，按使用顺序排列
+_line_day_cache = OrderedDict()
+_line_day_cache_size = 0
+_line_day_counters = {"hit": 0, "miss": 0, "evict": 0}
+
+
+def _remember_line_day(key, version, df):
+    """放入日线缓存，超出cfg.line_day_cache_memory时淘汰最久未使用的"""
+    global _line_day_cache_size
+    old = _line_day_cache.pop(key, None)
+    if old is not None:
+        _line_day_cache_size -= old[2]
+    size = int(df.memory_usage(index=False).sum())
+    if size > cfg.line_day_cache_memory:
+        return
+    _line_day_cache[key] = (version, df, size)
+    _line_day_cache_size += size
+    while _line_day_cache_size > cfg.line_day_cache_memory:
+        _, (_, _, evicted) = _line_day_cache.popitem(last=False)
+        _line_day_cache_size -= evicted
+        _line_day_counters["evict"] += 1
+
+
+def _to_day(date):
+    """
+    单个日期转换为自1970-01-01起的天数，None不转换，与lday_store.to_days使用同一解析
+    :param date: str 如2024-01-02或20240102，int 如20240102，或datetime
+    """
+    if date is None:
+        return None
+    # int按%Y%m%d解析，pd.to_datetime会当作纳秒时间戳
+    if isinstance(date, (int, np.integer)):
+        date = str(date)
+    if pd.isna(pd.to_datetime(date)):
+        raise ValueError(f"无法解析的日期: {date!r}")
+    return int(lday_store.to_days([date])[0])
+
+
+def _date_range(records, start, end):
+    """按日期二分查找[start, end]的行范围，start、end为自1970-01-01起的天数，None为不限"""
+    dates = records["date"]
+    lo = 0 if start is None else int(np.searchsorted(dates, start, side="left"))
+    hi = dates.shape[0] if end is None else int(np.searchsorted(dates, end, "right"))
+    return lo, hi
+
+
+def load_line_day(code="000001", adjust="qfq", start=None, end=None, last_n=None):
+    """
+    加载股票日线
+    直接映射不复权二进制日线文件，按复权因子表即时复权，无需解析
+    全部日线按最近最少使用缓存，日线文件或复权因子变化后重新加载（见lday_store.version_of），
+    返回的DataFrame与缓存共享只读数据，修改时复制
+    指定start、end、last_n时按日期二分查找，只读取和复权需要的行；已缓存全部日线时从缓存中截取，否则不放入缓存
+    :param code: str 股票代码
+    :param adjust: str qfq前复权，hfq后复权，none不复权
+    :param start: str 开始日期（含），如2024-01-02、20240102，也可以是int 20240102，为None时不限
+    :param end: str 结束日期（含），格式同start，为None时不限
+    :param last_n: int 只取截至end的最近N条日线，为None时不限
+    columns: ['date', 'open', 'high', 'low', 'close', 'vol', 'amount', 'adj']
+    """
+    version = lday_store.version_of(code, adjust)
+    if version is None:
         print(f"code={code} 日线数据文件不存在")
         return pd.DataFrame()
 
-    df = pd.read_csv(
-        path,
-        index_col=None,
-        encoding="gbk",
-        dtype={"code": str},
+    key = (lday_store.path_of(code), adjust)
+    cached = _line_day_cache.get(key)
+    if cached is not None and cached[0] != version:
+        cached = None
+    if start is not None or end is not None or last_n is not None:
+        records = lday_store.memmap(code)
+        lo, hi = _date_range(records, _to_day(start), _to_day(end))
+        if last_n is not None:
+            lo = max(lo, hi - last_n)
+        if cached is not None:
+            _line_day_cache.move_to_end(key)
+            _line_day_counters["hit"] += 1
+            return cached[1].iloc[lo:hi].reset_index(drop=True)
+        records = lday_store.adjust(records[lo:hi], lday_store.factors_of(code), adjust)
+        return lday_store.to_frame(records)
+
+    if cached is not None:
+        _line_day_cache.move_to_end(key)
+        _line_day_counters["hit"] += 1
+        return cached[1].copy(deep=False)
+
+    _line_day_counters["miss"] += 1
+    records = lday_store.adjust(
+        lday_store.memmap(code), lday_store.factors_of(code), adjust
     )
+    # 各列只读，返回共享数据的浅复制，调用方增删列、修改index或数据时不改变缓存
+    df = lday_store.to_frame(records, writeable=False)
+    _remember_line_day(key, version, df)
+    return df.copy(deep=False)
 
-    return df
+
+def line_day_cache_stats():
+    """
+    日线缓存统计，用于确定cfg.line_day_cache_memory
+    :return dict hit miss evict hit_rate count size
+    """
+    result = dict(_line_day_counters)
+    total = result["hit"] + result["miss"]
+    result["hit_rate"] = result["hit"] / total if total else 0.0
+    result["count"] = len(_line_day_cache)
+    result["size"] = _line_day_cache_size
+    return result
+
+
+def clear_line_day_cache():
+    """清空日线缓存和统计"""
+    global _line_day_cache_size
+    _line_day_cache.clear()
+    _line_day_cache_size = 0
+    for name in _line_day_counters:
+        _line_day_counters[name] = 0
+
+
+def _map(func, items, workers):
+    """workers大于1时多线程执行，读取文件和numpy计算时释放GIL"""
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, items))
+    return [func(item) for item in items]
+
+
+def load_panel(
+    fields=("close",), codes=None, start=None, end=None, adjust="qfq", workers=None
+):
+    """
+    加载全市场日线面板，日期×股票对齐，日期为各股票交易日的并集，无日线（未上市、停牌）为nan
+    多线程读取日线文件，直接写入预先分配的数组，不拼接DataFrame
+    :param fields: list 日线的列名，如close vol，见lday_store.DTYPE
+    :param codes: list 股票代码，为None时为全部日线
+    :param start: str 开始日期（含），如2020-01-01、20200101，也可以是int 20200101，为None时不限
+    :param end: str 结束日期（含），格式同start，为None时不限
+    :param adjust: str qfq前复权，hfq后复权，none不复权
+    :param workers: int 线程数，默认cfg.load_workers
+    :return dict {列名: DataFrame index为日期，columns为股票代码}
+    """
+    codes = lday_store.codes() if codes is None else list(codes)
+    workers = cfg.load_workers if workers is None else workers
+    start, end = _to_day(start), _to_day(end)
+    # 交易日标记，下标为自1970-01-01起的天数，覆盖到2149年
+    seen = np.zeros(2**16, dtype=bool)
+
+    def scan(code):
+        records = lday_store.memmap(code)
+        if records is None:
+            return 0, 0
+        lo, hi = _date_range(records, start, end)
+        seen[records["date"][lo:hi]] = True
+        return lo, hi
+
+    ranges = _map(scan, codes, workers)
+    days = np.flatnonzero(seen)
+
+    # 按列存储（Fortran顺序），每只股票写入连续内存，DataFrame直接使用不复制
+    panel = {
+        name: np.full((days.shape[0], len(codes)), np.nan, order="F") for name in fields
+    }
+    # 日期在面板中的行号，下标为自1970-01-01起的天数
+    position = np.zeros(seen.shape[0], dtype=np.int64)
+    position[days] = np.arange(days.shape[0])
+
+    def fill(j):
+        lo, hi = ranges[j]
+        if lo == hi:
+            return
+        # 一次读入连续的字节范围，只对需要的列复权
+        records = np.array(lday_store.memmap(codes[j])[lo:hi])
+        rows = position[records["date"]]
+        factors = lday_store.factors_of(codes[j])
+        adj = None
+        if adjust != "none" and factors.shape[0]:
+            adj = lday_store.adjust_factors(records["date"], factors, adjust)
+        for name in fields:
+            values = records[name]
+            if adj is not None and name in ["open", "high", "low", "close"]:
+                values = np.round(values * adj, 2)
+            elif adj is not None and name == "adj":
+                values = adj
+            panel[name][rows, j] = values
+
+    _map(fill, range(len(codes)), workers)
+
+    index = pd.DatetimeIndex(lday_store.from_days(days), name="date")
+    return {
+        name: pd.DataFrame(values, index=index, columns=codes, copy=False)
+        for name, values in panel.items()
+    }
+
+
+def load_line_period(code="000001", period="month", adjust="qfq"):
+    """
+    加载股票周期K线，读取预先合成的周期K线存储（见xline.update_period_stores）
+    :param code: str 股票代码
+    :param period: str week周线 month月线 quarter季线 year年线
+    :param adjust: str qfq前复权，hfq后复权，none不复权
+    columns: ['date', 'open', 'high', 'low', 'close', 'vol', 'amount', 'adj']，date为周期内最后一个交易日
+    """
+    records = xline.load(code, period, adjust)
+    if records is None:
+        print(f"code={code} {period}数据文件不存在")
+        return pd.DataFrame()
+    return lday_store.to_frame(records)
 
 
 """ 全局变量 """
 
-# dataframe  A股股票代码、名称
-df_a_shares = None
-# dict 股票{code:name},{name:code}
-dt_a_share_codes, dt_a_share_names = None, None
-# 财报
-df_a_share_annual_finance_reports = None
+# 全局变量在首次访问时从快照加载（见__getattr__、snapshot），输入文件未变化时不重新计算
+# df_a_shares: dataframe A股股票代码、名称
+# dt_a_share_codes, dt_a_share_names: dict 股票{code:name},{name:code}
+# df_a_share_annual_finance_reports: dataframe 年报
+SHARE_GLOBALS = ("df_a_shares", "dt_a_share_codes", "dt_a_share_names")
+FINANCE_GLOBALS = ("df_a_share_annual_finance_reports",)
+# 快照计算逻辑的版本号，修改股票代码表、年报的加载方式或财务字段映射时递增
+SNAPSHOT_VERSION = 1
 
 
-def init_global():
+def _build_a_shares():
+    df = load_a_shares()
+    return (df, *a_shares_to_dict(df))
+
+
+def _build_annual_finance_reports():
+    return load_a_annual_finance_reports(
+        fields=[field for field in tdx_mapping.finance_mapping if field != 0]
+    )
 
-    global df_a_shares
-    if df_a_shares is None:
-        df_a_shares = load_a_shares()
 
-    global dt_a_share_codes, dt_a_share_names
-    if dt_a_share_codes is None:
-        dt_a_share_codes, dt_a_share_names = a_shares_to_dict(df_a_shares)
+def init_global():
+    """加载股票代码表和代码、名称字典，年报在首次访问时加载"""
+    if "df_a_shares" in globals():
+        return
+    values = snapshot.load(
+        "a_shares", [cfg.a_share_path], _build_a_shares, SNAPSHOT_VERSION
+    )
+    globals().update(zip(SHARE_GLOBALS, values))
+
+
+def init_finance():
+    """加载年报"""
+    if "df_a_share_annual_finance_reports" in globals():
+        return
+    globals()["df_a_share_annual_finance_reports"] = snapshot.load(
+        "annual_finance_reports",
+        cw_store.files(),
+        _build_annual_finance_reports,
+        SNAPSHOT_VERSION,
+    )
+
 
-    global df_a_share_annual_finance_reports
-    if df_a_share_annual_finance_reports is None:
-        df_a_share_annual_finance_reports = load_a_annual_finance_reports()
+def __getattr__(name):
+    """首次访问全局变量时加载"""
+    if name in SHARE_GLOBALS:
+        init_global()
+    elif name in FINANCE_GLOBALS:
+        init_finance()
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return globals()[name]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+"""
+全市场选股
+对全部股票的日线计算选股条件，返回截至某日满足条件的股票
+条件可以是通达信公式文本（见tdx_formula，取最后一个输出），也可以是Python函数（传入日线DataFrame，返回序列或数值）
+多进程并行，日线文件由各进程只读映射，复权因子表在创建进程前加载，子进程共享
+
+python screener.py "公式" [日期] [最近N周期]
+例如 python screener.py "XG:C>HHV(REF(C,1),20) AND COUNT(C>REF(C,1),10)>=6;" 2024-01-02 250
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import log
+import lday_store
+import load_data
+import tdx_formula
+
+# 子进程中的选股参数，由_init设置
+_params = dict()
+
+
+def _init(condition, day, last_n, adjust):
+    if isinstance(condition, str):
+        condition = tdx_formula.compile_formula(condition)
+    _params.update(condition=condition, day=day, last_n=last_n, adjust=adjust)
+
+
+def _last(value):
+    """条件结果在最后一个周期是否成立，nan为不成立"""
+    if isinstance(value, dict):
+        # 公式取最后一个输出
+        value = list(value.values())[-1]
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        value = value.to_numpy()
+    value = np.asarray(value)
+    if value.ndim:
+        if value.shape[0] == 0:
+            return False
+        value = value[-1]
+    return bool(value == value and value)
+
+
+def match(code, condition, day=None, last_n=None, adjust="qfq"):
+    """
+    某股票截至某日是否满足选股条件
+    :param code: str 股票代码
+    :param condition: Formula或函数，函数传入日线DataFrame
+    :param day: int 自1970-01-01起的天数，该日停牌或未上市时不满足，为None时取最后一个交易日
+    :param last_n: int 只计算截至该日的最近N个周期，为None时计算全部历史
+    :param adjust: str 复权方式，见load_data.load_line_day
+    :return bool
+    """
+    records = lday_store.memmap(code)
+    if records is None or records.shape[0] == 0:
+        return False
+    end = records.shape[0]
+    if day is not None:
+        end = int(np.searchsorted(records["date"], day, side="right"))
+        if end == 0 or records["date"][end - 1] != day:
+            return False
+    begin = 0 if last_n is None else max(end - last_n, 0)
+    records = lday_store.adjust(records[begin:end], lday_store.factors_of(code), adjust)
+    if isinstance(condition, tdx_formula.Formula):
+        # 公式按列名取值，直接传入定长记录，省去构造DataFrame
+        return _last(condition(records))
+    return _last(condition(lday_store.to_frame(records)))
+
+
+def _screen_codes(codes):
+    """子进程：返回一组股票中满足条件的股票代码"""
+    return [code for code in codes if match(code, **_params)]
+
+
+def screen(condition, date=None, last_n=None, adjust="qfq", codes=None, workers=None):
+    """
+    全市场选股
+    :param condition: str 通达信公式，或函数（须可以pickle，即模块级函数），传入日线DataFrame
+    :param date: str 日期，如2024-01-02，为None时取各股票最后一个交易日
+    :param last_n: int 只计算最近N个周期，须不少于条件用到的最长周期，为None时计算全部历史
+    :param adjust: str 复权方式，见load_data.load_line_day
+    :param codes: list 股票代码，为None时为全部已转换日线的股票
+    :param workers: int 进程数，默认cfg.workers，为1时在当前进程顺序执行
+    :return DataFrame columns: code name，按code排序
+    """
+    codes = lday_store.codes() if codes is None else list(codes)
+    day = None if date is None else int(lday_store.to_days([date])[0])
+    workers = cfg.workers if workers is None else workers
+    # 在创建子进程前加载复权因子表，子进程共享
+    lday_store.load_factors()
+    args = (condition, day, last_n, adjust)
+
+    if workers > 1 and len(codes) > 1:
+        chunks = [chunk.tolist() for chunk in np.array_split(codes, workers * 4)]
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init, initargs=args
+        ) as executor:
+            matched = [
+                code for part in executor.map(_screen_codes, chunks) for code in part
+            ]
+    else:
+        _init(*args)
+        matched = _screen_codes(codes)
+
+    names = dict()
+    if os.path.exists(cfg.a_share_path):
+        names = load_data.dt_a_share_codes
+    matched.sort()
+    return pd.DataFrame(
+        {"code": matched, "name": [names.get(code, "") for code in matched]},
+        columns=["code", "name"],
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    start = time.time()
+    df = screen(
+        sys.argv[1],
+        date=sys.argv[2] if len(sys.argv) > 2 else None,
+        last_n=int(sys.argv[3]) if len(sys.argv) > 3 else None,
+    )
+    print(df.to_string(index=False))
+    log.i(f"选股完成，共{df.shape[0]}只，用时{(time.time() - start):.2f}秒")
@@ -0,0 +1,64 @@
+"""
+全局数据快照
+启动时需要的全局数据（股票代码表、年报、核心指标等）计算后保存为pickle文件，下次启动直接读取
+输入文件的大小、修改时间和版本号组成指纹，指纹不变时读取快照，变化时重新计算并保存
+
+文件格式：两个连续的pickle对象，第一个为指纹，第二个为数据，指纹不一致时不读取数据
+"""
+
+import os
+import pickle
+
+import config as cfg
+
+
+def fingerprint(paths, version=0):
+    """
+    输入文件的指纹
+    :param paths: list 输入文件路径，不存在的文件大小和修改时间记为None
+    :param version: int 计算逻辑的版本号，修改计算方式时递增
+    :return tuple
+    """
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats.append((path, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            stats.append((path, None, None))
+    return version, stats
+
+
+def path_of(name, root=None):
+    """快照文件路径"""
+    root = cfg.ProcessedDataPath.snapshot if root is None else root
+    return root + os.sep + name + ".pkl"
+
+
+def load(name, paths, build, version=0, root=None):
+    """
+    读取快照，快照不存在或指纹变化时调用build重新计算并保存
+    :param name: str 快照名，即文件名
+    :param paths: list 输入文件路径
+    :param build: 无参数的函数，返回需要保存的数据
+    :param version: int 计算逻辑的版本号
+    :param root: str 快照目录，默认cfg.ProcessedDataPath.snapshot
+    :return build的返回值或快照中保存的数据
+    """
+    path = path_of(name, root)
+    # 计算前取指纹，计算期间输入文件变化时下次启动重新计算
+    key = fingerprint(paths, version)
+    try:
+        with open(path, "rb") as f:
+            if pickle.load(f) == key:
+                return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    value = build()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+    return value
@@ -0,0 +1,207 @@
+"""
+指标计算结果缓存
+按(股票代码, 函数, 参数, 数据版本)缓存tdx_ta_func等函数对日线某列的计算结果，
+内存和磁盘两级，均按最近最少使用淘汰，大小分别受cfg.ta_cache_memory、cfg.ta_cache_disk限制
+
+数据版本由不复权日线文件的大小、修改时间和该股票的复权因子组成（见lday_store.version_of），
+update.py lday追加日线或除权除息改变复权因子后，原有的缓存自动失效
+
+磁盘格式：每个缓存一个文件 目录/股票代码/键的sha1.npy，文件头为定长的数据版本，之后依次为np.save格式的结果和日期
+
+例如
+ma20 = ta_cache.indicator("000001", tdx_ta_func.SMA, 20)
+ta_cache.stats()
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import lday_store
+import load_data
+
+# 文件头中数据版本的字节数
+VERSION_SIZE = 64
+
+# 内存缓存 {键: (数据版本, 结果, 日期索引)}，按使用顺序排列
+_memory = OrderedDict()
+_memory_size = 0
+# 各磁盘缓存目录的总字节数 {目录: 字节数}，首次写入时统计
+_disk_size = dict()
+# 最近加载的日线 (股票代码, 数据版本, 日线)，同一股票的多个指标只加载一次
+_line_day = (None, None, None)
+_counters = {"memory_hit": 0, "disk_hit": 0, "miss": 0, "evict": 0}
+
+
+def _key(code, func, args, column, adjust):
+    name = f"{func.__module__}.{func.__qualname__}"
+    return f"{code}|{name}|{args!r}|{column}|{adjust}"
+
+
+def _path(code, key, root):
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return root + os.sep + code + os.sep + digest + ".npy"
+
+
+def _nbytes(entry):
+    return entry[1].nbytes + entry[2].nbytes
+
+
+def _remember(key, version, values, index):
+    """放入内存缓存，超出大小时淘汰最久未使用的"""
+    global _memory_size
+    old = _memory.pop(key, None)
+    if old is not None:
+        _memory_size -= _nbytes(old)
+    entry = (version, values, index)
+    if _nbytes(entry) > cfg.ta_cache_memory:
+        return
+    _memory[key] = entry
+    _memory_size += _nbytes(entry)
+    while _memory_size > cfg.ta_cache_memory:
+        _, evicted = _memory.popitem(last=False)
+        _memory_size -= _nbytes(evicted)
+        _counters["evict"] += 1
+
+
+def _read(path, version):
+    """
+    读取磁盘缓存，版本不一致、文件不存在或没有日期（旧格式）时返回None
+    :return (结果, 日期)
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(VERSION_SIZE).rstrip(b"\0").decode() != version:
+                return None
+            values = np.load(f)
+            dates = np.load(f)
+    except (OSError, ValueError, EOFError):
+        return None
+    # 更新修改时间，作为最近使用时间
+    os.utime(path)
+    return values, dates
+
+
+def _write(path, version, values, dates, root):
+    """写入磁盘缓存，超出大小时删除最久未使用的文件"""
+    if root not in _disk_size:
+        _disk_size[root] = sum(size for _, size, _ in _files(root))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        _disk_size[root] -= os.path.getsize(path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(version.encode().ljust(VERSION_SIZE, b"\0"))
+        np.save(f, values)
+        np.save(f, dates)
+    os.replace(path + ".tmp", path)
+    _disk_size[root] += os.path.getsize(path)
+    if _disk_size[root] <= cfg.ta_cache_disk:
+        return
+    # 淘汰到上限的90%，避免之后每次写入都遍历目录
+    for file, size, _ in sorted(_files(root), key=lambda item: item[2]):
+        if _disk_size[root] <= cfg.ta_cache_disk * 0.9:
+            break
+        if file == path:
+            continue
+        os.remove(file)
+        _disk_size[root] -= size
+        _counters["evict"] += 1
+
+
+def _files(root):
+    """
+    磁盘缓存的全部文件
+    :return list (路径, 字节数, 修改时间)
+    """
+    files = []
+    if not os.path.exists(root):
+        return files
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        for file in os.scandir(entry.path):
+            if file.name.endswith(".npy"):
+                stat = file.stat()
+                files.append((file.path, stat.st_size, stat.st_mtime_ns))
+    return files
+
+
+def _load_line_day(code, adjust, version):
+    global _line_day
+    if _line_day[:2] != (code, version):
+        _line_day = (code, version, load_data.load_line_day(code, adjust))
+    return _line_day[2]
+
+
+def indicator(code, func, *args, column="close", adjust="qfq", root=None):
+    """
+    计算某股票日线某列的指标，结果有缓存且数据未变化时直接返回
+    :param code: str 股票代码
+    :param func: 指标函数，如tdx_ta_func.SMA，func(序列, *args)返回与日线等长的序列
+    :param args: 指标参数，如周期
+    :param column: str 日线的列名
+    :param adjust: str 复权方式，见load_data.load_line_day
+    :param root: str 磁盘缓存目录，默认cfg.ProcessedDataPath.ta_cache
+    :return Series 与load_line_day返回的日线行对应，index为日线的日期（名为date），日线不存在时为None
+    """
+    root = cfg.ProcessedDataPath.ta_cache if root is None else root
+    version = lday_store.version_of(code, adjust)
+    if version is None:
+        return None
+    key = _key(code, func, args, column, adjust)
+
+    cached = _memory.get(key)
+    if cached is not None and cached[0] == version:
+        _memory.move_to_end(key)
+        _counters["memory_hit"] += 1
+        return pd.Series(cached[1], index=cached[2], copy=True)
+
+    path = _path(code, key, root)
+    result = _read(path, version)
+    if result is not None:
+        _counters["disk_hit"] += 1
+        values, dates = result
+    else:
+        _counters["miss"] += 1
+        df = _load_line_day(code, adjust, version)
+        values = np.asarray(func(df[column], *args))
+        dates = df["date"].to_numpy()
+        _write(path, version, values, dates, root)
+    # 缓存的数组只读，返回复制的Series，调用方修改时不会影响缓存
+    values.flags.writeable = False
+    index = pd.DatetimeIndex(dates, name="date")
+    _remember(key, version, values, index)
+    return pd.Series(values, index=index, copy=True)
+
+
+def stats():
+    """
+    缓存命中统计
+    :return dict memory_hit disk_hit miss evict hit_rate memory_size disk_size
+    """
+    result = dict(_counters)
+    total = result["memory_hit"] + result["disk_hit"] + result["miss"]
+    result["hit_rate"] = (total - result["miss"]) / total if total else 0.0
+    result["memory_size"] = _memory_size
+    result["disk_size"] = sum(_disk_size.values())
+    return result
+
+
+def clear(root=None):
+    """
+    清空内存缓存和统计，root不为None时同时删除该磁盘缓存目录下的文件
+    """
+    global _memory_size, _line_day
+    _memory.clear()
+    _line_day = (None, None, None)
+    _memory_size = 0
+    for name in _counters:
+        _counters[name] = 0
+    if root is not None:
+        for file, _, _ in _files(root):
+            os.remove(file)
+        _disk_size.pop(root, None)
@@ -1,398 +1,787 @@
 """
 通达信数据函数
+requests、pytdx只在下载、解析股本变迁时导入，只读取日线和财务文件时不加载
 """
 
 import os
 import time
-import struct
-from struct import unpack
-from decimal import Decimal
-from datetime import datetime
-import requests
+import hashlib
+import zipfile
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from tqdm import tqdm
 import pandas as pd
 import numpy as np
-import pytdx.reader.gbbq_reader
-from pytdx.reader import HistoryFinancialReader
 from retry import retry
 
 import config as cfg
 import log
-import load_data
+import lday_store
+import gbbq_store
+
+
+def http_session(pool=10):
+    """
+    复用连接的http会话，连接池大小与并发下载数一致
+    :param pool: int 连接池大小
+    """
+    import requests
+    import requests.adapters
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 @retry(tries=3, delay=1)
-def download(url):
+def download(url, session=None):
     """
     http.get，可重试下载
+    :param session: requests.Session 为None时不复用连接
     :return (response.content, response.text)
     """
-    res = requests.get(url)
+    import requests
+
+    res = (requests if session is None else session).get(url, timeout=30)
     res.raise_for_status()
     return res.content, res.text
 
 
-def lday_to_csv(src="", dst="", file_name=""):
+def file_md5(path, chunk_size=1 << 20):
+    """
+    分块计算文件md5，不一次读入内存
+    :return (md5, size)
+    """
+    digest = hashlib.md5()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+@retry(tries=3, delay=1)
+def download_file(url, path, md5=None, size=None, session=None, chunk_size=1 << 16):
+    """
+    流式下载文件，边下载边计算md5，校验通过后才替换目标文件
+    下载中断时保留path.part，再次下载时从已下载的字节处续传（服务端不支持Range时重新下载）
+    :param url: str 下载地址
+    :param path: str 保存路径
+    :param md5: str 期望的md5，为None时不校验
+    :param size: int 期望的文件大小，为None时不校验
+    :param session: requests.Session
+    """
+    import requests
+
+    part = path + ".part"
+    digest, done = hashlib.md5(), 0
+    if os.path.exists(part):
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+                done += len(chunk)
+        if size is not None and done > size:
+            digest, done = hashlib.md5(), 0
+
+    headers = {"Range": f"bytes={done}-"} if done else {}
+    http = requests if session is None else session
+    with http.get(url, headers=headers, stream=True, timeout=30) as res:
+        # 已下载完整时服务端返回416
+        if not (res.status_code == 416 and done == size):
+            res.raise_for_status()
+            if res.status_code != 206:
+                digest, done = hashlib.md5(), 0
+            with open(part, "ab" if done else "wb") as f:
+                for chunk in res.iter_content(chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    done += len(chunk)
+
+    if (size is not None and done != size) or (
+        md5 is not None and digest.hexdigest() != md5
+    ):
+        os.remove(part)
+        raise ValueError(f"{url} 校验失败,size={done},md5={digest.hexdigest()}")
+    os.replace(part, path)
+
+
+def extract_zip(path, dst):
+    """解压zip文件到dst目录"""
+    with zipfile.ZipFile(path, "r") as f:
+        f.extractall(dst)
+
+
+def sync_cw(dst=None, workers=None):
+    """
+    按gpcw.txt同步通达信专业财务zip文件
+    本地文件先比较大小，大小一致再分块计算md5；缺失或不一致的文件并发下载，下载完成即在线程池中解压
+    :param dst: str zip保存及解压目录
+    :param workers: int 并发下载数
+    :return (not_exist, not_equal, failed) 缺失的文件、不一致的文件、下载失败的文件
+    """
+    dst = cfg.TdxCfg.ori_cw if dst is None else dst
+    workers = cfg.download_workers if workers is None else workers
+    session = http_session(workers)
+    _, text = download(cfg.TdxCfg.gpcw_url, session)
+    rows = [line.strip().split(",") for line in text.strip().splitlines()]
+    checksums = {name: (md5, int(size)) for name, md5, size in rows}
+
+    exists = [name for name in checksums if os.path.exists(dst + os.sep + name)]
+    not_exist = [name for name in checksums if name not in exists]
+    not_equal, same_size = [], []
+    for name in exists:
+        if os.path.getsize(dst + os.sep + name) == checksums[name][1]:
+            same_size.append(name)
+        else:
+            not_equal.append(name)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor, ThreadPoolExecutor(
+        max_workers=workers
+    ) as extractor:
+        md5s = executor.map(lambda name: file_md5(dst + os.sep + name)[0], same_size)
+        for name, md5 in zip(same_size, md5s):
+            if md5 != checksums[name][0]:
+                not_equal.append(name)
+
+        futures = {
+            executor.submit(
+                download_file,
+                cfg.TdxCfg.zip_url + name,
+                dst + os.sep + name,
+                *checksums[name],
+                session,
+            ): name
+            for name in not_exist + not_equal
+        }
+        extracts = []
+        for future in tqdm(as_completed(futures), total=len(futures), desc="download:"):
+            name = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(name)
+                log.e(f"{name} 下载失败: {e}")
+                continue
+            extracts.append(extractor.submit(extract_zip, dst + os.sep + name, dst))
+        for future in extracts:
+            future.result()
+
+    return not_exist, not_equal, failed
+
+
+# 通达信日线二进制记录格式，32字节为一组
+# date:日期 open/high/low/close:价格*100 amount:成交金额(float) vol:成交量 reserved:保留
+LDAY_DTYPE = np.dtype(
+    [
+        ("date", "<u4"),
+        ("open", "<u4"),
+        ("high", "<u4"),
+        ("low", "<u4"),
+        ("close", "<u4"),
+        ("amount", "<f4"),
+        ("vol", "<u4"),
+        ("reserved", "<u4"),
+    ]
+)
+
+
+def decode_lday(buf):
+    """
+    将通达信日线二进制数据一次性解码为numpy结构化数组
+    末尾不足32字节的残缺记录忽略
+    :param buf: bytes 日线文件内容
+    :return np.ndarray dtype为LDAY_DTYPE，只读
+    """
+    count = len(buf) // LDAY_DTYPE.itemsize
+    return np.frombuffer(buf, dtype=LDAY_DTYPE, count=count)
+
+
+def round_amount(amount):
+    """
+    成交金额四舍五入为整数，与Decimal ROUND_HALF_UP等价：绝对值加0.5后向下取整
+    :param amount: np.ndarray float32成交金额
+    :return np.ndarray int64
+    """
+    amount = amount.astype(np.float64)
+    return (np.sign(amount) * np.floor(np.abs(amount) + 0.5)).astype(np.int64)
+
+
+def lday_to_records(records):
+    """
+    将解码后的日线记录批量转换为不复权的定长记录（lday_store.DTYPE）
+    价格/100.0，成交金额四舍五入为整数，与csv输出的数值一致
+    :param records: np.ndarray decode_lday返回的结构化数组
+    :return np.ndarray dtype为lday_store.DTYPE
+    """
+    dst = np.empty(records.shape[0], dtype=lday_store.DTYPE)
+    dst["date"] = lday_store.int_to_date(records["date"]).astype(np.int32)
+    for name in ["open", "high", "low", "close"]:
+        dst[name] = records[name] / 100.0
+    dst["vol"] = records["vol"]
+    dst["amount"] = round_amount(records["amount"])
+    dst["adj"] = 1.0
+    return dst
+
+
+def lday_to_rows(records, code):
+    """
+    将解码后的日线记录批量转换为csv文本行
+    输出格式与逐条unpack一致：价格/100.0，成交金额四舍五入（ROUND_HALF_UP）为整数
+    :param records: np.ndarray decode_lday返回的结构化数组
+    :param code: str 股票代码
+    :return str 每行以换行符开头
+    """
+    if records.shape[0] == 0:
+        return ""
+
+    # 20240102 -> 2024-01-02
+    day = lday_store.int_to_date(records["date"])
+    amount = round_amount(records["amount"])
+
+    columns = [day.astype(str).tolist(), [code] * records.shape[0]]
+    for name in ["open", "high", "low", "close"]:
+        columns.append(map(str, (records[name] / 100.0).tolist()))
+    columns.append(map(str, records["vol"].tolist()))
+    columns.append(map(str, amount.tolist()))
+
+    return "\n" + "\n".join(map(",".join, zip(*columns)))
+
+
+def watermark_path(dst):
+    """日线目录对应的水位线文件路径，与目录同级"""
+    return dst.rstrip(os.sep) + ".watermark.csv"
+
+
+def load_watermark(dst):
+    """
+    加载日线目录的水位线
+    水位线记录每只股票已转换到的位置，增量更新时只需读取源文件新增的记录
+    :param dst: str 日线目录
+    :return dict {code: (date, offset, size)}
+        date: int 最后一条已转换记录的日期，如20240102
+        offset: int 源二进制文件中已转换的字节数
+        size: int 目标文件对应的字节数
+    """
+    path = watermark_path(dst)
+    if not os.path.isfile(path):
+        return dict()
+    df = pd.read_csv(path, encoding="utf-8", dtype={"code": str})
+    return {
+        code: (int(date), int(offset), int(size))
+        for code, date, offset, size in zip(
+            df["code"], df["date"], df["offset"], df["size"]
+        )
+    }
+
+
+def save_watermark(dst, watermark):
+    """
+    保存日线目录的水位线，先写临时文件再替换
+    :param dst: str 日线目录
+    :param watermark: dict load_watermark返回的水位线
+    """
+    path = watermark_path(dst)
+    df = pd.DataFrame(
+        [(code, *mark) for code, mark in sorted(watermark.items())],
+        columns=["code", "date", "offset", "size"],
+    )
+    df.to_csv(path + ".tmp", encoding="utf-8", index=False)
+    os.replace(path + ".tmp", path)
+
+
+def check_watermark(src_file, dst_path, mark):
+    """
+    校验水位线是否仍然有效
+    源文件被截断或改写（水位线处的记录日期不一致）、目标文件缺失或被截断时无效，需要全量转换
+    :param src_file: 已打开的源二进制文件
+    :param dst_path: str 目标文件路径
+    :param mark: tuple (date, offset, size)
+    :return bool
+    """
+    date, offset, size = mark
+    chunk_size = LDAY_DTYPE.itemsize
+    if size == 0 or not os.path.isfile(dst_path) or os.path.getsize(dst_path) < size:
+        return False
+    if offset == 0:
+        return True
+    src_file.seek(0, 2)
+    if src_file.tell() < offset:
+        return False
+    src_file.seek(offset - chunk_size)
+    records = decode_lday(src_file.read(chunk_size))
+    return records.shape[0] == 1 and int(records["date"][0]) == date
+
+
+def lday_convert(src_path, dst_path, code, encode, header=b"", watermark=None):
+    """
+    按水位线增量转换单个通达信日线文件
+    从源文件已转换的字节处开始读取，只追加新增记录，耗时只与新增记录数有关
+    :param src_path: str 源二进制文件路径
+    :param dst_path: str 目标文件路径
+    :param code: str 股票代码
+    :param encode: 将decode_lday返回的记录编码为bytes的函数
+    :param header: bytes 全量转换时写在文件开头的内容
+    :param watermark: dict load_watermark返回的水位线，转换后原地更新。为None时全量转换
+    """
+    mark = None if watermark is None else watermark.get(code)
+
+    with open(src_path, "rb") as f:
+        if mark is not None and check_watermark(f, dst_path, mark):
+            date, offset, size = mark
+            f.seek(offset)
+            records = decode_lday(f.read())
+            # 上次写入后水位线未保存时，目标文件可能有多余的内容，截断后重新追加
+            mode = "r+b"
+            content = encode(records)
+        else:
+            date, offset, size = 0, 0, 0
+            f.seek(0)
+            records = decode_lday(f.read())
+            mode = "wb"
+            content = header + encode(records)
+
+    with open(dst_path, mode) as dst_file:
+        dst_file.truncate(size)
+        dst_file.seek(size)
+        dst_file.write(content)
+
+    if watermark is not None:
+        if records.shape[0] > 0:
+            date = int(records["date"][-1])
+        watermark[code] = (
+            date,
+            offset + records.shape[0] * LDAY_DTYPE.itemsize,
+            size + len(content),
+        )
+
+
+def lday_to_csv(src="", dst="", file_name="", watermark=None):
     """
     将通达信vipdoc目录下，bj sh sz（北交所、上交所、深交所）日线数据原始二进制格式，转换为DataFrame格式存储到csv文件中。
-    通达信数据文件32字节为一组
-    支持增量更新
+    通达信数据文件32字节为一组，使用numpy结构化数组整体解码后一次写入
+    支持增量更新，见lday_convert
     :param src: str 二进制文件路径
     :param dst: str csv文件保存路径
     :param file_name: str 二进制文件名。example: sh000001.day
+    :param watermark: dict load_watermark返回的水位线，转换后原地更新。为None时全量转换
     :return none
     """
     code = file_name[2:-4]
-    src_path = src + os.sep + file_name
-    dst_path = dst + os.sep + code + ".csv"
-    with open(src_path, "rb") as f:
-        buf = f.read()
-
-    chunk_size = 32
-    chunk_num = int(len(buf) / chunk_size)
-    buf_index = 0
-
-    dst_exist = os.path.isfile(dst_path)
-    with open(dst_path, "a+", encoding="utf-8") as dst_file:
-        # 写表头
-        header_f = lambda: dst_file.write("date,code,open,high,low,close,vol,amount")
-        if not dst_exist:
-            header_f()
-            total_row = 0
-        else:
-            dst_file.seek(0, 0)
-            total_row = len(dst_file.readlines())
-            # 创建了文件，写表头失败，重新写入
-            if total_row == 0:
-                header_f()
-                total_row = 1
-                return
-            else:
-                dst_file.seek(0, 2)
-
-            # 除去第一行表头行
-            total_row = total_row - 1
-            buf_index = total_row * chunk_size
-
-        for _ in range(total_row, chunk_num):
-            # 将字节流转换成Python数据格式
-            # I: unsigned int
-            # f: float
-            # [5]浮点类型的成交金额，使用decimal类四舍五入为整数
-            info = unpack("IIIIIfII", buf[buf_index : buf_index + chunk_size])
-            date = datetime.strptime(str(info[0]), "%Y%m%d").strftime("%Y-%m-%d")
-            content = ["\n" + date, code]
-            for i in range(1, 5):
-                content.append(str(info[i] / 100.0))
-            content.append(str(info[6]))
-            amount = Decimal(info[5]).quantize(Decimal("1."), rounding="ROUND_HALF_UP")
-            content.append(str(amount))
-
-            dst_file.write(",".join(content))
-            buf_index += chunk_size
-
-
-def backward_adjust(lday_path="", df_gbbq=pd.DataFrame):
+    lday_convert(
+        src + os.sep + file_name,
+        dst + os.sep + code + ".csv",
+        code,
+        lambda records: lday_to_rows(records, code).encode("utf-8"),
+        b"date,code,open,high,low,close,vol,amount",
+        watermark,
+    )
+
+
+def lday_to_store(src="", dst="", file_name="", watermark=None):
+    """
+    将通达信日线数据原始二进制格式，转换为不复权的二进制日线（lday_store）
+    支持增量更新，见lday_convert
+    :param src: str 二进制文件路径
+    :param dst: str 二进制日线保存目录
+    :param file_name: str 二进制文件名。example: sh000001.day
+    :param watermark: dict load_watermark返回的水位线，转换后原地更新。为None时全量转换
+    :return none
+    """
+    code = file_name[2:-4]
+    lday_convert(
+        src + os.sep + file_name,
+        lday_store.path_of(code, dst),
+        code,
+        lambda records: lday_to_records(records).tobytes(),
+        watermark=watermark,
+    )
+
+
+# 除权除息计算复权因子使用的股本变迁列
+XRXD_COLUMNS = ["分红-前流通盘", "配股-后总股本", "配股价-前总股本", "送转股-后流通盘"]
+
+
+def group_xrxd(df_gbbq):
+    """
+    从股本变迁中一次性筛选全市场的除权除息记录，按code、date排序
+    同一股票同一天重复的记录保留最后一条
+    :param df_gbbq: DataFrame 股本变迁，load_data.load_gbbq返回
+    :return DataFrame columns: ['code', 'date', '分红-前流通盘', '配股-后总股本', '配股价-前总股本', '送转股-后流通盘']
+    """
+    df = df_gbbq.loc[df_gbbq["类别"] == "除权除息", ["code", "date"] + XRXD_COLUMNS]
+    df = df.drop_duplicates(subset=["code", "date"], keep="last")
+    return df.sort_values(by=["code", "date"], kind="stable").reset_index(drop=True)
+
+
+def qfq_adjust(df_bars, df_xrxd):
     """
     前复权 涨跌幅复权法
     在每次除权发生后， 根据除权价和前一收盘价计算一个比率，称为除权因子；把截止到计算日历次的除权因子连乘，即为截止日的累积除权因子。计算前复权价，则以价格乘上累积除权因子；向后复权，则价格除以累积除权因子
 
-    对导出的日线数据结合股本变迁数据进行前复权处理
-    :param lday_path: str 日线文件路径
-    :param df_gbbq: str 股本变迁dataframe
-
-    复权处理后，将新增adj列，值为True/False，表示是否复权
+    可同时传入多只股票，全部股票的复权因子在一次向量化计算中完成
+    :param df_bars: DataFrame 不复权日线 columns: code date open high low close vol amount，date为datetime64
+    :param df_xrxd: DataFrame 除权除息记录，group_xrxd返回
+    :return DataFrame 前复权日线，按code、date排序
+        columns: ['code', 'date', 'open', 'high', 'low', 'close', 'vol', 'amount', 'adj']
+    """
+    columns = ["code", "date", "open", "high", "low", "close", "vol", "amount"]
+    df_bars = df_bars[columns]
+
+    # (股票序号, 日期)合成一个int64排序键
+    ids, uniques = pd.factorize(df_bars["code"])
+    days = df_bars["date"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+    key = ids.astype(np.int64) * 100000 + days
+    if key.shape[0] > 1 and not (key[1:] > key[:-1]).all():
+        order = np.argsort(key, kind="stable")
+        df_bars, ids, key = df_bars.iloc[order], ids[order], key[order]
+    bar_count = key.shape[0]
+
+    # 每只股票的首行、末行
+    head = np.empty(bar_count, dtype=bool)
+    head[:1] = True
+    head[1:] = ids[1:] != ids[:-1]
+
+    # 除权除息：忽略无日线的股票和上市首日之前的记录
+    xrxd_ids = pd.Index(uniques).get_indexer(df_xrxd["code"])
+    xrxd_days = df_xrxd["date"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+    first_days = np.full(uniques.shape[0], np.iinfo(np.int64).max)
+    first_days[ids[head]] = days[head]
+    valid = xrxd_ids >= 0
+    valid[valid] = xrxd_days[valid] >= first_days[xrxd_ids[valid]]
+    xrxd_key = xrxd_ids[valid].astype(np.int64) * 100000 + xrxd_days[valid]
+    xrxd_values = [df_xrxd[c].to_numpy(dtype=np.float64)[valid] for c in XRXD_COLUMNS]
+    xrxd_order = np.argsort(xrxd_key, kind="stable")
+    xrxd_key = xrxd_key[xrxd_order]
+    xrxd_values = [v[xrxd_order] for v in xrxd_values]
 
-    根据除权除息/股本变化等计算复权因子（根据该因子可直接计算出股价）
-    已经计算过的因子不需重复计算
     """
-    log.i("开始前复权")
+    因为日线数据只记录交易日的数据，非交易时间（停牌期间等）也可除权除息
+    交易日的除权除息直接并入当天的日线；非交易日的除权除息插入新行（trade为False），
+    收盘价取上一个交易日的收盘价，计算完复权因子后剔除
+    """
+    pos = np.searchsorted(key, xrxd_key)
+    matched = pos < bar_count
+    matched[matched] = key[pos[matched]] == xrxd_key[matched]
+    insert = pos[~matched]
+
+    close = df_bars["close"].to_numpy(dtype=np.float64)
+    all_close = np.insert(close, insert, close[insert - 1])
+    all_ids = np.insert(ids, insert, ids[insert - 1])
+    trade = np.insert(np.ones(bar_count, dtype=bool), insert, False)
+    xrxd_columns = []
+    for values in xrxd_values:
+        column = np.zeros(bar_count)
+        column[pos[matched]] = values[matched]
+        xrxd_columns.append(np.insert(column, insert, values[~matched]))
+    dividend, allot, allot_price, bonus = xrxd_columns
+
+    all_head = np.empty(all_ids.shape[0], dtype=bool)
+    all_head[:1] = True
+    all_head[1:] = all_ids[1:] != all_ids[:-1]
+    all_tail = np.empty(all_ids.shape[0], dtype=bool)
+    all_tail[:-1] = all_head[1:]
+    all_tail[-1:] = True
+
+    pre_close = np.roll(all_close, 1)
+    pre_close[all_head] = np.nan
+
+    # 除权收盘价 = 除权除息价 = (股权登记日的收盘价-每股所分红利现金额+配股价×每股配股数)÷(1+每股送红股数+每股配股数+每股转增股数)
+    # 除权因子 = 除权收盘价 / 除权登记日收盘价
+    # 财报中皆以10为单位分红、配转股
+    xrxd_close = (pre_close * 10 - dividend + allot * allot_price) / (
+        10 + allot + bonus
+    )
+    factor = np.roll(xrxd_close, -1) / all_close
+    factor[all_tail] = np.nan
+    factor[np.isnan(factor)] = 1
+
+    # 复权因子：每只股票从最后一天向前连乘
+    adj = pd.Series(factor[::-1]).groupby(all_ids[::-1], sort=False).cumprod()
+    adj = adj.to_numpy()[::-1][trade]
+
+    df = df_bars.reset_index(drop=True)
+    df = df.assign(
+        **{c: df[c].to_numpy() * adj for c in ["open", "high", "low", "close"]},
+        adj=adj,
+    )
+    df = df[df["open"] != 0]
+    df = df.round({"open": 2, "high": 2, "low": 2, "close": 2})
+    return df.reset_index(drop=True)
+
+
+def load_raw_lday(lday_path, code):
+    """
+    加载不复权二进制日线
+    :return DataFrame columns: code date open high low close vol amount，date为datetime64
+    """
+    df = lday_store.load(code, lday_path)
+    df.insert(0, "code", code)
+    return df
 
-    files = os.listdir(lday_path)
-    files.sort()
-    for filename in tqdm(files, desc="前复权:"):
-        # example: 000001.csv
-        code = filename[:-4]
-        df_src = pd.read_csv(
-            lday_path + os.sep + filename, encoding="utf-8", dtype={"code": str}
-        )
-        df_src["date"] = pd.to_datetime(df_src["date"], format="%Y-%m-%d")
-        df_src.set_index("date", drop=True, inplace=True)
-        # 非交易时间（停牌期间等）可除权除息/变更股本，添加trade列方便处理非交易日期的除权除息
-        df_src["trade"] = True
-
-        if "adj" in df_src.columns.to_list():
-            if True in df_src["adj"].isna().to_list():
-                begin_row = np.where(df_src["adj"].isna())[0][0]
-            else:
-                # 已复权，跳过
-                continue
-        else:
-            begin_row = 0
-            new_share = True
-
-        # 从头计算复权因子 还是增量计算后来未复权的数据
-        # 未复权的数据中 不包含除权除息数据才能增量计算
-        append = False
-
-        df_share = df_gbbq[df_gbbq["code"] == code]
-        # 新增date，方便后续设置索引合并日线dataframe , load_date 中已经设置过date
-        # df_share.loc[:, ["date"]] = pd.to_datetime(df_share["权息日"], format="%Y%m%d")
-
-        # 除权除息 exclude right/dividend
-        df_xrxd = df_share[df_share["类别"] == "除权除息"]
-        # 股本变化
-        df_capital = df_share[
-            (df_share["类别"] == "股本变化")
-            | (df_share["类别"] == "送配股上市")
-            | (df_share["类别"] == "转配股上市")
+
+def calc_factors(df_xrxd, lday_path=None):
+    """
+    根据除权除息记录和不复权日线计算全市场的复权因子表，算法同qfq_adjust
+    每次除权除息的除权因子 = 除权收盘价 / 除权除息日前一交易日收盘价，只需读取除权除息日附近的收盘价
+    上市首日及之前的除权除息忽略
+    :param df_xrxd: DataFrame 除权除息记录，group_xrxd返回
+    :param lday_path: str 不复权二进制日线目录
+    :return np.ndarray dtype为lday_store.FACTOR_DTYPE，按code、date排序
+    """
+    tables = []
+    for code, df in df_xrxd.groupby("code", sort=True):
+        records = lday_store.memmap(code, lday_path)
+        if records is None or records.shape[0] == 0:
+            continue
+        days = lday_store.to_days(df["date"])
+        # 除权除息日之前的交易日数
+        pos = np.searchsorted(records["date"], days, side="left")
+        valid = pos > 0
+        if not valid.any():
+            continue
+        close = np.asarray(records["close"][pos[valid] - 1])
+        dividend, allot, allot_price, bonus = [
+            df[c].to_numpy(dtype=np.float64)[valid] for c in XRXD_COLUMNS
         ]
+        xrxd_close = (close * 10 - dividend + allot * allot_price) / (
+            10 + allot + bonus
+        )
+        factor = xrxd_close / close
+        factor[~np.isfinite(factor)] = 1
 
-        # 送配股上市 送配股上市 转配股上市可能在同一天发生，需要保留[送转股-后流通盘]值最大的行，其余的同天数据需要丢弃。
-        # 同天使用最新值即可，无需重复计算，且下文使用日期做索引时会冲突，综上2点，需要过滤数据
-        # 做法：先升序排序，再保留重复日期的最后一条
-        df_capital = df_capital.sort_values(by="送转股-后流通盘")
-        df_capital = df_capital.drop_duplicates(subset=["权息日"], keep="last")
+        table = np.empty(factor.shape[0], dtype=lday_store.FACTOR_DTYPE)
+        table["code"] = code
+        table["date"] = days[valid]
+        # 从最后一次除权除息向前连乘
+        table["factor"] = np.cumprod(factor[::-1])[::-1]
+        tables.append(table)
 
-        # 前已新增date列，设置date为索引以合并日线dataframe
-        df_xrxd.set_index("date", drop=True, inplace=True)
-        df_capital.set_index("date", drop=True, inplace=True)
-        df_capital = df_capital.rename(columns={"送转股-后流通盘": "流通股"})
+    if not tables:
+        return np.empty(0, dtype=lday_store.FACTOR_DTYPE)
+    return np.concatenate(tables)
 
-        # 最新的除权除息日
-        if df_xrxd.empty:
-            xrxd_lastest = pd.Timestamp.today().normalize()
+
+def adjust_begin(code, raw_last, xrxd_last):
+    """
+    判断某股票的前复权从哪天开始
+    已有前复权日线，且之后没有新的除权除息时，历史复权价格不变，只需追加新增的日线
+    :param code: str 股票代码
+    :param raw_last: Timestamp 不复权日线最后日期
+    :param xrxd_last: Timestamp 最后一次除权除息日期，没有除权除息时为None
+    :return (begin, append)
+        append为False：全量复权
+        append为True：只复权并追加begin之后的日线，begin为None时无需处理
+    """
+    records = lday_store.memmap(code, cfg.ProcessedDataPath.tdx_lday_qfq_bin)
+    if records is None or records.shape[0] == 0:
+        return None, False
+    stored_last = pd.Timestamp(lday_store.from_days(records["date"][-1:])[0])
+    # 有新的除权除息，或不复权日线被重建，需要全量复权
+    if (xrxd_last is not None and xrxd_last > stored_last) or raw_last < stored_last:
+        return None, False
+    if raw_last == stored_last:
+        return None, True
+    return stored_last, True
+
+
+def adjust_frame(df_bars, df_xrxd):
+    """
+    对已加载的多只股票日线前复权并保存到前复权二进制日线目录，支持增量
+    :param df_bars: DataFrame 不复权日线，见qfq_adjust
+    :param df_xrxd: DataFrame 除权除息记录，group_xrxd返回
+    """
+    raw_last = df_bars.groupby("code", sort=False)["date"].max()
+    xrxd_last = df_xrxd.groupby("code", sort=False)["date"].max()
+
+    begins, appends = dict(), set()
+    for code, last in raw_last.items():
+        begin, append = adjust_begin(code, last, xrxd_last.get(code))
+        if append:
+            if begin is None:
+                continue
+            appends.add(code)
+        begins[code] = pd.Timestamp.min if begin is None else begin
+    if not begins:
+        return
+
+    begin = df_bars["code"].map(begins)
+    df_bars = df_bars[begin.notna() & (df_bars["date"] > begin)]
+    df_dst = qfq_adjust(df_bars, df_xrxd)
+    if df_dst.empty:
+        return
+
+    # 整体转换为定长记录后按股票切分保存
+    root = cfg.ProcessedDataPath.tdx_lday_qfq_bin
+    records = lday_store.to_records(df_dst)
+    code = df_dst["code"].to_numpy()
+    bounds = np.flatnonzero(code[1:] != code[:-1]) + 1
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, code.shape[0]]):
+        if code[lo] in appends:
+            lday_store.append_records(code[lo], records[lo:hi], root)
         else:
-            xrxd_lastest = df_xrxd.index[-1]
-        df_proceed = pd.DataFrame()
-        if begin_row > 0 and xrxd_lastest < df_src.index[begin_row]:
-            append = true
-            df_proceed = df_src
-            df_src = df_src.iloc[begin_row:]
-            df_proceed.dropna(how="any", inplace=True)
-
-        """
-        df_dst为最终要写入文件的dataframe
-        因为日线数据只记录交易日的数据
-        category列为了在非交易日除权除息而引入的辅助列。名字和值无特别意义（不为na即可）
-        含非交易日的df_xrxd数据合并到日线df_dst时，df_dst会新增行，产生的na数据需要向下填充（即需要复制前一个交易日的open close、high等数据）。
-        之后再并入df_xrxd分红、配股等列时，df_dst不会再产生新行。对并入产生的na值可以填充为0，才能计算复权因子。最后再剔除category列和非交易日的行（trade为false）
-        """
-        df_xrxd.loc[:, ["category"]] = 1.0
-        df_dst = pd.concat([df_src, df_xrxd[["category"]][df_src.index[0] :]], axis=1)
-        # avoid warnning
-        with pd.option_context("future.no_silent_downcasting", True):
-            # 非交易日的除权除息填充 trade=False
-            df_dst.fillna({"trade": False}, inplace=True)
-            # 非交易日的open/close/high 等数据填充为上一个交易日的数据
-            df_dst.ffill(inplace=True)
-
-        # 合并除权除息列
-        df_dst = pd.concat(
-            [
-                df_dst,
-                df_xrxd[
-                    [
-                        "分红-前流通盘",
-                        "配股-后总股本",
-                        "配股价-前总股本",
-                        "送转股-后流通盘",
-                    ]
-                ][df_src.index[0] :],
-            ],
-            axis=1,
-        )
-        # 交易日的 分红、配股、配股价、送转股填充为0
-        df_dst.fillna(value=0, inplace=True)
-
-        # 除权收盘价 = 除权除息价 = (股权登记日的收盘价-每股所分红利现金额+配股价×每股配股数)÷(1+每股送红股数+每股配股数+每股转增股数)
-        # 除权因子 = 除权收盘价 / 除权登记日收盘价
-        # 财报中皆以10为单位分红、配转股
-        df_dst["xrxd_close"] = (
-            df_dst["close"].shift(1) * 10
-            - df_dst["分红-前流通盘"]
-            + df_dst["配股-后总股本"] * df_dst["配股价-前总股本"]
-        ) / (10 + df_dst["配股-后总股本"] + df_dst["送转股-后流通盘"])
-        # 复权因子
-        df_dst["adj"] = (
-            (df_dst["xrxd_close"].shift(-1) / df_dst["close"])
-            .fillna(value=1)[::-1]
-            .cumprod()
-        )
-        df_dst["open"] = df_dst["open"] * df_dst["adj"]
-        df_dst["high"] = df_dst["high"] * df_dst["adj"]
-        df_dst["low"] = df_dst["low"] * df_dst["adj"]
-        df_dst["close"] = df_dst["close"] * df_dst["adj"]
-
-        # 去除trade 为false的行，只保留交易日的数据
-        df_dst = df_dst[df_dst["trade"]]
-
-        # 去除引入的计算复权因子的中间列
-        df_dst = df_dst.drop(
-            [
-                "分红-前流通盘",
-                "配股-后总股本",
-                "配股价-前总股本",
-                "送转股-后流通盘",
-                "trade",
-                "category",
-                "xrxd_close",
-            ],
-            axis=1,
-        )[df_dst["open"] != 0]
-
-        # 价格 round
-        df_dst = df_dst.round(
-            {
-                "open": 2,
-                "high": 2,
-                "low": 2,
-                "close": 2,
-            }
-        )
+            lday_store.save_records(code[lo], records[lo:hi], root)
 
-        # TODO 流通股、流通市值、换手率
 
-        if not df_proceed.empty:
-            df_dst = df_proceed.append(df_dst)
-        df_dst.reset_index(drop=False, inplace=True)
+def backward_adjust(lday_path="", df_gbbq=pd.DataFrame, chunk=500):
+    """
+    对全部不复权日线结合股本变迁数据进行前复权处理（算法见qfq_adjust），结果保存到前复权二进制日线目录
+    日常读取使用load_data.load_line_day按复权因子表即时复权，此函数用于导出完整的前复权日线
+    除权除息一次性筛选，每chunk只股票合并后向量化计算复权因子
+    已经计算过的因子不需重复计算：没有新的除权除息时只追加新增的日线
+    :param lday_path: str 不复权二进制日线目录
+    :param df_gbbq: DataFrame 股本变迁dataframe
+    :param chunk: int 每批处理的股票数，控制内存占用
+    """
+    log.i("开始前复权")
 
-        df_dst.to_csv(
-            cfg.ProcessedDataPath.tdx_lday_qfq + os.sep + filename, encoding="utf-8"
-        )
-        df_dst.to_pickle(
-            cfg.ProcessedDataPath.tdx_pickle + os.sep + filename[:-4] + ".pkl"
+    df_xrxd = group_xrxd(df_gbbq)
+    codes = lday_store.codes(lday_path)
+    for i in tqdm(range(0, len(codes), chunk), desc="前复权:"):
+        df_bars = pd.concat(
+            [load_raw_lday(lday_path, code) for code in codes[i : i + chunk]],
+            ignore_index=True,
         )
-        # return
+        adjust_frame(df_bars, df_xrxd)
 
 
-def gbbq_to_csv(src_path="", dst_path=""):
+def lday_task(convert, src, dst, file_name, mark=None):
     """
-    从通达信中解析股本变迁
+    单只股票日线转换，各股票相互独立，可在进程池中并行执行
+    :param convert: 转换函数，lday_to_store或lday_to_csv
+    :param src: str 二进制文件路径
+    :param dst: str 保存目录
+    :param file_name: str 二进制文件名。example: sh000001.day
+    :param mark: tuple 该股票的水位线，为None时全量转换
+    :return (code, mark, error) 转换后的水位线；error为None表示成功，否则为异常堆栈，水位线保持不变
+    """
+    code = file_name[2:-4]
+    watermark = dict() if mark is None else {code: mark}
+    try:
+        convert(src, dst, file_name, watermark)
+    except Exception:
+        return code, mark, traceback.format_exc()
+    return code, watermark[code], None
+
+
+def gbbq_to_store(src_path="", dst_path=""):
+    """
+    从通达信中解析股本变迁，按code、权息日排序保存为二进制格式（gbbq_store）
+    类别保存为类别代码，加载时转换为Categorical
     :param src_path: str 通达信股本变迁原文件
     :param dst_path: str 解析后的股本变迁文件路径
     """
     log.i("开始处理股本变迁")
     start = time.time()
 
-    category = {
-        "1": "除权除息",
-        "2": "送配股上市",
-        "3": "非流通股上市",
-        "4": "未知股本变动",
-        "5": "股本变化",
-        "6": "增发新股",
-        "7": "股份回购",
-        "8": "增发新股上市",
-        "9": "转配股上市",
-        "10": "可转债上市",
-        "11": "扩缩股",
-        "12": "非流通股缩股",
-        "13": "送认购权证",
-        "14": "送认沽权证",
-    }
+    import pytdx.reader.gbbq_reader
 
     df_gbbq = pytdx.reader.gbbq_reader.GbbqReader().get_df(src_path)
     df_gbbq.drop(columns=["market"], inplace=True)
-    df_gbbq.columns = [
-        "code",
-        "权息日",
-        "类别",
-        "分红-前流通盘",
-        "配股价-前总股本",
-        "送转股-后流通盘",
-        "配股-后总股本",
+    df_gbbq.columns = ["code", "权息日", "类别"] + gbbq_store.COLUMNS
+    gbbq_store.save(gbbq_store.to_records(df_gbbq), dst_path)
+
+    log.i(f"股本变迁:end,共{df_gbbq.shape[0]}条,用时{(time.time() - start):.2f}秒")
+
+
+# 专业财务文件格式，参考c语言数据结构finance_define.c
+# 文件头 example: (1, 20220331, 4831, 720896, 2324, 0)
+CW_HEADER_DTYPE = np.dtype(
+    [
+        ("version", "<i2"),
+        ("date", "<u4"),
+        ("total", "<u2"),
+        ("unknown_2", "<u4"),
+        ("chunk_size", "<u4"),
+        ("unknown_3", "<u4"),
     ]
-    df_gbbq["类别"] = df_gbbq["类别"].astype("object")
-    df_gbbq["code"] = df_gbbq["code"].astype("object")
-    for i in range(df_gbbq.shape[0]):
-        df_gbbq.iat[i, df_gbbq.columns.get_loc("类别")] = category[
-            str(df_gbbq.iat[i, df_gbbq.columns.get_loc("类别")])
-        ]
-    df_gbbq.to_csv(dst_path, encoding="utf-8", index=False)
-
-    log.i(f"前复权:end,用时{(time.time() - start):.2f}秒")
+)
+# 每只股票的头：股票代码、填充、财务数据块的文件偏移量
+CW_SHARE_DTYPE = np.dtype([("code", "S6"), ("pad", "S1"), ("offset", "<u4")])
 
 
-def load_cw_dat(path):
+def decode_cw_header(buf):
     """
-    :param path :str: dat file path
+    解码专业财务文件的文件头和股票头
+    :param buf: bytes 文件开头，至少包含全部股票头
+    :return (header, shares) 结构化数组，dtype为CW_HEADER_DTYPE、CW_SHARE_DTYPE
+    """
+    header = np.frombuffer(buf, dtype=CW_HEADER_DTYPE, count=1)[0]
+    shares = np.frombuffer(
+        buf,
+        dtype=CW_SHARE_DTYPE,
+        count=int(header["total"]),
+        offset=CW_HEADER_DTYPE.itemsize,
+    )
+    return header, shares
 
-    :return: DataFrame
 
-    已参考了别人的读取写了读取的代码，这里又直接使用了pytdx库直接读，稍微处理下列做兼容
+def load_cw_header(path):
     """
-
+    只读取专业财务文件的文件头和股票头，不读取财务数据
+    :return (date, codes, fields) 报告期、股票代码、字段数
+    """
+    with open(path, "rb") as file:
+        buf = file.read(CW_HEADER_DTYPE.itemsize)
+        total = int(np.frombuffer(buf, dtype=CW_HEADER_DTYPE)[0]["total"])
+        buf += file.read(CW_SHARE_DTYPE.itemsize * total)
+    header, shares = decode_cw_header(buf)
+    return (
+        int(header["date"]),
+        shares["code"].astype(str),
+        int(header["chunk_size"]) // 4,
+    )
+
+
+def parse_cw_dat(buf):
+    """
+    解析专业财务文件，文件头、股票头、财务数据块均使用numpy结构化数组整体解码
+    财务数据块的偏移量可能有填充而不连续，按偏移量计算每个字节的下标一次取出
+    :param buf: bytes 专业财务文件内容
+    :return (date, codes, data)
+        date: int 报告期，如20220331
+        codes: np.ndarray str 股票代码
+        data: np.ndarray float32 财务数据，shape为(股票数, 字段数)
     """
-    方案一：
-    使用pytdx.reader 直接读取
-    df = HistoryFinancialReader().get_df(path)
-    # 将日期移动到最后
-    date = df["report_date"].to_list()
-    df.drop("report_date", axis=1, inplace=True)
+    header, shares = decode_cw_header(buf)
+    total, chunk_size = int(header["total"]), int(header["chunk_size"])
+    codes = shares["code"].astype(str)
+    offsets = shares["offset"].astype(np.int64)
+
+    begin = CW_HEADER_DTYPE.itemsize + CW_SHARE_DTYPE.itemsize * total
+    expect = begin + np.arange(total, dtype=np.int64) * chunk_size
+    if (offsets == expect).all():
+        # 没有填充，数据块连续存放
+        data = np.frombuffer(
+            buf, dtype="<f4", count=total * chunk_size // 4, offset=begin
+        ).reshape(total, chunk_size // 4)
+    else:
+        raw = np.frombuffer(buf, dtype=np.uint8)
+        index = offsets[:, None] + np.arange(chunk_size // 4 * 4)[None, :]
+        data = raw[index].view("<f4")
+    return int(header["date"]), codes, data
 
-    # 索引code自动变为第一列
-    df = df.reset_index(drop=False)
-    df.columns = [i for i in range(df.shape[1])]
-    df["report_date"] = date
-    return df
+
+def load_cw_dat(path):
     """
+    :param path :str: dat file path
 
-    # 方案二
-    # 参考c语言数据结构finance_define.c，手动读取
-    header_format = "<hIH3L"
-    header_size = struct.calcsize(header_format)
-    share_header_chunk_format = "<6scL"
-    share_header_chunk_size = struct.calcsize(share_header_chunk_format)
+    :return: DataFrame
+
+    读取专业财务文件，列0为股票代码，列1~N为财务数据（见tdx_mapping.finance_mapping）
+    """
     with open(path, "rb") as file:
-        # shares_header example: (1, 20220331, 4831, 720896, 2324, 0)
-        shares_header = unpack(header_format, file.read(header_size))
-        date = shares_header[1]
-        total = shares_header[2]
-        cw_chunk_size = shares_header[4]
-        cw_chunk_format = "<{}f".format(int(cw_chunk_size / 4))
-
-        datas = []
-        """
-        参考pytdx reader库的实现
-        此方案缺点：较多的前后seek，可能有性能问题
-        for index in range(total):
-            file.seek(header_size + index * share_header_chunk_size)
-            item = unpack(share_header_chunk_format, file.read(share_header_chunk_size))
-            code = item[0].decode("utf-8")
-            length = item[2]
-
-            file.seek(length)
-            cw = list(unpack(cw_chunk_format, file.read(cw_chunk_size)))
-            cw.insert(0, code)
-
-            datas.append(cw)
-        """
-        # [(code,offset)] (股票代码,文件偏移量)
-        code_offsets = []
-        for index in range(total):
-            share_header = unpack(
-                share_header_chunk_format, file.read(share_header_chunk_size)
-            )
-            code, offset = share_header[0].decode("utf-8"), share_header[2]
-            code_offsets.append((code, offset))
-
-        for code_of in code_offsets:
-            code, offset = code_of[0], code_of[1]
-            if file.tell() != offset:
-                print(
-                    f"{code}有填充，offset不一致,recode={offset},current_offset={file.tell()}"
-                )
-                file.seek(offset)
-            cw = list(unpack(cw_chunk_format, file.read(cw_chunk_size)))
-            cw.insert(0, code)
-
-            datas.append(cw)
-
-        df = pd.DataFrame(datas)
-        return df
+        _, codes, data = parse_cw_dat(file.read())
+    df = pd.DataFrame(
+        data.astype(np.float64), columns=range(1, data.shape[1] + 1), copy=False
+    )
+    df.insert(0, 0, codes)
+    return df
 
 
 if __name__ == "__main__":
-    gbbq_to_csv(cfg.TdxCfg.ori_gbbq, cfg.ProcessedDataPath.tdx_gbbq)
+    gbbq_to_store(cfg.TdxCfg.ori_gbbq, cfg.ProcessedDataPath.tdx_gbbq)
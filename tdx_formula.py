@@ -0,0 +1,397 @@
+"""
+通达信公式编译器
+将通达信公式文本解析为表达式DAG，相同的子表达式只保留一个节点，计算时每个节点只计算一次
+可以对单只股票的日线或全市场的面板（日期×股票）向量化计算
+
+支持的语法
+变量: C/CLOSE O/OPEN H/HIGH L/LOW V/VOL AMO/AMOUNT
+运算: + - * / > < >= <= = <> != AND OR NOT && ||，注释 {...}
+      NOT的优先级低于比较运算，NOT C>O 即 NOT(C>O)
+语句: 以;分隔，中间变量 X:=表达式; 输出 X:表达式; 不带名称的表达式也作为输出，名称为表达式文本
+函数: 见FUNCTIONS，MA(X,N)为N周期简单移动平均序列
+
+例如
+formula = compile_formula("MA5:=MA(C,5); MA20:=MA(C,20); XG:CROSS(MA5,MA20) AND C>REF(C,1);")
+result = formula(load_data.load_line_day("000001"))
+result["XG"]
+"""
+
+import re
+
+import numpy as np
+
+import tdx_ta_func as ta
+
+# 变量名对应的日线列名
+VARIABLES = {
+    "C": "close",
+    "CLOSE": "close",
+    "O": "open",
+    "OPEN": "open",
+    "H": "high",
+    "HIGH": "high",
+    "L": "low",
+    "LOW": "low",
+    "V": "vol",
+    "VOL": "vol",
+    "AMO": "amount",
+    "AMOUNT": "amount",
+}
+
+
+def _truth(value):
+    """通达信的条件：非0为真，nan为假"""
+    value = np.asarray(value)
+    if value.dtype == bool:
+        return value
+    return (value != 0) & ~np.isnan(value)
+
+
+def _number(value):
+    """参与算术运算时条件转换为1/0"""
+    value = np.asarray(value)
+    return value.astype(float) if value.dtype == bool else value
+
+
+def _ma(x, n):
+    # 通达信的MA为序列，对应tdx_ta_func.SMA
+    return ta.SMA(x, n)
+
+
+# 函数名: (实现, 参数类型)
+# 参数类型 x: 序列  c: 条件序列  n: 整数常量
+FUNCTIONS = {
+    "MA": (_ma, "xn"),
+    "REF": (ta.REF, "xn"),
+    "HHV": (ta.HHV, "xn"),
+    "LLV": (ta.LLV, "xn"),
+    "CROSS": (ta.CROSS, "xx"),
+    "COUNT": (ta.COUNT, "cn"),
+    "EXIST": (ta.EXIST, "cn"),
+    "EVERY": (ta.EVERY, "cn"),
+    "BARSLAST": (ta.BARSLAST, "c"),
+    "BARSLASTCOUNT": (ta.BARSLASTCOUNT, "c"),
+    "VALUEWHEN": (ta.VALUEWHEN, "cx"),
+    "IF": (lambda c, a, b: np.where(c, a, b), "cxx"),
+    "ABS": (np.abs, "x"),
+    "MAX": (np.maximum, "xx"),
+    "MIN": (np.minimum, "xx"),
+    "NOT": (np.logical_not, "c"),
+}
+
+# 运算符的实现，AND/OR/NOT的操作数按条件处理，算术运算的操作数按数值处理
+OPERATORS = {
+    "+": lambda a, b: _number(a) + _number(b),
+    "-": lambda a, b: _number(a) - _number(b),
+    "*": lambda a, b: _number(a) * _number(b),
+    "/": lambda a, b: _number(a) / _number(b),
+    ">": lambda a, b: _number(a) > _number(b),
+    "<": lambda a, b: _number(a) < _number(b),
+    ">=": lambda a, b: _number(a) >= _number(b),
+    "<=": lambda a, b: _number(a) <= _number(b),
+    "=": lambda a, b: _number(a) == _number(b),
+    "<>": lambda a, b: _number(a) != _number(b),
+    "AND": lambda a, b: _truth(a) & _truth(b),
+    "OR": lambda a, b: _truth(a) | _truth(b),
+    "NEG": lambda a: -_number(a),
+    "NOT": lambda a: ~_truth(a),
+}
+
+# 操作数可交换的运算，规范化操作数顺序后 A+B 与 B+A 为同一节点
+COMMUTATIVE = {"+", "*", "=", "<>", "AND", "OR"}
+
+# 比较运算交换操作数后的运算，A<B 与 B>A 为同一节点
+MIRROR = {"<": ">", "<=": ">="}
+
+_TOKEN = re.compile(
+    r"\s+|\{[^}]*\}"
+    r"|(?P<number>\d+\.?\d*|\.\d+)"
+    r"|(?P<name>[^\W\d]\w*)"
+    r"|(?P<op>:=|<=|>=|<>|!=|&&|\|\||[-+*/()<>=,:;])"
+)
+
+
+def tokenize(text):
+    """
+    公式文本拆分为(类型, 值, 起始位置, 结束位置)列表，类型为number/name/op，名称转换为大写
+    """
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError(f"无法识别的字符: {text[pos:pos + 10]}")
+        pos = match.end()
+        kind = match.lastgroup
+        if kind is None:
+            continue
+        value = match.group(kind)
+        if kind == "number":
+            value = float(value)
+        elif kind == "name":
+            value = value.upper()
+        elif value in ("&&", "||", "!="):
+            value = {"&&": "AND", "||": "OR", "!=": "<>"}[value]
+        if kind == "name" and value in ("AND", "OR"):
+            kind = "op"
+        tokens.append((kind, value, match.start(), match.end()))
+    return tokens
+
+
+class Formula:
+    """
+    编译后的公式
+    nodes: list 表达式节点 (运算, 参数...)，按依赖顺序排列，参数为节点下标或整数常量
+    outputs: dict 输出名称: 节点下标
+    terms: int 去重前的节点数
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.outputs = dict()
+        self.terms = 0
+        self._index = dict()
+
+    def node(self, op, *args):
+        """
+        添加节点，已存在相同的节点时返回已有节点的下标
+        """
+        self.terms += 1
+        if op in MIRROR:
+            op, args = MIRROR[op], args[::-1]
+        elif op in COMMUTATIVE:
+            args = tuple(sorted(args))
+        key = (op,) + args
+        index = self._index.get(key)
+        if index is None:
+            index = len(self.nodes)
+            self.nodes.append(key)
+            self._index[key] = index
+        return index
+
+    def constant(self, index):
+        """节点为常量时返回常量值，否则返回None"""
+        node = self.nodes[index]
+        return node[1] if node[0] == "CONST" else None
+
+    def _children(self, index):
+        op, args = self.nodes[index][0], self.nodes[index][1:]
+        if op in ("CONST", "VAR"):
+            return []
+        if op in FUNCTIONS:
+            spec = FUNCTIONS[op][1]
+            return [arg for arg, kind in zip(args, spec) if kind != "n"]
+        return list(args)
+
+    def __call__(self, data):
+        """
+        计算公式
+        :param data: 单只股票日线DataFrame（包含open high low close vol amount列），
+                     或{列名: 面板}，面板为日期×股票的DataFrame或二维numpy数组
+        :return dict 输出名称: 结果，与传入的列类型一致（Series、DataFrame或numpy数组）
+        """
+        values = [None] * len(self.nodes)
+
+        # 只计算输出依赖的节点，节点最后一次被使用后释放
+        needed = [False] * len(self.nodes)
+        last = [-1] * len(self.nodes)
+        for index in self.outputs.values():
+            needed[index] = True
+        for index in range(len(self.nodes) - 1, -1, -1):
+            if needed[index]:
+                for child in self._children(index):
+                    needed[child] = True
+                    last[child] = max(last[child], index)
+        keep = set(self.outputs.values())
+
+        # 结果的类型和形状取自第一个使用的变量，没有变量时取收盘价；
+        # 常量参数的函数可能在任何变量之前计算，须先确定形状
+        columns = [
+            VARIABLES[node[1]]
+            for index, node in enumerate(self.nodes)
+            if needed[index] and node[0] == "VAR"
+        ]
+        like = data[columns[0] if columns else "close"]
+        shape = ta._values(like).shape
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for index, node in enumerate(self.nodes):
+                if not needed[index]:
+                    continue
+                op, args = node[0], node[1:]
+                if op == "CONST":
+                    values[index] = args[0]
+                elif op == "VAR":
+                    column = data[VARIABLES[args[0]]]
+                    values[index] = ta._values(column).astype(float)
+                elif op in FUNCTIONS:
+                    func, spec = FUNCTIONS[op]
+                    params = []
+                    for arg, kind in zip(args, spec):
+                        if kind == "n":
+                            params.append(arg)
+                            continue
+                        # 常量参数扩展为序列
+                        value = np.broadcast_to(values[arg], shape)
+                        params.append(_truth(value) if kind == "c" else _number(value))
+                    values[index] = func(*params)
+                else:
+                    values[index] = OPERATORS[op](*[values[arg] for arg in args])
+                for child in self._children(index):
+                    if last[child] == index and child not in keep:
+                        values[child] = None
+
+        result = dict()
+        for name, index in self.outputs.items():
+            value = np.broadcast_to(values[index], shape)
+            result[name] = ta._wrap(np.array(value), like)
+        return result
+
+
+class _Parser:
+    """
+    递归下降解析，优先级从低到高: OR, AND, NOT, 比较, 加减, 乘除, 负号
+    NOT后为(时按函数NOT(X)解析
+    """
+
+    def __init__(self, text, formula):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.formula = formula
+        self.names = dict()
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None, None, len(self.text), len(self.text)
+
+    def take(self, value=None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise ValueError(f"公式第{self.pos + 1}个符号应为{value}，实际为{token[1]}")
+        self.pos += 1
+        return token
+
+    def statements(self):
+        while self.peek()[0] is not None:
+            if self.peek()[1] == ";":
+                self.take()
+                continue
+            start = self.pos
+            name = None
+            if (
+                self.peek()[0] == "name"
+                and self.pos + 1 < len(self.tokens)
+                and self.tokens[self.pos + 1][1] in (":=", ":")
+            ):
+                name = self.take()[1]
+                output = self.take()[1] == ":"
+            else:
+                output = True
+            index = self.expression()
+            if name is not None:
+                self.names[name] = index
+            if output:
+                if name is None:
+                    begin, end = self.tokens[start][2], self.tokens[self.pos - 1][3]
+                    name = self.text[begin:end]
+                self.formula.outputs[name] = index
+            if self.peek()[0] is not None:
+                self.take(";")
+
+    def binary(self, operand, ops):
+        left = operand()
+        while self.peek()[0] == "op" and self.peek()[1] in ops:
+            op = self.take()[1]
+            left = self.apply(op, left, operand())
+        return left
+
+    def apply(self, op, *args):
+        constants = [self.formula.constant(arg) for arg in args]
+        if None not in constants:
+            # 常量折叠
+            return self.formula.node("CONST", float(OPERATORS[op](*constants)))
+        return self.formula.node(op, *args)
+
+    def expression(self):
+        return self.binary(self.conjunction, ("OR",))
+
+    def conjunction(self):
+        return self.binary(self.negation, ("AND",))
+
+    def negation(self):
+        if self.peek()[:2] == ("name", "NOT") and self.pos + 1 < len(self.tokens):
+            if self.tokens[self.pos + 1][1] != "(":
+                self.take()
+                return self.apply("NOT", self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        return self.binary(self.additive, (">", "<", ">=", "<=", "=", "<>"))
+
+    def additive(self):
+        return self.binary(self.term, ("+", "-"))
+
+    def term(self):
+        return self.binary(self.unary, ("*", "/"))
+
+    def unary(self):
+        if self.peek()[1] == "-":
+            self.take()
+            return self.apply("NEG", self.unary())
+        if self.peek()[1] == "+":
+            self.take()
+            return self.unary()
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()[:2]
+        if kind == "number":
+            return self.formula.node("CONST", value)
+        if kind == "op" and value == "(":
+            index = self.expression()
+            self.take(")")
+            return index
+        if kind != "name":
+            raise ValueError(f"公式第{self.pos}个符号{value}不能作为操作数")
+        if self.peek()[1] == "(":
+            return self.call(value)
+        if value in self.names:
+            return self.names[value]
+        if value in VARIABLES:
+            return self.formula.node("VAR", VARIABLES[value].upper())
+        raise ValueError(f"未定义的变量: {value}")
+
+    def call(self, name):
+        if name not in FUNCTIONS:
+            raise ValueError(f"不支持的函数: {name}")
+        spec = FUNCTIONS[name][1]
+        self.take("(")
+        args = [self.expression()]
+        while self.peek()[1] == ",":
+            self.take()
+            args.append(self.expression())
+        self.take(")")
+        if len(args) != len(spec):
+            raise ValueError(f"函数{name}需要{len(spec)}个参数，实际为{len(args)}个")
+        for i, kind in enumerate(spec):
+            if kind == "n":
+                constant = self.formula.constant(args[i])
+                if constant is None or constant != int(constant):
+                    raise ValueError(f"函数{name}的第{i + 1}个参数须为整数常量")
+                args[i] = int(constant)
+        return self.formula.node(name, *args)
+
+
+def compile_formula(text):
+    """
+    编译通达信公式
+    :param text: str 公式文本
+    :return Formula 调用formula(data)计算
+    """
+    formula = Formula()
+    _Parser(text, formula).statements()
+    if not formula.outputs:
+        raise ValueError("公式没有输出")
+    return formula
@@ -1,8 +1,10 @@
 '''
 模仿通达信语句的函数库，如MA(C,5) REF(C,1)等样式。函数简单，只为了和通达信公式看起来一致，方便排查。
-传入类型必须是pandas Series类型。
-传出类型：只有MA输出具体数值，其他所有函数传出仍然是Series类型
+传入类型为pandas Series类型；全部函数还支持面板模式，
+传入二维的DataFrame或numpy数组（日期×股票，停牌或未上市为nan），按列一次计算全市场，结果与逐列计算一致。
+传出类型：只有MA输出具体数值（面板模式为每只股票的数值），其他所有函数传出与传入的类型一致
 '''
+import numpy as np
 import pandas as pd
 
 
@@ -15,25 +17,85 @@ def rolling_window(a, window):
     return sliding_window_view(a, window_shape=window)
 
 
+def _values(value):
+    """Series/DataFrame/数组统一转换为numpy数组，DataFrame为二维（日期×股票）"""
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        return value.to_numpy()
+    return np.asarray(value)
+
+
+def _wrap(result, like):
+    """计算结果按传入类型返回：Series、DataFrame或numpy数组"""
+    if isinstance(like, pd.Series):
+        return pd.Series(result, index=like.index)
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(result, index=like.index, columns=like.columns)
+    return result
+
+
+def _shift(a, day):
+    """按第0维（日期）后移day个周期，空出的位置为nan"""
+    result = np.full(a.shape, np.nan)
+    if day < a.shape[0]:
+        result[day:] = a[: a.shape[0] - day]
+    return result
+
+
 def REF(value, day):
     """
-    引用若干周期前的数据。如果传入列表，返回具体数值。如果传入序列，返回序列
+    引用若干周期前的数据。如果传入列表，返回具体数值。如果传入序列或面板，返回序列或面板
     """
-    if 'list' in str(type(value)):
+    if isinstance(value, list):
         result = value[~day]
-    elif 'series' in str(type(value)):
+    elif isinstance(value, (pd.Series, pd.DataFrame)):
         result = value.shift(periods=day)
+    else:
+        result = _shift(np.asarray(value, dtype=float), day)
     return result
 
 
+_talib_module = None
+
+
+def _talib():
+    """首次使用时导入talib，之后直接返回，只用其他函数时不导入"""
+    global _talib_module
+    if _talib_module is None:
+        import talib
+        _talib_module = talib
+    return _talib_module
+
+
 def MA(value, day) -> float:
     """
     返回当前周期的简单移动平均值。传入可以是列表或序列类型。传出是当前周期的简单移动平均具体值。
+    面板模式返回每只股票当前周期的值
     :rtype: float
     """
-    import talib
+    if np.ndim(value) == 2:
+        result = SMA(value, day)
+        return result.iloc[-1] if isinstance(result, pd.DataFrame) else result[-1]
     # result = statistics.mean(value[-day:])
-    result = talib.SMA(value, day).iat[-1]
+    result = _talib().SMA(value, day).iat[-1]
+    return result
+
+
+def _sma_panel(a, day):
+    """
+    面板的简单移动平均，按日期逐行计算，每行对全部股票向量化
+    计算顺序与talib.SMA一致：每列从第一个非nan值开始累加，之后的nan会传播
+    """
+    result = np.full(a.shape, np.nan)
+    begin = np.argmax(~np.isnan(a), axis=0)
+    begin[np.isnan(a).all(axis=0)] = a.shape[0]
+    total = np.zeros(a.shape[1])
+    for i in range(a.shape[0]):
+        started = begin <= i
+        total += np.where(started, a[i], 0.0)
+        ready = begin + day - 1 <= i
+        result[i, ready] = total[ready] / day
+        if i - day + 1 >= 0:
+            total -= np.where(ready, a[i - day + 1], 0.0)
     return result
 
 
@@ -41,30 +103,39 @@ def SMA(value, day):
     """
     返回简单移动平均序列。传入可以是列表或序列类型。传出是历史到当前周期为止的简单移动平均序列。
     """
-    import talib
+    if np.ndim(value) == 2:
+        return _wrap(_sma_panel(_values(value).astype(float), day), value)
     # result = statistics.mean(value[-day:])
-    result = talib.SMA(value, day)
+    result = _talib().SMA(value, day)
     return result
 
 
+def _extreme(series, day, accumulate, rolling):
+    """
+    HHV/LLV的实现，按第0维（日期）计算，支持一维和二维
+    day=0时为从第一个周期到当前的累计最大/最小值，nan不参与比较（取之前的值）；第一个值为nan时全部为nan
+    day>0时为day周期内的最大/最小值，不足day周期的部分按day=0计算
+    """
+    a = _values(series).astype(float)
+    if day == 0:
+        value = accumulate(a, axis=0) if a.shape[0] else a.copy()
+        if a.shape[0]:
+            # 第一个值为nan的列全部为nan
+            value[..., np.isnan(a[0])] = np.nan
+    else:
+        frame = pd.DataFrame(a) if a.ndim == 2 else pd.Series(a)
+        value = np.array(getattr(frame.rolling(day), rolling)(), dtype=float)
+        warm = min(day - 1, a.shape[0])
+        value[:warm] = _extreme(a[:warm], 0, accumulate, rolling)
+    return _wrap(value, series)
+
+
 def HHV(series, day):
     """
     返回最大值
     """
     # value = max(series[-day:])
-    if day == 0:
-        value = pd.Series(index=series.index, dtype=float)
-        tmp = series.iat[0]
-        value.iat[0] = tmp
-        for i in range(series.shape[0]):
-            if tmp < series.iat[i]:
-                tmp = series.iat[i]
-                value.iat[i] = tmp
-        value = value.fillna(method='ffill')  # 向下填充无效值
-    else:
-        value = series.rolling(day).max()
-        value.iloc[0:day-1] = HHV(series.iloc[0:day-1], 0)
-    return value
+    return _extreme(series, day, np.fmax.accumulate, 'max')
 
 
 def LLV(series, day):
@@ -72,48 +143,55 @@ def LLV(series, day):
     返回最小值
     """
     # value = min(value[-day:])
-    if day == 0:
-        value = pd.Series(index=series.index, dtype=float)
-        tmp = series.iat[0]
-        value.iat[0] = tmp
-        for i in range(series.shape[0]):
-            if tmp > series.iat[i]:
-                tmp = series.iat[i]
-                value.iat[i] = tmp
-        value = value.fillna(method='ffill')  # 向下填充无效值
-    else:
-        value = series.rolling(day).min()
-        value.iloc[0:day - 1] = LLV(series.iloc[0:day - 1], 0)
-    return value
+    return _extreme(series, day, np.fmin.accumulate, 'min')
 
 
-def COUNT(series, n):
-    # rolling方法不行，虽然简单明了但是性能太差
-    # result = series.rolling(n) \
-    #     .apply(lambda x: x.value_counts().to_dict()[True] if True in x.value_counts().to_dict() else 0)
-    df = series.to_frame('cond')
-    df.insert(df.shape[1], 'result', 0)
-    for index_true in df.loc[df['cond'] == True].index.to_list():
-        index_int = df.index.get_loc(index_true)
-        column_int = df.columns.get_loc('result')
-        df.iloc[index_int:index_int + n, column_int] = df.iloc[index_int:index_int + n, column_int] + 1
-    result = df['result']
+def _window_count(cond, n):
+    """
+    前缀和计算n周期内条件成立的次数，按第0维（日期）计算，支持一维和二维
+    不足n周期时统计已有的周期，n=0时统计从第一个周期起的全部周期
+    """
+    total = np.cumsum(_values(cond) == True, axis=0, dtype=np.int32)
+    if not 0 < n < total.shape[0]:
+        return total
+    result = np.empty_like(total)
+    result[:n] = total[:n]
+    np.subtract(total[n:], total[:-n], out=result[n:])
     return result
 
 
+def COUNT(series, n):
+    # 统计n周期中满足条件的周期数，n=0时从第一个周期开始
+    # 传入可以是Series，也可以是二维的DataFrame/数组（日期×股票），各列分别统计
+    # 与通达信一致：n=0时为累计次数（原实现n=0时全部为0）
+    return _wrap(_window_count(series, n), series)
+
+
 def EXIST(cond, n):
-    series = cond[-n:]
-    if True in series.to_list():
-        return True
-    else:
-        return False
+    # n周期内是否存在满足条件的周期，返回与传入类型一致的bool序列（面板）
+    # 与通达信一致：每个周期都计算（原实现只判断最后n个周期，返回一个bool值），
+    # 原来的结果为返回序列的最后一个值，即EXIST(cond, n).iat[-1]
+    return _wrap(_window_count(cond, n) > 0, cond)
+
+
+def EVERY(cond, n):
+    # n周期内是否一直满足条件，不足n周期时为False；n=0时为从第一个周期起是否一直满足
+    total = _window_count(cond, n)
+    if n == 0:
+        n = np.arange(1, total.shape[0] + 1).reshape((-1,) + (1,) * (total.ndim - 1))
+    return _wrap(total == n, cond)
 
 
 def CROSS(s1, s2):
-    cond1 = s1 > s2
-    cond2 = s1.shift() <= s2.shift()
-    result = cond1 & cond2
-    return result
+    # s1上穿s2，s2可以是数值
+    if isinstance(s1, (pd.Series, pd.DataFrame)):
+        cond1 = s1 > s2
+        cond2 = s1.shift() <= (s2.shift() if isinstance(s2, type(s1)) else s2)
+        result = cond1 & cond2
+        return result
+    a = np.asarray(s1, dtype=float)
+    b = np.asarray(s2, dtype=float)
+    return (a > b) & (_shift(a, 1) <= (_shift(b, 1) if b.ndim else b))
 
 
 def BARSLAST(series):
@@ -122,16 +200,13 @@ def BARSLAST(series):
     #  BARSLAST(X):上一次X不为0到现在的天数
     # 例如:
     #  BARSLAST(CLOSE/REF(CLOSE,1)>=1.1)表示上一个涨停板到当前的周期数
-    result = pd.Series(index=series.index, dtype=int)
-    i = 0
-    for k, v in series.items():
-        if v:
-            i = 0
-            result[k] = i
-        else:
-            i = i + 1
-            result[k] = i
-    return result
+    # 条件从未成立时，从第一个周期起为1、2、3...
+    cond = _values(series) != 0
+    index = np.arange(cond.shape[0]).reshape((-1,) + (1,) * (cond.ndim - 1))
+    last = np.where(cond, index, -1)
+    if cond.shape[0]:
+        last = np.maximum.accumulate(last, axis=0)
+    return _wrap(index - last, series)
 
 
 def BARSLASTCOUNT(cond):
@@ -140,20 +215,23 @@ def BARSLASTCOUNT(cond):
     #  BARSLASTCOUNT(X),统计连续满足X条件的周期数.
     # 例如:
     #  BARSLASTCOUNT(CLOSE>OPEN)表示统计连续收阳的周期数
-    result = pd.Series(index=cond.index, dtype=int)
-    i = 0
-    for k, v in cond.iteritems():
-        if v:
-            i = i + 1
-            result[k] = i
-        else:
-            i = 0
-            result[k] = i
-    return result
+    # 累计成立次数减去最近一次不成立时的累计次数
+    true = _values(cond) != 0
+    total = np.cumsum(true, axis=0)
+    if true.shape[0]:
+        reset = np.maximum.accumulate(np.where(true, 0, total), axis=0)
+    else:
+        reset = total
+    return _wrap(total - reset, cond)
 
 
 def VALUEWHEN(cond, value_series):
-    result = pd.Series(index=cond.index, dtype=float)
-    result.loc[cond.loc[cond==True].keys()] = value_series.loc[cond.loc[cond==True].keys()]
-    result = result.fillna(method='ffill')  # 向下填充无效值
-    return result
+    # 条件成立时取当前值，否则取上一次条件成立（且值有效）时的值
+    value = _values(value_series).astype(float)
+    valid = (_values(cond) == True) & ~np.isnan(value)
+    index = np.arange(valid.shape[0]).reshape((-1,) + (1,) * (valid.ndim - 1))
+    index = np.where(valid, index, -1)
+    if valid.shape[0]:
+        index = np.maximum.accumulate(index, axis=0)
+    last = np.take_along_axis(value, np.maximum(index, 0), axis=0)
+    return _wrap(np.where(index >= 0, last, np.nan), cond)
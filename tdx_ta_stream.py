@@ -0,0 +1,289 @@
+"""
+增量计算的指标，每个新周期只更新状态，结果与tdx_ta_func对全部历史重新计算一致
+每个指标一个对象，状态为各股票的数组（滑动窗口、累加和、计数），一次更新全部股票，
+状态可以保存到文件，下次运行时恢复后继续追加新周期
+
+例如
+ma = SMA(20)
+ma.extend(panel["close"])  # 日期×股票的全部历史，返回日期×股票的指标值
+value = ma.update(close)  # 收盘后追加一天，close为各股票当日收盘价的数组，返回各股票的指标值
+
+单只股票时传入序列和标量，返回标量。股票的顺序须与建立状态时一致，停牌的股票传入nan
+状态基于传入的序列，前复权价格在除权除息后会整体变化，需要对新的复权序列重新extend
+"""
+
+import json
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class Indicator(ABC):
+    """
+    增量指标的基类
+    子类实现update，_arrays为状态中的数组属性名，第一次update时按传入值的形状创建
+    """
+
+    _arrays = ()
+
+    @abstractmethod
+    def update(self, value):
+        """
+        追加一个新周期
+        :param value: 各股票新周期的值，np.ndarray或标量
+        :return 新周期的指标值，形状与value相同
+        """
+
+    def extend(self, values):
+        """
+        依次追加多个周期
+        :param values: 序列或日期×股票的面板
+        :return np.ndarray 各周期的指标值，形状与values相同
+        """
+        values = np.asarray(values)
+        return np.array([self.update(value) for value in values])
+
+    def state(self):
+        """
+        可以json序列化的状态，数组保存为[dtype, 列表]
+        """
+        state = dict(self.__dict__)
+        for name in self._arrays:
+            if state[name] is not None:
+                state[name] = [state[name].dtype.str, state[name].tolist()]
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        由state()返回的状态恢复
+        """
+        indicator = cls.__new__(cls)
+        indicator.__dict__.update(state)
+        for name in cls._arrays:
+            if state[name] is not None:
+                dtype, values = state[name]
+                setattr(indicator, name, np.array(values, dtype=dtype))
+        return indicator
+
+
+def _flat(value, dtype=None):
+    """
+    新周期的值转换为一维数组，状态按一维数组保存
+    :return (一维数组, 原形状)
+    """
+    value = np.asarray(value, dtype=dtype)
+    return value.reshape(-1), value.shape
+
+
+def _result(values, shape):
+    """恢复为传入值的形状，单只股票（0维）返回标量"""
+    return values.reshape(shape)[()]
+
+
+class SMA(Indicator):
+    """
+    简单移动平均，计算顺序与talib.SMA一致：从第一个非nan值开始累加，之后的nan会传播
+    """
+
+    _arrays = ("window", "total", "filled")
+
+    def __init__(self, n):
+        self.n = n
+        # 最近n个周期的值（环形缓冲，各股票的写入位置为filled % n），用于从累加和中减去移出窗口的值
+        # 数组的行为周期，列为股票
+        self.window = None
+        self.total = None
+        # 各股票从第一个非nan值起累加的周期数，0为尚未开始
+        self.filled = None
+
+    def update(self, value):
+        value, shape = _flat(value, np.float64)
+        if self.window is None:
+            self.window = np.zeros((self.n, value.shape[0]))
+            self.total = np.zeros(value.shape[0])
+            self.filled = np.zeros(value.shape[0], dtype=np.int64)
+        active = (self.filled > 0) | ~np.isnan(value)
+        columns = np.flatnonzero(active)
+        self.total[columns] += value[columns]
+        self.window[self.filled[columns] % self.n, columns] = value[columns]
+        self.filled[columns] += 1
+        full = active & (self.filled >= self.n)
+        result = np.where(full, self.total / self.n, np.nan)
+        # 减去下一个周期将移出窗口的值，即下一个写入位置上最早的值
+        columns = np.flatnonzero(full)
+        self.total[columns] -= self.window[self.filled[columns] % self.n, columns]
+        return _result(result, shape)
+
+
+class HHV(Indicator):
+    """
+    n周期最高值，n=0时为从第一个周期起的最高值
+    不足n周期时按n=0计算，第一个值为nan时不足n周期的部分为nan；窗口内有nan时为nan
+    窗口按n个周期分块（van Herk/Gil-Werman）：当前块的最高值逐周期累计，上一块在块结束时
+    一次算出各位置到块末的最高值，每个周期只比较两个数组，与n无关
+    """
+
+    _arrays = ("window", "running", "extreme", "first_nan")
+    # 窗口内的最高值（nan传播）、忽略nan的最高值
+    _better = np.maximum
+    _keep = np.fmax
+
+    def __init__(self, n):
+        self.n = n
+        self.bars = 0
+        # n行的缓冲，当前块的位置为bars % n：已写入的行为当前块的值，
+        # 其后的行为上一块该位置到块末的最高值
+        self.window = None
+        # 当前块到目前为止的最高值
+        self.running = None
+        # 从第一个周期起的最高值，忽略nan
+        self.extreme = None
+        self.first_nan = None
+
+    def update(self, value):
+        value, shape = _flat(value, np.float64)
+        if self.extreme is None:
+            self.window = np.zeros((self.n, value.shape[0]))
+            self.running = np.full(value.shape[0], np.nan)
+            self.extreme = np.full(value.shape[0], np.nan)
+            self.first_nan = np.isnan(value)
+        i = self.bars
+        self.bars += 1
+        self.extreme = self._keep(self.extreme, value)
+        if self.n == 0:
+            return _result(np.where(self.first_nan, np.nan, self.extreme), shape)
+        slot = i % self.n
+        self.window[slot] = value
+        self.running = value.copy() if slot == 0 else self._better(self.running, value)
+        if slot == self.n - 1:
+            # 块结束，窗口恰为当前块；改为各位置到块末的最高值，供下一块使用
+            result = self.running
+            suffix = self._better.accumulate(self.window[::-1], axis=0)
+            self.window = suffix[::-1].copy()
+        else:
+            result = self._better(self.running, self.window[slot + 1])
+        if i < self.n - 1:
+            return _result(np.where(self.first_nan, np.nan, self.extreme), shape)
+        return _result(result, shape)
+
+
+class LLV(HHV):
+    """
+    n周期最低值，规则同HHV
+    """
+
+    _better = np.minimum
+    _keep = np.fmin
+
+
+class COUNT(Indicator):
+    """
+    n周期中满足条件的周期数，n=0时从第一个周期开始
+    """
+
+    _arrays = ("window", "count")
+
+    def __init__(self, n):
+        self.n = n
+        self.bars = 0
+        # 最近n个周期是否满足条件（环形缓冲，写入位置为bars % n）
+        self.window = None
+        self.count = None
+
+    def update(self, value):
+        value, shape = _flat(value)
+        true = value == True
+        if self.count is None:
+            self.window = np.zeros((self.n, true.shape[0]), dtype=bool)
+            self.count = np.zeros(true.shape[0], dtype=np.int64)
+        if self.n > 0:
+            slot = self.bars % self.n
+            if self.bars >= self.n:
+                self.count -= self.window[slot]
+            self.window[slot] = true
+        self.bars += 1
+        self.count += true
+        return _result(self.count.copy(), shape)
+
+
+class BARSLAST(Indicator):
+    """
+    上一次条件成立到当前的周期数，条件从未成立时从第一个周期起为1、2、3...
+    """
+
+    _arrays = ("last",)
+
+    def __init__(self):
+        self.bars = 0
+        # 各股票上一次条件成立的周期序号，-1为从未成立
+        self.last = None
+
+    def update(self, value):
+        value, shape = _flat(value)
+        if self.last is None:
+            self.last = np.full(value.shape[0], -1, dtype=np.int64)
+        self.last[value != 0] = self.bars
+        self.bars += 1
+        return _result(self.bars - 1 - self.last, shape)
+
+
+class BARSLASTCOUNT(Indicator):
+    """
+    连续满足条件的周期数
+    """
+
+    _arrays = ("count",)
+
+    def __init__(self):
+        self.count = None
+
+    def update(self, value):
+        value, shape = _flat(value)
+        if self.count is None:
+            self.count = np.zeros(value.shape[0], dtype=np.int64)
+        self.count = np.where(value != 0, self.count + 1, 0)
+        return _result(self.count, shape)
+
+
+INDICATORS = {
+    cls.__name__: cls for cls in [SMA, HHV, LLV, COUNT, BARSLAST, BARSLASTCOUNT]
+}
+
+
+def save(indicators, path):
+    """
+    保存指标状态，先写临时文件再替换
+    :param indicators: dict {名称: {名称: 指标}}，如{"market": {"MA20": SMA(20)}}或{code: {...}}
+    :param path: str 文件路径
+    """
+    data = {
+        key: {
+            name: [type(indicator).__name__, indicator.state()]
+            for name, indicator in items.items()
+        }
+        for key, items in indicators.items()
+    }
+    # json.dumps整体编码比json.dump逐段写入快
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(json.dumps(data, separators=(",", ":")))
+    os.replace(path + ".tmp", path)
+
+
+def load(path):
+    """
+    加载save保存的指标状态
+    :return dict {名称: {名称: 指标}}，文件不存在时为空
+    """
+    if not os.path.exists(path):
+        return dict()
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        key: {
+            name: INDICATORS[kind].from_state(state)
+            for name, (kind, state) in items.items()
+        }
+        for key, items in data.items()
+    }
@@ -0,0 +1,406 @@
+"""
+随机生成的模拟数据，基准测试（benchmark.py）和测试（tests）共用
+通达信日线二进制文件、股本变迁、专业财务文件、日期×股票的价格面板等，固定随机种子，结果可重复；
+以及参照实现（原实现或按文件格式、定义逐条计算），测试校验一致性，benchmark.py --baseline与新实现比较耗时
+"""
+
+import os
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+from struct import pack, unpack
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import tdx_data_func
+import lday_store
+
+
+def gen_lday(path, rows=5000, seed=0):
+    """
+    生成通达信格式的日线二进制文件
+    :param path: str 文件路径
+    :param rows: int 记录条数（交易日数）
+    """
+    rng = np.random.default_rng(seed)
+    records = np.zeros(rows, dtype=tdx_data_func.LDAY_DTYPE)
+
+    days = np.arange("2000-01-01", "2100-01-01", dtype="datetime64[D]")
+    # 跳过周末
+    days = days[(days.astype(np.int64) + 3) % 7 < 5][:rows]
+    ymd = days.astype(str)
+    records["date"] = np.char.replace(ymd, "-", "").astype(np.uint32)
+
+    close = 1000 + np.cumsum(rng.integers(-50, 51, rows))
+    close = np.clip(close, 100, None)
+    records["open"] = close + rng.integers(-20, 21, rows)
+    records["high"] = np.maximum(records["open"], close) + rng.integers(0, 30, rows)
+    records["low"] = np.minimum(records["open"], close) - rng.integers(0, 30, rows)
+    records["close"] = close
+    records["vol"] = rng.integers(1000, 10**8, rows)
+    # 成交金额包含.5的情况，校验四舍五入
+    records["amount"] = rng.integers(10**4, 10**7, rows) + rng.choice(
+        [0.0, 0.25, 0.5, 0.75], rows
+    )
+
+    with open(path, "wb") as f:
+        f.write(records.tobytes())
+
+
+def gen_gbbq(codes, begin="2000-01-01", end="2020-01-01", events=10, seed=0):
+    """
+    生成股本变迁DataFrame，格式同load_data.load_gbbq
+    除权除息日期随机，包含非交易日（周末）和最后一个交易日之后的日期
+    :param codes: list 股票代码
+    :param events: int 每只股票的除权除息次数
+    """
+    rng = np.random.default_rng(seed)
+    days = np.arange(begin, end, dtype="datetime64[D]")
+    rows = []
+    for code in codes:
+        for date in np.sort(rng.choice(days, events, replace=False)):
+            rows.append(
+                (
+                    code,
+                    int(str(date).replace("-", "")),
+                    "除权除息",
+                    float(rng.choice([0.0, 0.5, 1.2, 3.0])),
+                    float(rng.choice([0.0, 0.0, 8.5])),
+                    float(rng.choice([0.0, 0.0, 3.0, 10.0])),
+                    float(rng.choice([0.0, 0.0, 1.5])),
+                )
+            )
+        # 其他类别，前复权不使用
+        rows.append((code, 20100105, "股本变化", 1000.0, 2000.0, 1500.0, 3000.0))
+    df = pd.DataFrame(
+        rows,
+        columns=[
+            "code",
+            "权息日",
+            "类别",
+            "分红-前流通盘",
+            "配股价-前总股本",
+            "送转股-后流通盘",
+            "配股-后总股本",
+        ],
+    )
+    df["date"] = pd.to_datetime(df["权息日"], format="%Y%m%d")
+    return df
+
+
+def gen_store(codes, rows=5000, short=False, src=None):
+    """
+    生成不复权日线存储和复权因子表，位置为cfg.ProcessedDataPath.tdx_lday_bin和tdx_lday_factor
+    :param codes: list 股票代码
+    :param rows: int 每只股票的日线条数
+    :param short: bool 每5只股票中有1只只有rows//10条日线
+    :param src: str 通达信日线文件的保存目录，为None时不保留
+    :return DataFrame 计算复权因子使用的股本变迁，见gen_gbbq
+    """
+    paths = cfg.ProcessedDataPath
+    os.makedirs(paths.tdx_lday_bin, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = tmp if src is None else src
+        for i, code in enumerate(codes):
+            name = "sz" + code + ".day"
+            count = rows // 10 if short and i % 5 == 0 else rows
+            gen_lday(src + os.sep + name, rows=count, seed=i)
+            tdx_data_func.lday_to_store(src=src, dst=paths.tdx_lday_bin, file_name=name)
+    df_gbbq = gen_gbbq(codes)
+    df_xrxd = tdx_data_func.group_xrxd(df_gbbq)
+    lday_store.save_factors(tdx_data_func.calc_factors(df_xrxd, paths.tdx_lday_bin))
+    return df_gbbq
+
+
+def gen_cw(path, shares=5000, fields=580, pad=100, seed=0, date=20220331):
+    """
+    生成专业财务文件，格式见finance_define.c
+    :param pad: int 每pad只股票的数据块前插入4字节填充，0为不填充
+    """
+    rng = np.random.default_rng(seed)
+    chunk_size = fields * 4
+    header = pack("<hIH3L", 1, date, shares, 0, chunk_size, 0)
+    offset = len(header) + 11 * shares
+    heads, chunks = [], []
+    for i in range(shares):
+        if pad and i % pad == pad - 1:
+            chunks.append(b"\x00" * 4)
+            offset += 4
+        heads.append(pack("<6scL", f"{i:06d}".encode(), b"\x00", offset))
+        chunks.append(rng.standard_normal(fields).astype("<f4").tobytes())
+        offset += chunk_size
+    with open(path, "wb") as f:
+        f.write(header + b"".join(heads) + b"".join(chunks))
+
+
+def gen_finance(dst, years=10, shares=4000, fields=580, periods=("1231",)):
+    """
+    生成多个报告期的专业财务文件，股票逐年增加，2020年以前字段较少
+    :param dst: str 目录
+    :param periods: list 每年的报告期，如["0331", "0630", "0930", "1231"]
+    :return list 文件名，按报告期排序
+    """
+    names = []
+    for year in range(2024 - years, 2024):
+        for mmdd in periods:
+            name = f"gpcw{year}{mmdd}.dat"
+            count = shares - (2024 - year) * 100
+            width = fields - 100 if year < 2020 else fields
+            gen_cw(dst + os.sep + name, count, width, seed=year, date=int(name[4:12]))
+            names.append(name)
+    return names
+
+
+def gen_a_shares(path, codes):
+    """生成股票代码表，格式同load_data.load_a_shares"""
+    pd.DataFrame(
+        {
+            "code": codes,
+            "name": [f"股票{code}" for code in codes],
+            "listing_date": "2000-01-04",
+        }
+    ).to_csv(path, index=False, encoding="utf-8")
+
+
+def gen_panel(dates=4860, symbols=5000, seed=0):
+    """
+    生成日期×股票的收盘价面板，未上市的日期为nan，随机停牌日为nan
+    """
+    rng = np.random.default_rng(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, (dates, symbols)), axis=0))
+    close = np.round(close, 2)
+    listed = rng.integers(0, dates, symbols)
+    listed[: symbols // 2] = 0
+    close[np.arange(dates)[:, None] < listed] = np.nan
+    close[rng.random((dates, symbols)) < 0.01] = np.nan
+    return pd.DataFrame(
+        close,
+        index=pd.bdate_range("2004-01-01", periods=dates),
+        columns=[f"{i:06d}" for i in range(symbols)],
+    )
+
+
+def gen_market(dates=4860, symbols=5000, seed=0):
+    """
+    生成回测用的开盘价、收盘价、成交量面板，包括停牌（无日线或成交量为0）和开盘涨跌停
+    """
+    rng = np.random.default_rng(seed)
+    close = gen_panel(dates, symbols, seed)
+    prev = close.ffill().shift(1).to_numpy()
+    gap = rng.normal(0, 0.01, close.shape)
+    # 部分日期开盘涨停或跌停
+    gap[rng.random(close.shape) < 0.005] = 0.1
+    gap[rng.random(close.shape) < 0.005] = -0.1
+    open_ = np.round(np.where(np.isnan(prev), close, prev * (1 + gap)), 2)
+    open_[np.isnan(close.to_numpy())] = np.nan
+    vol = rng.integers(1, 10**6, close.shape).astype(np.float64)
+    vol[rng.random(close.shape) < 0.002] = 0
+    vol[np.isnan(open_)] = np.nan
+    return {
+        "open": pd.DataFrame(open_, index=close.index, columns=close.columns),
+        "close": close,
+        "vol": pd.DataFrame(vol, index=close.index, columns=close.columns),
+    }
+
+
+def momentum_top(close, n=20, top=50):
+    """信号：n日涨幅最大的top只股票等权持有"""
+    values = close.to_numpy()
+    momentum = np.full_like(values, -np.inf)
+    with np.errstate(invalid="ignore"):
+        momentum[n:] = values[n:] / values[:-n]
+    momentum[np.isnan(momentum)] = -np.inf
+    rank = np.argsort(-momentum, axis=1, kind="stable")[:, :top]
+    signal = np.zeros(values.shape, dtype=bool)
+    np.put_along_axis(signal, rank, True, axis=1)
+    signal &= momentum > -np.inf
+    return pd.DataFrame(signal, index=close.index, columns=close.columns)
+
+
+def ta_cases(rows=6000, seed=0):
+    """
+    TA函数的用例：随机价格（含nan、首个值为nan、重复值）、随机条件（含nan）
+    :return list (名称, 价格Series, 条件Series)
+    """
+    rng = np.random.default_rng(seed)
+    cases = []
+    for name, n in [("长序列", rows), ("短序列", 7), ("单个", 1)]:
+        index = pd.date_range("2000-01-01", periods=n)
+        price = pd.Series(np.round(rng.random(n) * 10, 1), index=index)
+        cond = pd.Series(rng.random(n) < 0.1, index=index)
+        cases.append((name, price, cond))
+        with_nan = price.copy()
+        with_nan[rng.random(n) < 0.05] = np.nan
+        cases.append((name + "含nan", with_nan, with_nan > 5))
+        cond_float = cond.astype(float)
+        cond_float[rng.random(n) < 0.05] = np.nan
+        cases.append((name + "条件含nan", price, cond_float))
+    first_nan = cases[0][1].copy()
+    first_nan.iat[0] = np.nan
+    cases.append(("首个值为nan", first_nan, cases[0][2]))
+    return cases
+
+
+def sma_talib(values, day):
+    """
+    talib.SMA的计算过程（跳过开头的nan后滚动累加），未安装talib时代替单只股票的SMA
+    """
+    values = np.asarray(values, dtype=float)
+    result = np.full(values.shape[0], np.nan)
+    valid = np.flatnonzero(~np.isnan(values))
+    if valid.shape[0] == 0 or valid[0] + day - 1 >= values.shape[0]:
+        return result
+    begin = valid[0]
+    total = 0.0
+    for i in range(begin, begin + day - 1):
+        total += values[i]
+    trailing = begin
+    for i in range(begin + day - 1, values.shape[0]):
+        total += values[i]
+        result[i] = total / day
+        total -= values[trailing]
+        trailing += 1
+    return result
+
+
+def lday_to_csv_reference(src, dst, file_name):
+    """逐条struct.unpack的日线转换"""
+    code = file_name[2:-4]
+    with open(src + os.sep + file_name, "rb") as f:
+        buf = f.read()
+    with open(dst + os.sep + code + ".csv", "w", encoding="utf-8") as dst_file:
+        dst_file.write("date,code,open,high,low,close,vol,amount")
+        for i in range(0, len(buf) // 32 * 32, 32):
+            info = unpack("IIIIIfII", buf[i : i + 32])
+            date = datetime.strptime(str(info[0]), "%Y%m%d").strftime("%Y-%m-%d")
+            content = ["\n" + date, code]
+            content += [str(info[k] / 100.0) for k in range(1, 5)]
+            content.append(str(info[6]))
+            amount = Decimal(info[5]).quantize(Decimal("1."), rounding="ROUND_HALF_UP")
+            content.append(str(amount))
+            dst_file.write(",".join(content))
+
+
+def qfq_reference(df_raw, df_gbbq, code):
+    """
+    按定义逐次除权的前复权：除权除息日之前的价格乘以 除权价 / 除权除息日前一交易日收盘价
+    除权价 = (收盘价 * 10 - 分红 + 配股 * 配股价) / (10 + 配股 + 送转股)
+    :return (复权因子, 前复权价格DataFrame)
+    """
+    dates = df_raw["date"].to_numpy()
+    close = df_raw["close"].to_numpy()
+    adj = np.ones(df_raw.shape[0])
+    df_xrxd = df_gbbq[(df_gbbq["code"] == code) & (df_gbbq["类别"] == "除权除息")]
+    for _, row in df_xrxd.iterrows():
+        before = dates < row["date"].to_datetime64()
+        if not before.any():
+            continue
+        prev = close[before][-1]
+        price = (
+            prev * 10
+            - row["分红-前流通盘"]
+            + row["配股-后总股本"] * row["配股价-前总股本"]
+        ) / (10 + row["配股-后总股本"] + row["送转股-后流通盘"])
+        adj[before] *= price / prev
+    prices = {
+        name: np.round(df_raw[name].to_numpy() * adj, 2)
+        for name in ["open", "high", "low", "close"]
+    }
+    return adj, pd.DataFrame(prices)
+
+
+def hhv_reference(series, day, compare=lambda a, b: a < b):
+    """原HHV的逐元素比较实现，compare取反为LLV"""
+    if day == 0:
+        value = pd.Series(index=series.index, dtype=float)
+        tmp = series.iat[0]
+        value.iat[0] = tmp
+        for i in range(series.shape[0]):
+            if compare(tmp, series.iat[i]):
+                tmp = series.iat[i]
+                value.iat[i] = tmp
+        value = value.ffill()
+    else:
+        value = (
+            series.rolling(day).max() if compare(0, 1) else series.rolling(day).min()
+        )
+        # 原实现day=1时对空序列取iat[0]会出错，day=1没有需要填充的部分
+        if day > 1:
+            value.iloc[0 : day - 1] = hhv_reference(
+                series.iloc[0 : day - 1], 0, compare
+            )
+    return value
+
+
+def llv_reference(series, day):
+    return hhv_reference(series, day, lambda a, b: a > b)
+
+
+def barslast_reference(series):
+    result = pd.Series(index=series.index, dtype=int)
+    i = 0
+    for k, v in series.items():
+        if v:
+            i = 0
+            result[k] = i
+        else:
+            i = i + 1
+            result[k] = i
+    return result
+
+
+def barslastcount_reference(cond):
+    result = pd.Series(index=cond.index, dtype=int)
+    i = 0
+    for k, v in cond.items():
+        if v:
+            i = i + 1
+            result[k] = i
+        else:
+            i = 0
+            result[k] = i
+    return result
+
+
+def valuewhen_reference(cond, value_series):
+    result = pd.Series(index=cond.index, dtype=float)
+    result.loc[cond.loc[cond == True].keys()] = value_series.loc[
+        cond.loc[cond == True].keys()
+    ]
+    return result.ffill()
+
+
+def count_reference(series, n):
+    """原COUNT：对每个成立的位置，之后n个周期（含当前）的计数加1"""
+    df = series.to_frame("cond")
+    df.insert(df.shape[1], "result", 0)
+    for index_true in df.loc[df["cond"] == True].index.to_list():
+        index_int = df.index.get_loc(index_true)
+        column_int = df.columns.get_loc("result")
+        df.iloc[index_int : index_int + n, column_int] = (
+            df.iloc[index_int : index_int + n, column_int] + 1
+        )
+    return df["result"]
+
+
+# 选股公式，中间变量之间有大量重复的子表达式
+SCREEN_FORMULA = """
+{放量突破}
+MA5:=MA(C,5);
+MA10:=MA(C,10);
+MA20:=MA(C,20);
+UP:=C>REF(C,1);
+ZF:=(C-REF(C,1))/REF(C,1)*100;
+TP:=C>=HHV(REF(C,1),20) AND ZF>3;
+VOLUP:=V>MA(V,5)*1.5 AND V>REF(V,1);
+TREND:=MA5>MA10 AND MA10>MA20 AND MA20>REF(MA20,1);
+STRONG:=COUNT(UP,10)>=6 AND EVERY(C>MA20,5);
+NEAR:=(HHV(H,20)-C)/(HHV(H,20)-LLV(L,20))<0.2;
+XG:TP AND VOLUP AND TREND AND STRONG AND NEAR;
+DAYS:BARSLAST(CROSS(MA5,MA20));
+"""
+
+# 全市场选股的条件
+SCREEN_CONDITION = "XG:C>HHV(REF(C,1),20) AND COUNT(C>REF(C,1),10)>=5;"
@@ -0,0 +1,42 @@
+"""
+测试使用仓库根目录下的模块，与直接运行脚本时一致
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config as cfg  # noqa: E402
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    """
+    加工后数据的目录指向临时目录，结束后清空日线缓存和指标缓存
+    :return cfg.ProcessedDataPath
+    """
+    import load_data
+    import ta_cache
+
+    data = cfg.ProcessedDataPath
+    for name in [
+        "tdx_lday_bin",
+        "tdx_lday_qfq_bin",
+        "tdx_lday_period",
+        "tdx_index",
+        "tdx_cw_cube",
+        "ta_cache",
+        "snapshot",
+    ]:
+        monkeypatch.setattr(data, name, str(tmp_path / name))
+    monkeypatch.setattr(data, "tdx_lday_factor", str(tmp_path / "factor.bin"))
+    monkeypatch.setattr(data, "tdx_gbbq", str(tmp_path / "gbbq.bin"))
+    monkeypatch.setattr(cfg, "a_share_path", str(tmp_path / "a_share.csv"))
+    load_data.clear_line_day_cache()
+    ta_cache.clear()
+    yield data
+    load_data.clear_line_day_cache()
+    ta_cache.clear()
@@ -0,0 +1,104 @@
+"""
+组合回测与按backtrader事件循环写法逐bar处理的参照实现一致：次日开盘成交、手续费和印花税、涨跌停和停牌不能成交、资金不足时按比例买入
+"""
+
+import math
+
+import numpy as np
+
+import backtest
+from testdata import gen_market, momentum_top
+
+
+def backtest_by_bar(
+    panel,
+    signal,
+    capital=1e6,
+    commission=0.00025,
+    min_commission=5.0,
+    stamp_duty=0.0005,
+    lot=100,
+    limit=0.1,
+):
+    """
+    参照实现：按backtrader的事件循环写法逐bar逐股票处理
+    next()中按收盘后的信号对每只股票下目标股数的市价单，下一bar开盘成交，先成交卖单再成交买单
+    """
+    opens, closes, vols = (
+        panel[name].to_numpy().tolist() for name in ["open", "close", "vol"]
+    )
+    signal = signal.to_numpy().tolist()
+    symbols = len(closes[0])
+    shares = [0.0] * symbols
+    last = [math.nan] * symbols
+    cash = capital
+    orders = None
+    equity = []
+
+    def fee(value):
+        return max(value * commission, min_commission) if value > 0 else 0.0
+
+    for t in range(len(closes)):
+        if orders is not None:
+            # broker：开盘撮合上一bar提交的订单
+            weights = orders
+            price = []
+            for j in range(symbols):
+                can = not math.isnan(opens[t][j]) and vols[t][j] > 0
+                price.append(opens[t][j] if can else last[j])
+            value = cash
+            for j in range(symbols):
+                if shares[j] and not math.isnan(price[j]):
+                    value += price[j] * shares[j]
+            sells, buys = [], []
+            for j in range(symbols):
+                if math.isnan(opens[t][j]) or not vols[t][j] > 0:
+                    continue
+                target = math.floor(value * weights[j] / opens[t][j] / lot) * lot
+                up, down = math.inf, -math.inf
+                if not math.isnan(last[j]):
+                    # 上市首日没有涨跌停限制
+                    up = math.floor(last[j] * (1 + limit) * 100 + 0.5 + 1e-6) / 100
+                    down = math.floor(last[j] * (1 - limit) * 100 + 0.5 + 1e-6) / 100
+                if target < shares[j] and not opens[t][j] <= down + 1e-6:
+                    sells.append((j, shares[j] - target))
+                elif target > shares[j] and not opens[t][j] >= up - 1e-6:
+                    buys.append((j, target - shares[j]))
+            for j, size in sells:
+                amount = size * opens[t][j]
+                cash += amount - fee(amount) - amount * stamp_duty
+                shares[j] -= size
+            need = sum(size * opens[t][j] + fee(size * opens[t][j]) for j, size in buys)
+            if need > cash:
+                total = sum(size * opens[t][j] for j, size in buys)
+                fees = sum(fee(size * opens[t][j]) for j, size in buys)
+                ratio = min(max(cash - fees, 0.0) / total, 1.0) if total else 0.0
+                buys = [(j, math.floor(size * ratio / lot) * lot) for j, size in buys]
+            for j, size in buys:
+                amount = size * opens[t][j]
+                cash -= amount + fee(amount)
+                shares[j] += size
+        for j in range(symbols):
+            if not math.isnan(closes[t][j]):
+                last[j] = closes[t][j]
+        value = cash
+        for j in range(symbols):
+            if shares[j] and not math.isnan(last[j]):
+                value += last[j] * shares[j]
+        equity.append(value)
+        # strategy.next()：收盘后按信号计算目标权重
+        count = sum(signal[t])
+        orders = (
+            [1.0 / count if s else 0.0 for s in signal[t]] if count else [0.0] * symbols
+        )
+    return np.array(equity)
+
+
+def test_run():
+    panel = gen_market(500, 60, seed=1)
+    signal = momentum_top(panel["close"], top=5)
+    expect = backtest_by_bar(panel, signal)
+    result = backtest.run(panel, signal, limit=0.1)
+    assert np.allclose(result["equity"].to_numpy(), expect, rtol=1e-10)
+    assert result["turnover"].sum() > 0 and result["cost"].sum() > 0
+    assert (result["positions"].iloc[25:] > 0).all()
@@ -0,0 +1,64 @@
+"""
+cw_store财务数据立方体与逐个解析专业财务文件后拼接的结果一致，重复写入报告期后不变
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import cw_store
+import tdx_data_func
+import tdx_mapping
+from testdata import gen_finance
+
+
+def load_finance_reference(dat, names, period):
+    """逐个解析报告期文件后拼接"""
+    frames = []
+    for name in names:
+        if name[8:12] != period:
+            continue
+        df = tdx_data_func.load_cw_dat(dat + os.sep + name)
+        df["date"] = pd.to_datetime(name[4:12], format="%Y%m%d")
+        frames.append(df)
+    df = pd.concat(frames)
+    return df.sort_values(by=[0, "date"], kind="stable").reset_index(drop=True)
+
+
+def test_load(tmp_path):
+    dat, cube = str(tmp_path / "dat"), str(tmp_path / "cube")
+    os.mkdir(dat)
+    names = gen_finance(
+        dat, years=6, shares=1000, fields=200, periods=["0331", "0630", "0930", "1231"]
+    )
+    headers = [tdx_data_func.load_cw_header(dat + os.sep + n) for n in names]
+    cw_store.reserve(
+        np.concatenate([h[1] for h in headers]), max(h[2] for h in headers), cube
+    )
+    for name in names:
+        with open(dat + os.sep + name, "rb") as f:
+            cw_store.put(*tdx_data_func.parse_cw_dat(f.read()), root=cube)
+    assert cw_store.reports(cube) == sorted(int(name[4:12]) for name in names)
+
+    fields = [field for field in tdx_mapping.finance_mapping if field != 0]
+    fields = [field for field in fields if field <= 200]
+    for period in ["0331", "1231"]:
+        df = cw_store.load(fields, period, cube)
+        expect = load_finance_reference(dat, names, period)
+        assert (df[0] == expect[0]).all()
+        assert (df["date"] == expect["date"]).all()
+        for field in fields:
+            assert df[field].equals(expect[field]), field
+
+    # 超出文件字段数的字段为nan，同load_cw_dat拼接的结果
+    df = cw_store.load([1, 200, 201, 300], "1231", cube)
+    assert list(df.columns) == [0, 1, 200, 201, 300, "date"]
+    assert df[[201, 300]].isna().all().all()
+    assert df[200].equals(load_finance_reference(dat, names, "1231")[200])
+
+    # 覆盖已有报告期后结果不变
+    df = cw_store.load(fields, "1231", cube)
+    with open(dat + os.sep + names[-1], "rb") as f:
+        cw_store.put(*tdx_data_func.parse_cw_dat(f.read()), root=cube)
+    assert cw_store.load(fields, "1231", cube).equals(df)
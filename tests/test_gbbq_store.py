@@ -0,0 +1,46 @@
+"""
+gbbq_store的定长记录与股本变迁DataFrame一致：全表、单只股票、按类别筛选
+"""
+
+import numpy as np
+
+import gbbq_store
+from testdata import gen_gbbq
+
+CODES = [f"{i:06d}" for i in range(50)]
+
+
+def save_gbbq(path):
+    """保存gen_gbbq生成的股本变迁，返回按code、权息日排序的DataFrame"""
+    df = gen_gbbq(CODES, events=5)
+    df_code = df.drop(columns=["date"])
+    df_code["类别"] = df_code["类别"].map(
+        {name: i + 1 for i, name in enumerate(gbbq_store.CATEGORIES)}
+    )
+    gbbq_store.save(gbbq_store.to_records(df_code), path)
+    return df.sort_values(["code", "权息日"], kind="stable", ignore_index=True)
+
+
+def test_to_frame(tmp_path):
+    path = str(tmp_path / "gbbq.bin")
+    expect = save_gbbq(path)
+    df = gbbq_store.to_frame(gbbq_store.load(path)[0])
+    assert (df.columns == expect.columns).all()
+    for name in expect.columns:
+        assert (df[name] == expect[name]).all(), name
+
+
+def test_records_of(tmp_path):
+    path = str(tmp_path / "gbbq.bin")
+    save_gbbq(path)
+    df = gbbq_store.to_frame(gbbq_store.load(path)[0])
+    for code in [CODES[0], CODES[7], CODES[-1]]:
+        part = gbbq_store.to_frame(gbbq_store.records_of(code, path))
+        assert part.equals(df[df["code"] == code].reset_index(drop=True))
+        part = gbbq_store.to_frame(gbbq_store.records_of(code, path, "除权除息"))
+        expect = df[(df["code"] == code) & (df["类别"] == "除权除息")]
+        assert part.equals(expect.reset_index(drop=True))
+    assert gbbq_store.records_of("999999", path).shape[0] == 0
+    assert np.array_equal(
+        gbbq_store.to_frame(gbbq_store.records_of("999999", path)).columns, df.columns
+    )
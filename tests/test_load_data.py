@@ -0,0 +1,223 @@
+"""
+load_data：日线缓存（返回值修改不影响缓存、数据变化后失效、淘汰），按日期范围读取，全市场面板，启动全局数据快照
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import config as cfg
+import cw_store
+import lday_store
+import load_data
+import tdx_data_func
+import xline
+from testdata import gen_a_shares, gen_finance, gen_store
+
+CODES = [f"{i:06d}" for i in range(10)]
+ROWS = 1000
+
+
+@pytest.fixture
+def store(paths):
+    gen_store(CODES, rows=ROWS, short=True)
+    return paths
+
+
+def uncached_load(code, adjust="qfq"):
+    records = lday_store.memmap(code)
+    records = lday_store.adjust(records, lday_store.factors_of(code), adjust)
+    return lday_store.to_frame(records)
+
+
+def test_line_day_cache(store, monkeypatch):
+    monkeypatch.setattr(cfg, "line_day_cache_memory", 2**30)
+    for _ in range(3):
+        for code in CODES:
+            load_data.load_line_day(code)
+    stats = load_data.line_day_cache_stats()
+    assert stats["miss"] == len(CODES) and stats["hit"] == len(CODES) * 2, stats
+
+    # 修改返回值不影响缓存
+    code = CODES[1]
+    expect = uncached_load(code)
+    df = load_data.load_line_day(code)
+    try:
+        df.loc[0, "close"] = -1.0
+    except ValueError:
+        pass
+    df["close"] = 0.0
+    df.index = df["date"]
+    df.reset_index(drop=True, inplace=True)
+    xline.day2month(load_data.load_line_day(code))
+    assert load_data.load_line_day(code).equals(expect)
+
+    # 追加日线、复权因子变化后重新加载
+    extra = np.array(lday_store.memmap(code)[-5:])
+    extra["date"] += 7
+    lday_store.append_records(code, extra)
+    assert load_data.load_line_day(code).equals(uncached_load(code))
+    assert load_data.load_line_day(code).shape[0] == ROWS + 5
+    factors = lday_store.load_factors()[0].copy()
+    changed = factors["code"] == factors["code"][0]
+    factors["factor"][changed] *= 0.9
+    lday_store.save_factors(factors)
+    changed = factors["code"][changed][0].decode()
+    assert load_data.load_line_day(changed).equals(uncached_load(changed))
+    assert load_data.load_line_day(changed, "none").equals(
+        uncached_load(changed, "none")
+    )
+
+
+def test_line_day_cache_evict(store, monkeypatch):
+    monkeypatch.setattr(cfg, "line_day_cache_memory", 2**30)
+    load_data.load_line_day(CODES[1])
+    size = load_data.line_day_cache_stats()["size"]
+    monkeypatch.setattr(cfg, "line_day_cache_memory", size * 3)
+    load_data.clear_line_day_cache()
+    for code in CODES:
+        load_data.load_line_day(code)
+    stats = load_data.line_day_cache_stats()
+    assert stats["evict"] > 0 and stats["size"] <= cfg.line_day_cache_memory
+    assert stats["count"] <= 3 + len(CODES) // 5
+
+
+@pytest.mark.parametrize("cache", [0, 2**30])
+def test_line_day_range(store, monkeypatch, cache):
+    # 不缓存时读取需要的行，缓存全部日线后从缓存中截取
+    monkeypatch.setattr(cfg, "line_day_cache_memory", cache)
+    dates = load_data.load_line_day(CODES[1])["date"]
+    start, end = str(dates.iat[-500])[:10], str(dates.iat[-258])[:10]
+    for code in CODES[:2]:
+        for adjust in ["qfq", "hfq", "none"]:
+            df = load_data.load_line_day(code, adjust)
+            cases = [
+                (dict(last_n=60), df.tail(60)),
+                (dict(start=start, end=end), df[df["date"].between(start, end)]),
+                (dict(start=start), df[df["date"] >= start]),
+                (dict(end=end, last_n=60), df[df["date"] <= end].tail(60)),
+                (dict(start="2100-01-01"), df.iloc[:0]),
+            ]
+            for kwargs, expect in cases:
+                actual = load_data.load_line_day(code, adjust, **kwargs)
+                assert actual.equals(expect.reset_index(drop=True)), (adjust, kwargs)
+    if cache:
+        assert load_data.line_day_cache_stats()["hit"] > 0
+
+
+def concat_panel(fields, codes, adjust="qfq"):
+    """逐只加载日线，按列拼接"""
+    frames = {name: dict() for name in fields}
+    for code in codes:
+        df = load_data.load_line_day(code, adjust).set_index("date")
+        for name in fields:
+            frames[name][code] = df[name]
+    return {name: pd.concat(frames[name], axis=1, sort=True) for name in fields}
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_load_panel(store, workers):
+    # 次新股从中途上市，部分日期停牌
+    rng = np.random.default_rng(0)
+    for i, code in enumerate(CODES):
+        records = np.array(lday_store.memmap(code))
+        if i % 5 == 0:
+            records["date"] += ROWS - ROWS // 10
+        lday_store.save_records(code, records[rng.random(records.shape[0]) > 0.01])
+
+    fields = ["open", "close", "vol"]
+    expect = concat_panel(fields, CODES)
+    panel = load_data.load_panel(fields, workers=workers)
+    for name in fields:
+        assert expect[name].index.equals(panel[name].index)
+        assert np.array_equal(
+            expect[name].to_numpy(np.float64), panel[name].to_numpy(), equal_nan=True
+        ), name
+
+    # 日期范围和股票过滤
+    dates = panel["close"].index
+    start, end = str(dates[200])[:10], str(dates[600])[:10]
+    subset = CODES[::3]
+    part = load_data.load_panel(
+        ["close"], subset, start, end, adjust="hfq", workers=workers
+    )["close"]
+    expect = concat_panel(["close"], subset, "hfq")["close"]
+    expect = expect.loc[start:end].dropna(how="all")
+    assert part.columns.tolist() == subset
+    assert part.index.equals(expect.index)
+    assert np.array_equal(part.to_numpy(), expect.to_numpy(), equal_nan=True)
+
+
+@pytest.fixture
+def globals_reset():
+    """清除load_data已加载的全局变量，模拟重新启动"""
+
+    def reset():
+        for name in load_data.SHARE_GLOBALS + load_data.FINANCE_GLOBALS:
+            load_data.__dict__.pop(name, None)
+
+    reset()
+    yield reset
+    reset()
+
+
+def test_snapshot(paths, tmp_path, globals_reset):
+    codes = [f"{i:06d}" for i in range(300)]
+    gen_a_shares(cfg.a_share_path, codes)
+    dat = str(tmp_path / "dat")
+    os.mkdir(dat)
+    names = gen_finance(dat, years=3, shares=600, fields=200)
+    cw_store.reserve(np.array([c.encode() for c in codes]), 200)
+    for name in names:
+        with open(dat + os.sep + name, "rb") as f:
+            cw_store.put(*tdx_data_func.parse_cw_dat(f.read()))
+
+    df, dt_codes, dt_names = load_data._build_a_shares()
+    df_finance = load_data._build_annual_finance_reports()
+    for _ in range(2):
+        # 首次计算并保存快照，之后读取快照
+        globals_reset()
+        assert load_data.df_a_shares.equals(df)
+        assert load_data.dt_a_share_codes == dt_codes
+        assert load_data.dt_a_share_names == dt_names
+        assert load_data.df_a_share_annual_finance_reports.equals(df_finance)
+    assert os.path.exists(paths.snapshot + os.sep + "a_shares.pkl")
+
+    # 代码表变化：重新加载代码表
+    globals_reset()
+    with open(cfg.a_share_path, "a", encoding="utf-8") as f:
+        f.write("999999,新股,2024-01-02\n")
+    assert load_data.dt_a_share_codes["999999"] == "新股"
+    assert load_data.dt_a_share_names["新股"] == "999999"
+
+    # 财务数据变化：重新加载年报
+    globals_reset()
+    with open(dat + os.sep + names[-1], "rb") as f:
+        date, report_codes, data = tdx_data_func.parse_cw_dat(f.read())
+    data = data.copy()
+    data[0, 0] = 12345.0
+    cw_store.put(date, report_codes, data)
+    assert not load_data.df_a_share_annual_finance_reports.equals(df_finance)
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [("2000-03-01", "2000-06-30"), ("20000301", "20000630"), (20000301, 20000630)],
+)
+def test_line_day_date_formats(store, start, end):
+    df = load_data.load_line_day(CODES[1])
+    expect = df[df["date"].between("2000-03-01", "2000-06-30")].reset_index(drop=True)
+    assert expect.shape[0] > 0
+    assert load_data.load_line_day(CODES[1], start=start, end=end).equals(expect)
+    panel = load_data.load_panel(["close"], CODES[1:2], start, end)["close"]
+    assert np.array_equal(panel[CODES[1]].to_numpy(), expect["close"].to_numpy())
+
+
+@pytest.mark.parametrize("date", ["garbage", "", "2000-13-01"])
+def test_line_day_bad_date(store, date):
+    with pytest.raises(ValueError):
+        load_data.load_line_day(CODES[1], start=date)
+    with pytest.raises(ValueError):
+        load_data.load_panel(["close"], CODES[1:2], end=date)
@@ -0,0 +1,64 @@
+"""
+screener全市场选股与逐只加载日线循环判断一致：公式和函数条件，全部历史和最近N周期，单进程和多进程
+"""
+
+import pytest
+
+import config as cfg
+import lday_store
+import load_data
+import screener
+import tdx_ta_func as ta
+from testdata import SCREEN_CONDITION, gen_store
+
+CODES = [f"{i:06d}" for i in range(30)]
+
+
+def screen_condition(df):
+    """SCREEN_CONDITION对应的Python选股条件"""
+    close = df["close"]
+    up = close > ta.REF(close, 1)
+    return (close > ta.HHV(ta.REF(close, 1), 20)) & (ta.COUNT(up, 10) >= 5)
+
+
+def screen_by_loop(date):
+    """逐只加载全部日线，截取到选股日期"""
+    matched = []
+    for code in CODES:
+        df = load_data.load_line_day(code)
+        df = df[df["date"] <= date]
+        if df.shape[0] == 0 or str(df["date"].iat[-1])[:10] != date:
+            continue
+        if screen_condition(df.reset_index(drop=True)).iat[-1]:
+            matched.append(code)
+    return matched
+
+
+@pytest.fixture(scope="module")
+def screened(tmp_path_factory):
+    """各用例共用的日线和逐只循环的选股结果"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        root = tmp_path_factory.mktemp("screener")
+        monkeypatch.setattr(cfg.ProcessedDataPath, "tdx_lday_bin", str(root / "raw"))
+        monkeypatch.setattr(
+            cfg.ProcessedDataPath, "tdx_lday_factor", str(root / "factor.bin")
+        )
+        monkeypatch.setattr(cfg, "a_share_path", str(root / "a_share.csv"))
+        # 部分股票日线较短（次新股），不在选股日期交易
+        gen_store(CODES, rows=600, short=True)
+        records = lday_store.memmap(CODES[1])
+        date = str(lday_store.from_days(records["date"][-30])[()])[:10]
+        expect = screen_by_loop(date)
+        assert 0 < len(expect) < len(CODES)
+        yield date, expect
+    load_data.clear_line_day_cache()
+
+
+@pytest.mark.parametrize("condition", [SCREEN_CONDITION, screen_condition])
+@pytest.mark.parametrize("last_n", [None, 250])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_screen(screened, condition, last_n, workers):
+    date, expect = screened
+    df = screener.screen(condition, date, last_n=last_n, workers=workers)
+    assert df.columns.tolist() == ["code", "name"]
+    assert df["code"].tolist() == expect
@@ -0,0 +1,91 @@
+"""
+入口模块的导入耗时和依赖：超出STARTUP_BUDGET或加载了无关的第三方库时失败
+python tests/test_startup.py 输出各入口的导入耗时和耗时最多的依赖
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 入口模块的导入耗时上限（秒，不含解释器自身启动），以及导入后不应加载的第三方库
+STARTUP_BUDGET = {
+    "update": (0.8, ["akshare", "requests", "pytdx", "matplotlib", "talib"]),
+    "tdx_data_func": (0.8, ["requests", "pytdx", "akshare", "talib"]),
+    "tdx_ta_func": (0.6, ["talib", "requests", "tqdm", "loguru"]),
+    "tdx_formula": (0.6, ["talib", "requests", "tqdm", "loguru"]),
+    "load_data": (0.7, ["requests", "pytdx", "akshare", "tqdm", "talib"]),
+    "screener": (0.8, ["requests", "pytdx", "akshare", "tqdm", "talib"]),
+    "backtest": (0.6, ["requests", "tqdm", "loguru", "talib"]),
+    "fundamental": (0.8, ["matplotlib", "requests", "pytdx", "akshare", "talib"]),
+}
+
+
+def import_profile(module, repeat=3):
+    """
+    在新进程中导入模块，取多次中耗时最短的一次
+    :return (耗时秒数, 导入后已加载的顶层模块名集合, [(顶层第三方库, 耗时秒数)...]按耗时降序)
+    """
+    code = f"import sys, {module}; print(' '.join(sorted(sys.modules)))"
+    best, loaded, packages = None, set(), []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            cwd=ROOT,
+        )
+        if result.returncode:
+            raise ImportError(f"import {module} 失败: {result.stderr[-500:]}")
+        loaded = {name.split(".")[0] for name in result.stdout.split()}
+        costs = dict()
+        for line in result.stderr.splitlines()[1:]:
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, name = line[len("import time:") :].split("|")
+            # 包的累计耗时包括其子模块
+            name = name.strip()
+            if "." not in name:
+                costs[name] = max(costs.get(name, 0), int(cumulative) / 1e6)
+        total = costs.get(module, 0.0)
+        if best is None or total < best:
+            best = total
+            packages = sorted(
+                (
+                    (k, v)
+                    for k, v in costs.items()
+                    if k not in (module, "site") and v >= 0.005
+                ),
+                key=lambda item: -item[1],
+            )
+    return best, loaded, packages
+
+
+@pytest.mark.parametrize("module", list(STARTUP_BUDGET))
+def test_startup(module):
+    budget, forbidden = STARTUP_BUDGET[module]
+    try:
+        cost, loaded, packages = import_profile(module)
+    except ImportError as e:
+        # 依赖未安装
+        pytest.skip(str(e).splitlines()[-1])
+    unexpected = sorted(set(forbidden) & loaded)
+    assert not unexpected, f"{module} 导入时加载了 {unexpected}"
+    heavy = ", ".join(f"{name} {t:.3f}s" for name, t in packages[:5])
+    assert (
+        cost <= budget
+    ), f"{module} 导入耗时{cost:.3f}s 超出上限{budget}s, 依赖: {heavy}"
+
+
+if __name__ == "__main__":
+    for module, (budget, _) in STARTUP_BUDGET.items():
+        try:
+            cost, _, packages = import_profile(module)
+        except ImportError as e:
+            print(f"{module}: 跳过, {str(e).splitlines()[-1]}")
+            continue
+        heavy = ", ".join(f"{name} {t:.3f}s" for name, t in packages[:5])
+        print(f"{module}: {cost:.3f}s (上限{budget}s) 依赖: {heavy}")
@@ -0,0 +1,107 @@
+"""
+指标缓存：结果与直接计算一致（含日期索引），追加日线、复权因子变化后失效，超出大小时淘汰
+"""
+
+import numpy as np
+import pytest
+
+import config as cfg
+import lday_store
+import load_data
+import ta_cache
+import tdx_ta_func as ta
+from testdata import gen_store
+
+CODES = [f"{i:06d}" for i in range(10)]
+LADDER = [(func, n) for func in [ta.HHV, ta.LLV] for n in [5, 20, 60]]
+TOTAL = len(CODES) * len(LADDER)
+
+
+@pytest.fixture
+def store(paths):
+    gen_store(CODES, rows=500)
+    return paths
+
+
+def direct():
+    result = dict()
+    for code in CODES:
+        df = load_data.load_line_day(code)
+        for func, n in LADDER:
+            value = func(df["close"], n)
+            value.index = df["date"]
+            result[code, func.__name__, n] = value
+    return result
+
+
+def cached():
+    return {
+        (code, func.__name__, n): ta_cache.indicator(code, func, n)
+        for code in CODES
+        for func, n in LADDER
+    }
+
+
+def check(expect):
+    for key, value in cached().items():
+        assert np.array_equal(value, expect[key], equal_nan=True), key
+        # 与按日期对齐的日线、其他指标一致
+        assert value.index.equals(expect[key].index), key
+
+
+def test_hit(store):
+    expect = direct()
+    check(expect)
+    assert ta_cache.stats()["miss"] == TOTAL
+    check(expect)
+    assert ta_cache.stats()["memory_hit"] == TOTAL
+    ta_cache.clear()
+    check(expect)
+    assert ta_cache.stats()["disk_hit"] == TOTAL
+
+
+def test_result_is_copy(store):
+    value = ta_cache.indicator(CODES[0], ta.HHV, 5)
+    expect = value.copy()
+    value.iloc[:] = -1.0
+    assert ta_cache.indicator(CODES[0], ta.HHV, 5).equals(expect)
+
+
+def test_invalidate(store):
+    cached()
+    # 追加日线：追加的股票重新计算，其余股票仍命中
+    ta_cache.clear()
+    appended = CODES[:3]
+    for code in appended:
+        extra = np.array(lday_store.memmap(code)[-5:])
+        extra["date"] += 7
+        lday_store.append_records(code, extra)
+    check(direct())
+    stats = ta_cache.stats()
+    assert stats["miss"] == len(appended) * len(LADDER), stats
+    assert stats["disk_hit"] == TOTAL - stats["miss"], stats
+
+    # 除权除息：复权因子变化的股票重新计算
+    ta_cache.clear()
+    factors = lday_store.load_factors()[0].copy()
+    changed = factors["code"] == factors["code"][0]
+    factors["factor"][changed] *= 0.9
+    lday_store.save_factors(factors)
+    check(direct())
+    assert ta_cache.stats()["miss"] == len(LADDER)
+
+
+def test_evict(store, monkeypatch):
+    cached()
+    size = ta_cache.stats()["disk_size"]
+    monkeypatch.setattr(cfg, "ta_cache_disk", size // 2)
+    monkeypatch.setattr(cfg, "ta_cache_memory", size // 4)
+    ta_cache.clear(store.ta_cache)
+    cached()
+    stats = ta_cache.stats()
+    assert stats["evict"] > 0 and stats["memory_size"] <= cfg.ta_cache_memory
+    assert sum(s for _, s, _ in ta_cache._files(store.ta_cache)) <= cfg.ta_cache_disk
+
+
+def test_missing(store):
+    assert ta_cache.indicator("999999", ta.HHV, 5) is None
@@ -0,0 +1,215 @@
+"""
+tdx_data_func与按文件格式逐条解析、按定义逐次除权的参照实现一致：日线转换、水位线增量、前复权、专业财务文件、财务zip同步
+"""
+
+import functools
+import http.server
+import os
+import threading
+import zipfile
+from struct import calcsize, unpack
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import config as cfg
+import lday_store
+import load_data
+import tdx_data_func
+from testdata import gen_cw, gen_lday, gen_store, lday_to_csv_reference, qfq_reference
+
+
+def test_lday_to_csv(tmp_path):
+    src, dst, ref = (str(tmp_path / name) for name in ["src", "dst", "ref"])
+    for p in [src, dst, ref]:
+        os.mkdir(p)
+    for i in range(3):
+        name = f"sz{i:06d}.day"
+        gen_lday(src + os.sep + name, rows=500, seed=i)
+        tdx_data_func.lday_to_csv(src=src, dst=dst, file_name=name)
+        lday_to_csv_reference(src, ref, name)
+        with open(dst + os.sep + name[2:-4] + ".csv") as f1:
+            with open(ref + os.sep + name[2:-4] + ".csv") as f2:
+                assert f1.read() == f2.read(), name
+
+
+def test_lday_watermark(tmp_path):
+    # 源文件先去掉最后一条记录，转换后再恢复，模拟每日新增一条
+    src, dst = str(tmp_path / "src"), str(tmp_path / "dst")
+    for p in [src, dst]:
+        os.mkdir(p)
+    names = [f"sz{i:06d}.day" for i in range(3)]
+    tails = dict()
+    for i, name in enumerate(names):
+        gen_lday(src + os.sep + name, rows=501, seed=i)
+        with open(src + os.sep + name, "rb+") as f:
+            f.seek(-tdx_data_func.LDAY_DTYPE.itemsize, 2)
+            tails[name] = f.read()
+            f.seek(-tdx_data_func.LDAY_DTYPE.itemsize, 2)
+            f.truncate()
+    watermark = dict()
+    for name in names:
+        tdx_data_func.lday_to_csv(src, dst, name, watermark)
+    tdx_data_func.save_watermark(dst, watermark)
+    for name in names:
+        with open(src + os.sep + name, "ab") as f:
+            f.write(tails[name])
+
+    watermark = tdx_data_func.load_watermark(dst)
+    for name in names:
+        tdx_data_func.lday_to_csv(src, dst, name, watermark)
+    for name in names:
+        path = dst + os.sep + name[2:-4] + ".csv"
+        with open(path) as f:
+            incremental = f.read()
+        tdx_data_func.lday_to_csv(src, dst, name)
+        with open(path) as f:
+            assert f.read() == incremental, name
+        assert incremental.count("\n") == 501
+
+
+def test_backward_adjust(paths):
+    codes = [f"{i:06d}" for i in range(5)]
+    df_gbbq = gen_store(codes, rows=2000)
+    os.makedirs(paths.tdx_lday_qfq_bin, exist_ok=True)
+    tdx_data_func.backward_adjust(paths.tdx_lday_bin, df_gbbq)
+    for code in codes:
+        df_raw = load_data.load_line_day(code, adjust="none")
+        adj, expect = qfq_reference(df_raw, df_gbbq, code)
+        # 前复权存储、读取时按复权因子表复权：复权因子的乘法顺序不同，只在四舍五入临界值相差1分
+        for df in [
+            lday_store.load(code, paths.tdx_lday_qfq_bin),
+            load_data.load_line_day(code),
+        ]:
+            assert df["date"].equals(df_raw["date"])
+            assert np.allclose(df["adj"], adj, rtol=1e-12, atol=0), code
+            for name in expect.columns:
+                diff = np.abs(df[name].to_numpy() - expect[name].to_numpy())
+                assert (diff < 0.0101).all(), (code, name)
+        # 后复权：上市首日价格不变，各日与前复权相差同一比例
+        df_hfq = load_data.load_line_day(code, adjust="hfq")
+        assert df_hfq.loc[0, "close"] == df_raw.loc[0, "close"]
+        ratio = df_hfq["adj"].to_numpy() / adj
+        assert np.allclose(ratio, ratio[0], rtol=1e-12, atol=0), code
+
+
+def load_cw_dat_reference(path):
+    """逐条unpack的专业财务文件解析"""
+    with open(path, "rb") as file:
+        header = unpack("<hIH3L", file.read(calcsize("<hIH3L")))
+        total, chunk_size = header[2], header[4]
+        heads = [unpack("<6scL", file.read(calcsize("<6scL"))) for _ in range(total)]
+        rows = []
+        for code, _, offset in heads:
+            file.seek(offset)
+            row = list(unpack(f"<{chunk_size // 4}f", file.read(chunk_size)))
+            rows.append([code.decode("utf-8")] + row)
+    return pd.DataFrame(rows)
+
+
+@pytest.mark.parametrize("pad", [0, 100])
+def test_load_cw_dat(tmp_path, pad):
+    path = str(tmp_path / "gpcw20220331.dat")
+    gen_cw(path, shares=300, fields=60, pad=pad)
+    df = tdx_data_func.load_cw_dat(path)
+    expect = load_cw_dat_reference(path)
+    assert (df.columns == expect.columns).all()
+    assert (df[0] == expect[0]).all()
+    assert (df.iloc[:, 1:] == expect.iloc[:, 1:]).all().all()
+
+
+class TdxFinHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    本地替身，模拟通达信财务数据下载服务：提供gpcw.txt和zip，支持Range续传，记录收到的Range头
+    """
+
+    ranges = []
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            content = f.read()
+        begin = 0
+        if "Range" in self.headers:
+            TdxFinHandler.ranges.append(self.headers["Range"])
+            begin = int(self.headers["Range"][6:].split("-")[0])
+            if begin >= len(content):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {begin}-{len(content) - 1}/{len(content)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(content) - begin))
+        self.end_headers()
+        self.wfile.write(content[begin:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def tdx_server(tmp_path, monkeypatch):
+    """
+    本地财务数据下载服务，gpcw.txt列出4个zip
+    :return (服务目录, gpcw.txt的行)
+    """
+    srv = str(tmp_path / "srv")
+    os.mkdir(srv)
+    lines = []
+    for i in range(4):
+        name = f"gpcw{2000 + i}1231"
+        gen_cw(srv + os.sep + name + ".dat", 200, 60, seed=i)
+        with zipfile.ZipFile(srv + os.sep + name + ".zip", "w") as f:
+            f.write(srv + os.sep + name + ".dat", name + ".dat")
+        md5, size = tdx_data_func.file_md5(srv + os.sep + name + ".zip")
+        lines.append(f"{name}.zip,{md5},{size}")
+    with open(srv + os.sep + "gpcw.txt", "w", newline="") as f:
+        f.write("\r\n".join(lines))
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(TdxFinHandler, directory=srv)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    monkeypatch.setattr(cfg.TdxCfg, "gpcw_url", url + "gpcw.txt")
+    monkeypatch.setattr(cfg.TdxCfg, "zip_url", url)
+    yield srv, lines
+    server.shutdown()
+
+
+def test_sync_cw(tmp_path, tdx_server):
+    srv, lines = tdx_server
+    dst = str(tmp_path / "dst")
+    os.mkdir(dst)
+    names = [line.split(",")[0] for line in lines]
+    assert tdx_data_func.sync_cw(dst, workers=4) == (names, [], [])
+    for name in names:
+        for suffix in [".zip", ".dat"]:
+            with open(srv + os.sep + name[:-4] + suffix, "rb") as f1:
+                with open(dst + os.sep + name[:-4] + suffix, "rb") as f2:
+                    assert f1.read() == f2.read(), name + suffix
+
+    # 已同步时不再下载
+    assert tdx_data_func.sync_cw(dst) == ([], [], [])
+
+    # 本地文件损坏时重新下载；下载中断时续传
+    first, second = names[:2]
+    with open(dst + os.sep + first, "r+b") as f:
+        f.seek(10)
+        f.write(b"broken")
+    with open(srv + os.sep + second, "rb") as f:
+        content = f.read()
+    os.remove(dst + os.sep + second)
+    with open(dst + os.sep + second + ".part", "wb") as f:
+        f.write(content[: len(content) // 2])
+    TdxFinHandler.ranges.clear()
+    assert tdx_data_func.sync_cw(dst) == ([second], [first], [])
+    assert TdxFinHandler.ranges == [f"bytes={len(content) // 2}-"]
+    for name in [first, second]:
+        assert tdx_data_func.file_md5(dst + os.sep + name)[0] in "".join(lines)
@@ -0,0 +1,85 @@
+"""
+编译后的通达信公式与逐行调用tdx_ta_func的结果一致，面板与单只股票一致
+"""
+
+import numpy as np
+import pandas as pd
+
+import tdx_formula
+import tdx_ta_func as ta
+from testdata import SCREEN_FORMULA, gen_panel
+
+
+def screen_by_hand(c, h, low, v):
+    """SCREEN_FORMULA按通常的写法逐行调用tdx_ta_func"""
+    up = c > ta.REF(c, 1)
+    zf = (c - ta.REF(c, 1)) / ta.REF(c, 1) * 100
+    tp = (c >= ta.HHV(ta.REF(c, 1), 20)) & (zf > 3)
+    volup = (v > ta.SMA(v, 5) * 1.5) & (v > ta.REF(v, 1))
+    trend = (
+        (ta.SMA(c, 5) > ta.SMA(c, 10))
+        & (ta.SMA(c, 10) > ta.SMA(c, 20))
+        & (ta.SMA(c, 20) > ta.REF(ta.SMA(c, 20), 1))
+    )
+    strong = (ta.COUNT(up, 10) >= 6) & ta.EVERY(c > ta.SMA(c, 20), 5)
+    near = (ta.HHV(h, 20) - c) / (ta.HHV(h, 20) - ta.LLV(low, 20)) < 0.2
+    xg = tp & volup & trend & strong & near
+    days = ta.BARSLAST(ta.CROSS(ta.SMA(c, 5), ta.SMA(c, 20)))
+    return {"XG": xg, "DAYS": days}
+
+
+def test_screen_formula():
+    close = gen_panel(500, 50)
+    rng = np.random.default_rng(1)
+    panel = {
+        "close": close,
+        "high": close * (1 + rng.random(close.shape) * 0.05),
+        "low": close * (1 - rng.random(close.shape) * 0.05),
+        "vol": close * 0 + rng.integers(1, 10**6, close.shape),
+    }
+    formula = tdx_formula.compile_formula(SCREEN_FORMULA)
+    assert list(formula.outputs) == ["XG", "DAYS"]
+    # 重复的子表达式只计算一次
+    assert len(formula.nodes) < formula.terms
+
+    expect = screen_by_hand(panel["close"], panel["high"], panel["low"], panel["vol"])
+    result = formula(panel)
+    for name in formula.outputs:
+        assert isinstance(result[name], pd.DataFrame)
+        assert result[name].index.equals(close.index)
+        assert np.array_equal(result[name].to_numpy(), expect[name].to_numpy()), name
+
+    # 单只股票与面板的对应列一致
+    code = close.columns[-1]
+    single = formula({name: df[[code]] for name, df in panel.items()})
+    for name in formula.outputs:
+        assert np.array_equal(single[name][code], result[name][code]), name
+
+
+def test_not_prefix():
+    close = gen_panel(100, 5)
+    panel = {"close": close, "open": close.shift(1)}
+    result = tdx_formula.compile_formula(
+        "A:NOT C>O; B:NOT(C>O); C1:NOT C>O AND C>1; D:NOT(C)>O;"
+    )(panel)
+    up = tdx_formula._truth(close > panel["open"])
+    assert np.array_equal(result["A"].to_numpy(), ~up)
+    assert np.array_equal(result["B"].to_numpy(), ~up)
+    assert np.array_equal(result["C1"].to_numpy(), ~up & (close > 1).to_numpy())
+    # NOT后为(时按函数解析
+    expect = ~tdx_formula._truth(close) > panel["open"]
+    assert np.array_equal(result["D"].to_numpy(), expect.to_numpy())
+
+
+def test_constant_args_broadcast():
+    # 只有常量参数的函数在变量之前计算，结果扩展为数据的形状
+    close = gen_panel(100, 5)
+    result = tdx_formula.compile_formula("X:REF(5,1)+C; Y:HHV(2,3); Z:NOT 0;")(
+        {"close": close}
+    )
+    expect = np.where(np.arange(100)[:, None] < 1, np.nan, 5 + close.to_numpy())
+    assert np.array_equal(result["X"].to_numpy(), expect, equal_nan=True)
+    for name, value in [("Y", 2), ("Z", 1)]:
+        assert isinstance(result[name], pd.DataFrame)
+        assert result[name].shape == close.shape
+        assert (result[name].to_numpy() == value).all(), name
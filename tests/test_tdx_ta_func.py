@@ -0,0 +1,185 @@
+"""
+tdx_ta_func与原逐元素循环实现（参照实现）的一致性：nan、n=0、窗口大于序列长度
+COUNT、EXIST在n=0和返回类型上有意与原实现不同（与通达信一致），单独测试
+面板模式（日期×股票）与逐列计算一致
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tdx_ta_func as ta
+from testdata import (
+    barslast_reference,
+    barslastcount_reference,
+    count_reference,
+    gen_panel,
+    hhv_reference,
+    llv_reference,
+    sma_talib,
+    ta_cases,
+    valuewhen_reference,
+)
+
+CASES = ta_cases(600)
+CASE_IDS = [name for name, _, _ in CASES]
+# 0为从第一个周期起，20大于短序列的长度
+WINDOWS = [0, 1, 5, 20]
+
+
+def assert_same(actual, expect):
+    assert isinstance(actual, pd.Series)
+    assert actual.index.equals(expect.index)
+    assert np.array_equal(
+        actual.to_numpy(dtype=float), expect.to_numpy(dtype=float), equal_nan=True
+    )
+
+
+@pytest.mark.parametrize("day", WINDOWS)
+@pytest.mark.parametrize("name, price, cond", CASES, ids=CASE_IDS)
+def test_hhv(name, price, cond, day):
+    assert_same(ta.HHV(price, day), hhv_reference(price, day))
+
+
+@pytest.mark.parametrize("day", WINDOWS)
+@pytest.mark.parametrize("name, price, cond", CASES, ids=CASE_IDS)
+def test_llv(name, price, cond, day):
+    assert_same(ta.LLV(price, day), llv_reference(price, day))
+
+
+def test_hhv_window_longer_than_series():
+    # 不足day周期时按day=0计算
+    price = pd.Series([3.0, 1.0, np.nan, 5.0, 2.0])
+    assert ta.HHV(price, 10).tolist() == [3.0, 3.0, 3.0, 5.0, 5.0]
+    assert ta.LLV(price, 10).tolist() == [3.0, 1.0, 1.0, 1.0, 1.0]
+
+
+@pytest.mark.parametrize("name, price, cond", CASES, ids=CASE_IDS)
+def test_barslast(name, price, cond):
+    assert_same(ta.BARSLAST(cond), barslast_reference(cond))
+
+
+@pytest.mark.parametrize("name, price, cond", CASES, ids=CASE_IDS)
+def test_barslastcount(name, price, cond):
+    assert_same(ta.BARSLASTCOUNT(cond), barslastcount_reference(cond))
+
+
+@pytest.mark.parametrize("name, price, cond", CASES, ids=CASE_IDS)
+def test_valuewhen(name, price, cond):
+    assert_same(ta.VALUEWHEN(cond, price), valuewhen_reference(cond, price))
+
+
+@pytest.mark.parametrize("n", [1, 5, 20])
+@pytest.mark.parametrize("name, price, cond", CASES, ids=CASE_IDS)
+def test_count(name, price, cond, n):
+    assert_same(ta.COUNT(cond, n), count_reference(cond, n))
+
+
+def test_count_n0_is_cumulative():
+    # 原实现n=0时全部为0，现与通达信一致为从第一个周期起的累计次数
+    cond = pd.Series([True, False, np.nan, True, True])
+    assert ta.COUNT(cond, 0).tolist() == [1, 1, 1, 2, 3]
+    panel = np.array([[True, False], [False, False], [True, True]])
+    assert ta.COUNT(panel, 0).tolist() == [[1, 0], [1, 0], [2, 1]]
+
+
+def test_count_panel_matches_columns():
+    panel = np.random.default_rng(0).random((300, 40)) < 0.1
+    result = ta.COUNT(panel, 20)
+    for c in range(panel.shape[1]):
+        assert np.array_equal(result[:, c], ta.COUNT(pd.Series(panel[:, c]), 20))
+
+
+@pytest.mark.parametrize("n", [0, 1, 5, 20])
+@pytest.mark.parametrize("name, price, cond", CASES, ids=CASE_IDS)
+def test_exist(name, price, cond, n):
+    result = ta.EXIST(cond, n)
+    # 原实现只判断最后n个周期，返回一个bool值，现在返回各周期的bool序列
+    assert isinstance(result, pd.Series) and result.dtype == bool
+    assert result.index.equals(cond.index)
+    if n > 0:
+        expect = count_reference(cond, n) > 0
+        assert np.array_equal(result.to_numpy(), expect.to_numpy())
+        assert result.iat[-1] == (True in cond[-n:].to_list())
+    else:
+        assert np.array_equal(result.to_numpy(), np.cumsum(cond == True) > 0)
+
+
+def test_exist_return_type():
+    cond = pd.DataFrame({"a": [False, True, False], "b": [False, False, False]})
+    result = ta.EXIST(cond, 2)
+    assert isinstance(result, pd.DataFrame) and result.columns.equals(cond.columns)
+    assert result.to_numpy().tolist() == [[False, False], [True, False], [True, False]]
+    result = ta.EXIST(cond.to_numpy(), 2)
+    assert isinstance(result, np.ndarray) and result.dtype == bool
+
+
+@pytest.mark.parametrize("n", [0, 1, 5, 20])
+@pytest.mark.parametrize("name, price, cond", CASES, ids=CASE_IDS)
+def test_every(name, price, cond, n):
+    if n > 0:
+        expect = cond.rolling(n, min_periods=n).apply(lambda x: (x == True).all())
+        expect = expect == 1
+    else:
+        expect = (cond == True).cummin()
+    assert np.array_equal(ta.EVERY(cond, n).to_numpy(), expect.to_numpy())
+
+
+@pytest.mark.parametrize(
+    "func",
+    [
+        lambda s: ta.HHV(s, 0),
+        lambda s: ta.LLV(s, 5),
+        lambda s: ta.BARSLAST(s > 1),
+        lambda s: ta.BARSLASTCOUNT(s > 1),
+        lambda s: ta.VALUEWHEN(s > 1, s),
+        lambda s: ta.COUNT(s > 1, 0),
+        lambda s: ta.EXIST(s > 1, 5),
+    ],
+)
+def test_empty(func):
+    result = func(pd.Series([], dtype=float))
+    assert isinstance(result, pd.Series) and result.shape[0] == 0
+
+
+PANEL = gen_panel(300, 40)
+# 面板模式的函数及对应的单只股票计算，None为与面板相同
+PANEL_CASES = {
+    "SMA(C,20)": (lambda c: ta.SMA(c, 20), lambda s: sma_talib(s, 20)),
+    "REF(C,5)": (lambda c: ta.REF(c, 5), None),
+    "HHV(C,20)": (lambda c: ta.HHV(c, 20), None),
+    "LLV(C,0)": (lambda c: ta.LLV(c, 0), None),
+    "CROSS(C,MA)": (
+        lambda c: ta.CROSS(c, ta.SMA(c, 20)),
+        lambda s: ta.CROSS(s, pd.Series(sma_talib(s, 20), index=s.index)),
+    ),
+    "COUNT(C>REF(C,1),10)": (lambda c: ta.COUNT(c > ta.REF(c, 1), 10), None),
+    "BARSLAST(C>=REF(C,1)*1.1)": (
+        lambda c: ta.BARSLAST(c >= ta.REF(c, 1) * 1.1),
+        None,
+    ),
+}
+
+
+@pytest.mark.parametrize("name", list(PANEL_CASES))
+def test_panel_matches_columns(name):
+    func, single = PANEL_CASES[name]
+    single = func if single is None else single
+    result = func(PANEL)
+    assert isinstance(result, pd.DataFrame) and result.index.equals(PANEL.index)
+    for c in PANEL.columns:
+        expect = np.asarray(single(PANEL[c]), dtype=float)
+        actual = result[c].to_numpy(dtype=float)
+        assert np.array_equal(actual, expect, equal_nan=True), c
+    # numpy数组与DataFrame结果一致
+    array = func(PANEL.to_numpy())
+    assert np.array_equal(
+        np.asarray(array, dtype=float), result.to_numpy(dtype=float), equal_nan=True
+    )
+
+
+def test_ma_panel_is_last_sma():
+    ma = ta.MA(PANEL, 20)
+    assert np.array_equal(
+        ma.to_numpy(), ta.SMA(PANEL, 20).iloc[-1].to_numpy(), equal_nan=True
+    )
@@ -0,0 +1,81 @@
+"""
+增量指标与tdx_ta_func对全部历史重新计算一致：序列和面板，中途保存并恢复状态后继续追加
+"""
+
+import numpy as np
+import pytest
+
+import tdx_ta_func as ta
+import tdx_ta_stream as stream
+from testdata import gen_panel, sma_talib, ta_cases
+
+N = 20
+
+
+def indicators():
+    return {
+        "SMA": stream.SMA(N),
+        "HHV": stream.HHV(N),
+        "LLV": stream.LLV(N),
+        "LLV0": stream.LLV(0),
+        "COUNT": stream.COUNT(N),
+        "BARSLAST": stream.BARSLAST(),
+        "BARSLASTCOUNT": stream.BARSLASTCOUNT(),
+    }
+
+
+def full(close):
+    """对全部历史重新计算"""
+    up = close > ta.REF(close, 1)
+    return {
+        # 单只股票用sma_talib代替talib.SMA
+        "SMA": ta.SMA(close, N) if close.ndim == 2 else sma_talib(close, N),
+        "HHV": ta.HHV(close, N),
+        "LLV": ta.LLV(close, N),
+        "LLV0": ta.LLV(close, 0),
+        "COUNT": ta.COUNT(up, N),
+        "BARSLAST": ta.BARSLAST(up),
+        "BARSLASTCOUNT": ta.BARSLASTCOUNT(up),
+    }
+
+
+def inputs(close):
+    """各指标的输入序列：价格或上涨条件"""
+    up = np.zeros(close.shape, dtype=bool)
+    up[1:] = close[1:] > close[:-1]
+    return {
+        name: close if name in ("SMA", "HHV", "LLV", "LLV0") else up
+        for name in indicators()
+    }
+
+
+CASES = [(name, price) for name, price, _ in ta_cases(600)]
+CASES.append(("面板", gen_panel(300, 50)))
+
+
+@pytest.mark.parametrize("name, price", CASES, ids=[name for name, _ in CASES])
+def test_stream_matches_full(tmp_path, name, price):
+    path = str(tmp_path / "state.json")
+    close = price.to_numpy(dtype=float)
+    expect = full(price)
+    # 包括在HHV/LLV的块中间保存状态
+    splits = {0, min(N + 7, close.shape[0]), close.shape[0] // 2, close.shape[0] - 1}
+    for split in sorted(splits):
+        items = indicators()
+        head = {
+            key: item.extend(inputs(close)[key][:split]) for key, item in items.items()
+        }
+        stream.save({"market": items}, path)
+        items = stream.load(path)["market"]
+        for key, item in items.items():
+            tail = [item.update(v) for v in inputs(close)[key][split:]]
+            actual = np.concatenate(
+                [head[key].reshape((-1,) + close.shape[1:]), np.array(tail)]
+            ).astype(float)
+            assert np.array_equal(
+                actual, np.asarray(expect[key], dtype=float), equal_nan=True
+            ), (key, split)
+
+
+def test_load_missing(tmp_path):
+    assert stream.load(str(tmp_path / "state.json")) == dict()
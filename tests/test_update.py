@@ -0,0 +1,82 @@
+"""
+update.update_tdx_lday：多进程与单进程转换结果一致，单只失败不影响其他股票，水位线合并保存，再次执行不重复转换
+"""
+
+import os
+
+import pytest
+
+import config as cfg
+import gbbq_store
+import tdx_data_func
+import update
+from testdata import gen_gbbq, gen_lday
+
+SZ = [f"sz{code}.day" for code in ["000001", "000002", "300001"]]
+SH = [f"sh{code}.day" for code in ["600000", "688001"]]
+INDEX = ["sh000001.day", "sz399001.day", "sh000300.day"]
+
+
+@pytest.fixture
+def tdx(paths, tmp_path, monkeypatch):
+    """
+    通达信日线目录：深市、沪市股票和指数，其中sz000099.day无法读取（为目录），指数sh000300.day缺失
+    """
+    sz, sh = str(tmp_path / "sz"), str(tmp_path / "sh")
+    for p in [sz, sh, paths.tdx_lday_bin, paths.tdx_index]:
+        os.makedirs(p)
+    for i, name in enumerate(SZ + SH + INDEX[:2]):
+        gen_lday((sz if name.startswith("sz") else sh) + os.sep + name, 300, seed=i)
+    # 不转换的代码（B股）
+    gen_lday(sz + os.sep + "sz200001.day", 300)
+    os.mkdir(sz + os.sep + "sz000099.day")
+    monkeypatch.setattr(cfg.TdxCfg, "ori_lday_sz", sz)
+    monkeypatch.setattr(cfg.TdxCfg, "ori_lday_sh", sh)
+    monkeypatch.setattr(cfg, "index_list", INDEX)
+    df = gen_gbbq([name[2:-4] for name in SZ + SH]).drop(columns=["date"])
+    df["类别"] = df["类别"].map({"除权除息": 1, "股本变化": 5})
+    gbbq_store.save(gbbq_store.to_records(df))
+    return paths
+
+
+def outputs(paths):
+    """日线、指数目录及其水位线文件的内容 {路径: bytes}"""
+    result = dict()
+    for root in [paths.tdx_lday_bin, paths.tdx_index]:
+        for name in sorted(os.listdir(root)):
+            with open(root + os.sep + name, "rb") as f:
+                result[root + os.sep + name] = f.read()
+        with open(tdx_data_func.watermark_path(root), "rb") as f:
+            result[tdx_data_func.watermark_path(root)] = f.read()
+    return result
+
+
+def clear(paths):
+    for root in [paths.tdx_lday_bin, paths.tdx_index]:
+        for name in os.listdir(root):
+            os.remove(root + os.sep + name)
+        os.remove(tdx_data_func.watermark_path(root))
+
+
+def test_update_tdx_lday(tdx):
+    assert update.update_tdx_lday(workers=1) == ["000099", "000300"]
+    serial = outputs(tdx)
+    stocks = sorted(os.listdir(tdx.tdx_lday_bin))
+    assert stocks == sorted(name[2:-4] + ".bin" for name in SZ + SH)
+    assert sorted(os.listdir(tdx.tdx_index)) == ["000001.csv", "399001.csv"]
+
+    # 水位线：成功的股票和指数为源文件的末尾，失败的没有水位线
+    for root, names in [(tdx.tdx_lday_bin, SZ + SH), (tdx.tdx_index, INDEX[:2])]:
+        watermark = tdx_data_func.load_watermark(root)
+        assert sorted(watermark) == sorted(name[2:-4] for name in names)
+        for name in names:
+            src = cfg.TdxCfg.ori_lday_sz if name[:2] == "sz" else cfg.TdxCfg.ori_lday_sh
+            assert watermark[name[2:-4]][1] == os.path.getsize(src + os.sep + name)
+
+    clear(tdx)
+    assert update.update_tdx_lday(workers=2) == ["000099", "000300"]
+    assert outputs(tdx) == serial
+
+    # 再次执行：没有新增记录，输出和水位线不变
+    assert update.update_tdx_lday(workers=2) == ["000099", "000300"]
+    assert outputs(tdx) == serial
@@ -0,0 +1,113 @@
+"""
+周期K线：每日增量更新与全量合成一致，与按复权后日线resample一致，day2period不修改传入的DataFrame
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lday_store
+import load_data
+import xline
+from testdata import gen_store
+
+CODES = [f"{i:06d}" for i in range(10)]
+SAMPLES = {"week": "W", "month": "ME", "quarter": "QE", "year": "YE"}
+
+
+@pytest.fixture
+def store(paths):
+    gen_store(CODES, rows=1000, short=True)
+    return paths
+
+
+def resample(df, sample):
+    """按pandas resample合成周期K线"""
+    return (
+        df.set_index("date", drop=False)
+        .resample(sample)
+        .agg(
+            {
+                "date": "last",
+                "open": "first",
+                "high": "max",
+                "low": "min",
+                "close": "last",
+                "vol": "sum",
+                "amount": "sum",
+            }
+        )
+        .dropna()
+        .reset_index(drop=True)
+    )
+
+
+def test_incremental(store, tmp_path):
+    full_root = str(tmp_path / "period_full")
+    assert xline.update_period_stores(root=full_root, full=True) == len(CODES)
+
+    # 截去最后几天后合成，再逐日追加并增量更新，结果与全量合成一致
+    days = 5
+    records = {code: np.array(lday_store.memmap(code)) for code in CODES}
+    for code in CODES:
+        lday_store.save_records(code, records[code][:-days])
+    xline.update_period_stores()
+    for day in range(days, 0, -1):
+        for code in CODES:
+            lday_store.append_records(code, records[code][-day:][:1])
+        assert xline.update_period_stores() == len(CODES)
+    assert xline.update_period_stores() == 0
+    for period in xline.PERIODS:
+        for code in CODES:
+            a = lday_store.memmap(code, xline.period_root(period))
+            b = lday_store.memmap(code, xline.period_root(period, full_root))
+            assert a.tobytes() == b.tobytes(), (period, code)
+
+
+@pytest.mark.parametrize("adjust", ["qfq", "hfq", "none"])
+def test_load_line_period(store, adjust):
+    xline.update_period_stores()
+    # 前复权和后复权只在四舍五入临界值相差1分
+    tolerance = 0 if adjust == "none" else 0.0101
+    for code in CODES[:3]:
+        df = load_data.load_line_day(code, adjust)
+        for period, sample in SAMPLES.items():
+            expect = resample(df, sample)
+            actual = load_data.load_line_period(code, period, adjust)
+            for name in ["date", "vol", "amount"]:
+                assert (actual[name] == expect[name]).all(), (code, period, name)
+            for name in ["open", "high", "low", "close"]:
+                diff = np.abs(actual[name] - expect[name])
+                assert (diff <= tolerance).all(), (code, period, name)
+
+
+@pytest.mark.parametrize("period", list(SAMPLES))
+def test_day2period(store, period):
+    sample = SAMPLES[period]
+    df = load_data.load_line_day(CODES[1], "none")
+    expect = resample(df, sample)
+    result = xline.day2period(df, "Y" if sample == "YE" else sample)
+    # 不修改传入的DataFrame
+    assert df.index.equals(pd.RangeIndex(df.shape[0]))
+    assert result.index.equals(pd.DatetimeIndex(expect["date"], name="date"))
+    for name in ["open", "high", "low", "close", "vol", "amount"]:
+        assert (result[name].to_numpy() == expect[name].to_numpy()).all(), name
+
+
+def test_day2period_labels():
+    # 2001年2月整月停牌：月线的日期为各月最后一个交易日，2月不输出
+    dates = pd.bdate_range("2001-01-01", "2001-03-31")
+    dates = dates[dates.month != 2][:-3]
+    df = pd.DataFrame({"date": dates.strftime("%Y-%m-%d")})
+    for name in ["open", "close", "high", "low"]:
+        df[name] = np.arange(dates.shape[0], dtype=float)
+    result = xline.day2period(df, "ME")
+    expect = pd.DatetimeIndex(["2001-01-31", "2001-03-27"], name="date")
+    assert result.index.equals(expect)
+    assert result["close"].tolist() == [22.0, 41.0]
+    assert (
+        result.index.to_period("M")
+        .to_timestamp(how="end")
+        .normalize()
+        .equals(pd.DatetimeIndex(["2001-01-31", "2001-03-31"], name="date"))
+    )
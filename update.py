@@ -3,14 +3,12 @@
 python update.py
 """
 
-import io
 import os
 import sys
 import time
-import hashlib
-import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-import akshare as ak
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
@@ -18,6 +16,9 @@ import config as cfg
 import log
 import tdx_data_func
 import load_data
+import lday_store
+import cw_store
+import xline
 
 
 def update_a_shares():
@@ -25,6 +26,9 @@ def update_a_shares():
     更新A股全部股票代码-股票名称
     网络原因，接口可能不稳定，报错时重试几次
     """
+    # akshare导入耗时较长，只在更新股票代码时导入
+    import akshare as ak
+
     start = time.time()
     log.i("更新A股全部股票代码-股票名称:start")
 
@@ -32,11 +36,8 @@ def update_a_shares():
     df.set_index("code", drop=True, inplace=True)
     # 加上上市日期
     lt = []
-    for filename in tqdm(
-        os.listdir(cfg.ProcessedDataPath.tdx_lday_qfq), desc="query ipo date"
-    ):
-        code = filename[:-4]
-        df_lday = load_data.load_line_day(code)
+    for code in tqdm(lday_store.codes(), desc="query ipo date"):
+        df_lday = load_data.load_line_day(code, adjust="none")
         if df_lday.empty:
             continue
         lt.append({"code": code, "listing_date": df_lday.loc[0, "date"]})
@@ -61,37 +62,13 @@ def update_tdx_cw():
     """
     start = time.time()
     log.i("更新通达信财务数据:start")
-    _, text = tdx_data_func.download(cfg.TdxCfg.gpcw_url)
-    data = [l.strip().split(",") for l in text.strip().split("\r\n")]
-    df_check_sum = pd.DataFrame(data, columns=["filename", "md5", "filesize"])
-    list_md5 = df_check_sum["md5"].to_list()
-
-    ori_files = [name for name in os.listdir(cfg.TdxCfg.ori_cw) if name[-3:] == "zip"]
-    list_not_exist = []
-    list_not_equal = []
-    download_task = []
-
-    # 计算需要下载的zip文件
-    for index, filename in enumerate(df_check_sum["filename"].to_list()):
-        path = cfg.TdxCfg.ori_cw + os.sep + filename
-        if filename in ori_files:
-            md5 = hashlib.md5(open(path, "rb").read()).hexdigest()
-            if md5 != list_md5[index]:
-                download_task.append(filename)
-                list_not_equal.append(filename)
-        else:
-            download_task.append(filename)
-            list_not_exist.append(filename)
-
-    # 1 downaload zip 2 extract zip
-    for filename in tqdm(download_task, desc="download task:"):
-        content, _ = tdx_data_func.download(cfg.TdxCfg.zip_url + filename)
-        # extract
-        with zipfile.ZipFile(io.BytesIO(content)) as f:
-            f.extractall(cfg.TdxCfg.ori_cw)
-
-        with open(cfg.TdxCfg.ori_cw + os.sep + filename, "wb") as f:
-            f.write(content)
+    # 并发下载缺失或不一致的zip并解压
+    list_not_exist, list_not_equal, failed = tdx_data_func.sync_cw()
+    if failed:
+        log.e(f"财务数据下载失败{len(failed)}份: {failed}")
+    download_task = [
+        name for name in list_not_exist + list_not_equal if name not in failed
+    ]
 
     # make sure all zip had been extracted
     zip_files = [
@@ -100,30 +77,52 @@ def update_tdx_cw():
     dat_files = [
         name[:-4] for name in os.listdir(cfg.TdxCfg.ori_cw) if name[-3:] == "dat"
     ]
-    for filename in tqdm(set(zip_files).difference(set(dat_files)), desc="extract:"):
-        with zipfile.ZipFile(
-            cfg.TdxCfg.ori_cw + os.sep + filename + ".zip", "r"
-        ) as file:
-            file.extractall(cfg.TdxCfg.ori_cw)
-    # convert  all to pkl
-    pkl_files = [name[:-4] for name in os.listdir(cfg.ProcessedDataPath.tdx_cw)]
-    for filename in tqdm(
-        set(zip_files).difference(set(pkl_files)), desc="convert to pkl:"
-    ):
-        ori_dat_path = cfg.TdxCfg.ori_cw + os.sep + filename + ".dat"
-        dst_pkl_path = cfg.ProcessedDataPath.tdx_cw + os.sep + filename + ".pkl"
-        df = tdx_data_func.load_cw_dat(ori_dat_path)
-        df.to_pickle(dst_pkl_path, compression=None)
+    missing = sorted(set(zip_files).difference(set(dat_files)))
+    with ThreadPoolExecutor(max_workers=cfg.download_workers) as executor:
+        list(
+            executor.map(
+                lambda name: tdx_data_func.extract_zip(
+                    cfg.TdxCfg.ori_cw + os.sep + name + ".zip", cfg.TdxCfg.ori_cw
+                ),
+                missing,
+            )
+        )
+    # 新增或重新下载的报告期写入财务数据立方体
+    saved = set(cw_store.reports())
+    cw_files = [
+        name
+        for name in sorted(os.listdir(cfg.TdxCfg.ori_cw))
+        if name[-3:] == "dat"
+        and os.path.getsize(cfg.TdxCfg.ori_cw + os.sep + name) > 0
+        and (int(name[4:-4]) not in saved or name[:-4] + ".zip" in download_task)
+    ]
+    if cw_files:
+        # 先汇总全部股票和字段数，立方体最多重建一次
+        headers = [
+            tdx_data_func.load_cw_header(cfg.TdxCfg.ori_cw + os.sep + name)
+            for name in cw_files
+        ]
+        cw_store.reserve(
+            np.concatenate([codes for _, codes, _ in headers]),
+            max(fields for _, _, fields in headers),
+        )
+    for name in tqdm(cw_files, desc="convert to cube:"):
+        with open(cfg.TdxCfg.ori_cw + os.sep + name, "rb") as f:
+            date, codes, data = tdx_data_func.parse_cw_dat(f.read())
+        cw_store.put(date, codes, data)
 
     log.i(
         f"更新通达信财务数据:start,共{len(list_not_equal)+len(list_not_exist)}份，其中not exist:{list_not_exist}, not equal:{list_not_equal} 用时{(time.time() - start):.2f}秒"
     )
 
 
-def update_tdx_lday():
+def update_tdx_lday(workers=None):
     """
-    在通达信软件下载日线数据后，转换为csv格式
-    并根据股本变迁数据进行前复权处理
+    在通达信软件下载日线数据后，股票转换为不复权二进制日线，指数转换为csv格式
+    各股票相互独立，可使用多进程并行
+    最后根据股本变迁数据重新计算复权因子表，新的除权除息只需更新复权因子表，再增量合成周期K线
+    :param workers: int 进程数，默认cfg.workers，为1时在当前进程顺序执行
+    :return list 转换失败的股票（指数）代码，其余股票照常转换，失败的水位线不变
     """
     start = time.time()
     log.i("更新通达信日线数据:start")
@@ -150,52 +149,93 @@ def update_tdx_lday():
         df_shares[0].str.startswith("8") | df_shares[0].str.startswith("43")
     ]
     """
-    dst = cfg.ProcessedDataPath.tdx_lday_qfq
+    workers = cfg.workers if workers is None else workers
+    dst = cfg.ProcessedDataPath.tdx_lday_bin
+    # 水位线：记录每只股票已转换到源文件的位置，只转换新增的记录
+    watermarks = {
+        dst: tdx_data_func.load_watermark(dst),
+        cfg.ProcessedDataPath.tdx_index: tdx_data_func.load_watermark(
+            cfg.ProcessedDataPath.tdx_index
+        ),
+    }
 
-    log.i("导出深市日线")
+    # 任务：(转换函数, 源目录, 目标目录, 文件名)
+    # 股票保存为不复权二进制日线，读取时按复权因子表复权
+    tasks = []
     names = [
         name
         for name in os.listdir(cfg.TdxCfg.ori_lday_sz)
         if name[2:4] == "00" or name[2:4] == "30"
     ]
-    names.sort()
-    for name in tqdm(names, desc="sz lday:"):
-        tdx_data_func.lday_to_csv(src=cfg.TdxCfg.ori_lday_sz, dst=dst, file_name=name)
-
-    log.i("导出沪市日线")
+    tasks += [
+        (tdx_data_func.lday_to_store, cfg.TdxCfg.ori_lday_sz, dst, name)
+        for name in sorted(names)
+    ]
     names = [
         name
         for name in os.listdir(cfg.TdxCfg.ori_lday_sh)
         if name[2:4] == "60" or name[2:4] == "68"
     ]
-    names.sort()
-    for name in tqdm(names, desc="sh lday"):
-        tdx_data_func.lday_to_csv(src=cfg.TdxCfg.ori_lday_sh, dst=dst, file_name=name)
-
-    log.i("导出指数")
-    for name in tqdm(cfg.index_list, desc="index lday"):
+    tasks += [
+        (tdx_data_func.lday_to_store, cfg.TdxCfg.ori_lday_sh, dst, name)
+        for name in sorted(names)
+    ]
+    # 指数只转换为csv
+    for name in cfg.index_list:
         if name.startswith("sh"):
-            tdx_data_func.lday_to_csv(
-                src=cfg.TdxCfg.ori_lday_sh,
-                dst=cfg.ProcessedDataPath.tdx_index,
-                file_name=name,
-            )
+            src = cfg.TdxCfg.ori_lday_sh
         elif name.startswith("sz"):
-            tdx_data_func.lday_to_csv(
-                src=cfg.TdxCfg.ori_lday_sz,
-                dst=cfg.ProcessedDataPath.tdx_index,
-                file_name=name,
+            src = cfg.TdxCfg.ori_lday_sz
+        else:
+            continue
+        tasks.append(
+            (tdx_data_func.lday_to_csv, src, cfg.ProcessedDataPath.tdx_index, name)
+        )
+
+    args = [[task[i] for task in tasks] for i in range(4)]
+    args.append([watermarks[task[2]].get(task[3][2:-4]) for task in tasks])
+    log.i(f"导出日线,共{len(tasks)}只,进程数{workers}")
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map按提交顺序返回结果，合并水位线的顺序与进程调度无关
+            results = list(
+                tqdm(
+                    executor.map(tdx_data_func.lday_task, *args, chunksize=8),
+                    total=len(tasks),
+                    desc="lday:",
+                )
             )
+    else:
+        results = [
+            tdx_data_func.lday_task(*arg)
+            for arg in tqdm(list(zip(*args)), desc="lday:")
+        ]
+
+    failed = []
+    for task, (code, mark, error) in zip(tasks, results):
+        if mark is not None:
+            watermarks[task[2]][code] = mark
+        if error is not None:
+            failed.append(code)
+            print(f"{code} 日线更新失败:\n{error}")
+    for path, watermark in watermarks.items():
+        tdx_data_func.save_watermark(path, watermark)
+    if failed:
+        log.e(f"日线更新失败{len(failed)}只: {failed}")
+
+    # 除权除息只影响复权因子表，不需要重写日线
+    log.i("计算复权因子")
+    df_xrxd = tdx_data_func.group_xrxd(load_data.load_gbbq())
+    lday_store.save_factors(tdx_data_func.calc_factors(df_xrxd, dst))
+
+    # 周线、月线等只需重新合成新增日线所在的周期
+    log.i("合成周期K线")
+    count = xline.update_period_stores(lday_path=dst)
+    log.i(f"合成周期K线{count}只")
 
     # 暂时忽略北交所
     log.i(f"更新通达信日线数据:end,用时{(time.time() - start):.2f}秒")
-
-    # 更新日线数据之后进行前复权
-    start = time.time()
-    log.i("前复权:start")
-    df_gbbq = load_data.load_gbbq()
-    tdx_data_func.backward_adjust(cfg.ProcessedDataPath.tdx_lday_qfq, df_gbbq=df_gbbq)
-    log.i(f"前复权:end,用时{(time.time() - start):.2f}秒")
+    return failed
 
 
 if __name__ == "__main__":
@@ -1,21 +1,116 @@
 """
-股价日线、年线等之间的转换
+股价日线、周线、月线、季线、年线等之间的转换
+aggregate对按日期排序的定长记录向量化合成周期K线，多只股票的日线首尾相接时一次合成全市场
+
+全市场的周期K线保存为与日线相同格式的二进制存储（见lday_store），目录为cfg.ProcessedDataPath.tdx_lday_period下的周期名
+价格为未取整的后复权价格，后复权价格不受之后的除权除息影响，每天只需重新合成最后一个（未结束的）周期
+读取时前复权价格 = 后复权价格 * 全部复权因子的连乘，见load
+
+python xline.py 全量重建周期K线
 """
 
+import os
+import zlib
+
+import numpy as np
 import pandas as pd
 
+import config as cfg
+import lday_store
+
+# 支持的周期，计算方式见period_keys
+PERIODS = ["week", "month", "quarter", "year"]
+
+# 重建时每批合成的股票数，控制内存占用
+CHUNK = 500
+
+
+def period_keys(days, period):
+    """
+    日期所属周期的序号，同一周期的日期序号相同，序号随日期递增
+    :param days: np.ndarray 自1970-01-01起的天数
+    :param period: str week month quarter year
+    :return np.ndarray int64
+    """
+    days = np.asarray(days, dtype=np.int64)
+    if period == "week":
+        # 1970-01-01为星期四，周一为一周的开始
+        return (days + 3) // 7
+    month = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    if period == "month":
+        return month
+    if period == "quarter":
+        return month // 3
+    if period == "year":
+        return month // 12
+    raise ValueError("不支持的周期: " + period)
 
-def day2period(df=pd.DataFrame, sample="d"):
-    df.index = pd.to_datetime(df["date"], format="%Y-%m-%d")
 
-    to_df = pd.DataFrame()
-    to_df["open"] = df["open"].resample(sample).first()
-    to_df["close"] = df["close"].resample(sample).last()
-    to_df["high"] = df["high"].resample(sample).max()
-    to_df["low"] = df["low"].resample(sample).min()
-    # to_df.reset_index(drop=True, inplace=True)
+def aggregate(records, period, starts=None):
+    """
+    日线合成周期K线
+    开盘价为周期内第一天的开盘价，收盘价、日期、复权因子为最后一天的值，
+    最高价、最低价为周期内的最高、最低，成交量、成交金额为周期内的合计
+    :param records: np.ndarray 按日期升序的日线定长记录，多只股票首尾相接时由starts指定各股票的起始行
+    :param period: str week month quarter year
+    :param starts: np.ndarray 各股票在records中的起始行，为None时为单只股票
+    :return (np.ndarray 周期K线定长记录, np.ndarray 各周期在records中的起始行)
+    """
+    rows = records.shape[0]
+    if rows == 0:
+        return np.empty(0, dtype=lday_store.DTYPE), np.empty(0, dtype=np.int64)
+    key = period_keys(records["date"], period)
+    new = np.empty(rows, dtype=bool)
+    new[0] = True
+    np.not_equal(key[1:], key[:-1], out=new[1:])
+    if starts is not None:
+        new[starts[starts < rows]] = True
+    first = np.flatnonzero(new)
+    last = np.r_[first[1:] - 1, rows - 1]
 
-    df.reset_index(drop=True, inplace=True)
+    bars = np.empty(first.shape[0], dtype=lday_store.DTYPE)
+    for name in ["date", "close", "adj"]:
+        bars[name] = records[name][last]
+    bars["open"] = records["open"][first]
+    bars["high"] = np.maximum.reduceat(records["high"], first)
+    bars["low"] = np.minimum.reduceat(records["low"], first)
+    bars["vol"] = np.add.reduceat(records["vol"], first)
+    bars["amount"] = np.add.reduceat(records["amount"], first)
+    return bars, first
+
+
+def day2period(df=pd.DataFrame, sample="d"):
+    """
+    单只股票的日线DataFrame合成周期K线，不修改传入的DataFrame
+    与pandas resample的区别：index为周期内最后一个交易日，而不是周期的结束日（周日、月末等）；
+    没有交易日的周期（如整月停牌）不输出，resample会输出全为nan的一行。
+    与周期K线存储（load_data.load_line_period）的日期一致，按周期结束日对齐时用
+    index.to_period(...).to_timestamp(how="end")转换
+    :param sample: str W周 ME月 QE季 Y年，d为不合成
+    :return DataFrame index为周期内最后一个交易日，columns: open close high low，日线有vol amount时包括其合计
+    """
+    df = df.reset_index(drop=True)
+    if sample != "d" and df.shape[0]:
+        period = {"W": "week", "ME": "month", "QE": "quarter", "Y": "year"}[sample]
+        key = period_keys(lday_store.to_days(df["date"]), period)
+        first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        last = np.r_[first[1:] - 1, df.shape[0] - 1]
+        to_df = pd.DataFrame(
+            {
+                "open": df["open"].to_numpy()[first],
+                "close": df["close"].to_numpy()[last],
+                "high": np.maximum.reduceat(df["high"].to_numpy(), first),
+                "low": np.minimum.reduceat(df["low"].to_numpy(), first),
+            }
+        )
+        for name in ["vol", "amount"]:
+            if name in df.columns:
+                to_df[name] = np.add.reduceat(df[name].to_numpy(), first)
+        to_df.index = pd.DatetimeIndex(pd.to_datetime(df["date"]).to_numpy()[last])
+    else:
+        to_df = df[["open", "close", "high", "low"]].copy()
+        to_df.index = pd.DatetimeIndex(pd.to_datetime(df["date"]))
+    to_df.index.name = "date"
     return to_df
 
 
@@ -27,5 +122,162 @@ def day2month(df=pd.DataFrame):
     return day2period(df, sample="ME")
 
 
+def day2quarter(df=pd.DataFrame):
+    return day2period(df, sample="QE")
+
+
 def day2year(df=pd.DataFrame):
     return day2period(df, sample="Y")
+
+
+def period_root(period, root=None):
+    """周期K线存储目录"""
+    root = cfg.ProcessedDataPath.tdx_lday_period if root is None else root
+    return root + os.sep + period
+
+
+def _watermark_path(root):
+    return root + os.sep + "watermark.csv"
+
+
+def load_watermark(root=None):
+    """
+    周期K线的水位线
+    :return dict {code: (已合成的日线条数, 复权因子的crc32, 最后一条已合成日线的日期)}
+    """
+    root = cfg.ProcessedDataPath.tdx_lday_period if root is None else root
+    path = _watermark_path(root)
+    if not os.path.isfile(path):
+        return dict()
+    df = pd.read_csv(path, encoding="utf-8", dtype={"code": str})
+    return {
+        code: (int(bars), int(crc), int(date))
+        for code, bars, crc, date in zip(df["code"], df["bars"], df["crc"], df["date"])
+    }
+
+
+def save_watermark(watermark, root=None):
+    root = cfg.ProcessedDataPath.tdx_lday_period if root is None else root
+    path = _watermark_path(root)
+    df = pd.DataFrame(
+        [(code, *mark) for code, mark in sorted(watermark.items())],
+        columns=["code", "bars", "crc", "date"],
+    )
+    df.to_csv(path + ".tmp", encoding="utf-8", index=False)
+    os.replace(path + ".tmp", path)
+
+
+def _write_tail(code, keep, bars, root):
+    """
+    保留周期K线文件的前keep条，之后替换为bars
+    keep为0时整体覆盖写入
+    """
+    if keep == 0:
+        lday_store.save_records(code, bars, root)
+        return
+    with open(lday_store.path_of(code, root), "r+b") as f:
+        f.truncate(keep * lday_store.DTYPE.itemsize)
+        f.seek(0, os.SEEK_END)
+        bars.tofile(f)
+
+
+def update_period_stores(codes=None, lday_path=None, root=None, full=False):
+    """
+    由不复权日线和复权因子表增量更新全部周期的K线存储
+    水位线记录每只股票已合成的日线条数、复权因子的crc32和最后一条日线的日期：
+    日线增加时只重新合成各周期的最后一个周期；复权因子变化、日线被截断或改写时重新合成该股票
+    需要合成的日线按CHUNK只股票首尾相接，每个周期一次合成
+    :param codes: list 股票代码，默认为全部日线
+    :param lday_path: str 不复权日线目录
+    :param root: str 周期K线目录
+    :param full: bool 全量重建
+    :return int 更新的股票数
+    """
+    lday_path = cfg.ProcessedDataPath.tdx_lday_bin if lday_path is None else lday_path
+    root = cfg.ProcessedDataPath.tdx_lday_period if root is None else root
+    codes = lday_store.codes(lday_path) if codes is None else codes
+    for period in PERIODS:
+        os.makedirs(period_root(period, root), exist_ok=True)
+    watermark = dict() if full else load_watermark(root)
+
+    # 每只股票需要合成的日线：(code, 日线, 复权因子, 复权因子crc, 上次已合成的日线条数)
+    tasks = []
+    for code in codes:
+        records = lday_store.memmap(code, lday_path)
+        if records is None or records.shape[0] == 0:
+            continue
+        factors = lday_store.factors_of(code)
+        crc = zlib.crc32(factors.tobytes())
+        bars, old_crc, date = watermark.get(code, (0, None, None))
+        if (
+            old_crc != crc
+            or bars > records.shape[0]
+            or (bars and records["date"][bars - 1] != date)
+        ):
+            bars = 0
+        if bars == records.shape[0]:
+            continue
+        tasks.append((code, records, factors, crc, bars))
+
+    for i in range(0, len(tasks), CHUNK):
+        chunk = tasks[i : i + CHUNK]
+        for period in PERIODS:
+            path = period_root(period, root)
+            parts, keeps = [], []
+            for code, records, factors, crc, bars in chunk:
+                # 从已保存的最后一个周期的第一天开始重新合成，之前的周期不变
+                begin, keep = 0, 0
+                stored = lday_store.memmap(code, path) if bars else None
+                if stored is not None and stored.shape[0]:
+                    last = period_keys(stored["date"][-1:], period)[0]
+                    begin = int(
+                        np.searchsorted(period_keys(records["date"], period), last)
+                    )
+                    keep = stored.shape[0] - 1
+                # 写入前释放映射，截断文件后不再访问
+                del stored
+                parts.append(
+                    lday_store.adjust(records[begin:], factors, "hfq", decimals=None)
+                )
+                keeps.append(keep)
+            sizes = np.array([part.shape[0] for part in parts])
+            starts = np.r_[0, np.cumsum(sizes)[:-1]]
+            merged, first = aggregate(np.concatenate(parts), period, starts)
+            # 各股票的周期K线在merged中的范围
+            bounds = np.searchsorted(first, np.r_[starts, sizes.sum()])
+            for j, (code, *_) in enumerate(chunk):
+                _write_tail(code, keeps[j], merged[bounds[j] : bounds[j + 1]], path)
+        for code, records, _, crc, _ in chunk:
+            watermark[code] = (records.shape[0], crc, int(records["date"][-1]))
+    save_watermark(watermark, root)
+    return len(tasks)
+
+
+def load(code, period="month", adjust="qfq", root=None):
+    """
+    读取某股票的周期K线
+    :param period: str week month quarter year
+    :param adjust: str qfq前复权，hfq后复权，none不复权（由不复权日线即时合成）
+    :return np.ndarray 定长记录，价格保留两位小数，文件不存在返回None
+    """
+    if adjust == "none":
+        records = lday_store.memmap(code)
+        return None if records is None else aggregate(records, period)[0]
+    records = lday_store.memmap(code, period_root(period, root))
+    if records is None:
+        return None
+    records = np.array(records)
+    scale = 1.0
+    if adjust == "qfq":
+        factors = lday_store.factors_of(code)
+        scale = factors["factor"][0] if factors.shape[0] else 1.0
+    elif adjust != "hfq":
+        raise ValueError("不支持的复权方式: " + adjust)
+    for name in ["open", "high", "low", "close"]:
+        records[name] = np.round(records[name] * scale, 2)
+    records["adj"] = records["adj"] * scale
+    return records
+
+
+if __name__ == "__main__":
+    update_period_stores(full=True)